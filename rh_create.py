@@ -18,16 +18,20 @@ import argparse
 import json
 import os
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import unquote, urlparse
 
 
-CREATE_URL = "https://www.runninghub.ai/task/webapp/create"
-HISTORY_URL = "https://www.runninghub.ai/api/output/v2/history"
 ORIGIN = "https://www.runninghub.ai"
+CREATE_PATH = "/task/webapp/create"
+HISTORY_PATH = "/api/output/v2/history"
+CREATE_URL = ORIGIN + CREATE_PATH
+HISTORY_URL = ORIGIN + HISTORY_PATH
 
 
 def _redact(value: str, keep: int = 6) -> str:
@@ -95,6 +99,13 @@ def _parse_tokendump(path: str) -> TokenDump:
     data = record.get("data")
     if not isinstance(data, list):
         raise SystemExit("cookies.txt record missing 'data' array")
+    return _dump_from_record(host, record)
+
+
+def _dump_from_record(host: str, record: Dict[str, Any]) -> TokenDump:
+    data = record.get("data")
+    if not isinstance(data, list):
+        data = []
 
     cookies: Dict[str, str] = {}
     local_storage: Dict[str, str] = {}
@@ -132,21 +143,21 @@ def _extract_access_token(dump: TokenDump) -> str:
     return ""
 
 
-def _build_referer(payload: Dict[str, Any], override: str) -> str:
+def _build_referer(payload: Dict[str, Any], override: str, origin: str = ORIGIN) -> str:
     if override:
         return override
     webapp_id = payload.get("webappId")
     if isinstance(webapp_id, str) and webapp_id.strip():
-        return f"{ORIGIN}/ai-detail/{webapp_id.strip()}"
-    return f"{ORIGIN}/"
+        return f"{origin}/ai-detail/{webapp_id.strip()}"
+    return f"{origin}/"
 
 
-def _make_headers(payload: Dict[str, Any], token: str, referer: str) -> Dict[str, str]:
+def _make_headers(payload: Dict[str, Any], token: str, referer: str, origin: str = ORIGIN) -> Dict[str, str]:
     h = {
         "accept": "application/json, text/plain, */*",
         "accept-language": "zh-CN,zh;q=0.9",
         "content-type": "application/json",
-        "origin": ORIGIN,
+        "origin": origin,
         "referer": referer,
         # From fetch.txt; server may ignore but harmless.
         "user-language": "zh_CN",
@@ -249,18 +260,379 @@ def _install_cookies(session: Any, dump: TokenDump) -> None:
             pass
 
 
+# ---- batch mode ----
+
+
+@dataclass
+class BatchProfile:
+    name: str
+    dump: TokenDump
+    token: str
+
+
+@dataclass
+class BatchItem:
+    line: int
+    id: str
+    payload: Dict[str, Any]
+    # Pin to a profile by name ("" = any).
+    profile: str = ""
+
+
+def _parse_multicookies(path: str) -> List[BatchProfile]:
+    """
+    TokenMaster multi export: { "records": { host: [record, ...] } }, the bare
+    { host: [record, ...] } root, or a single-record cookies.txt.
+    """
+    root = _load_json_file(path)
+    if not isinstance(root, dict):
+        raise SystemExit(f"{path} must be a JSON object")
+
+    pairs: List[Tuple[str, Dict[str, Any]]] = []
+    if isinstance(root.get("record"), dict):
+        pairs.append((str(root.get("host") or root.get("hostname") or "www.runninghub.ai"), root["record"]))
+    groups = root.get("records") if isinstance(root.get("records"), dict) else root
+    for host, records in groups.items():
+        if isinstance(records, list):
+            pairs.extend((str(host), r) for r in records if isinstance(r, dict))
+
+    profiles: List[BatchProfile] = []
+    seen: Dict[str, int] = {}
+    for host, record in pairs:
+        dump = _dump_from_record(host, record)
+        token = _extract_access_token(dump)
+        name = str(record.get("name") or "").strip() or f"profile{len(profiles) + 1}"
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            name = f"{name}#{seen[name]}"
+        profiles.append(BatchProfile(name=name, dump=dump, token=token))
+    if not profiles:
+        raise SystemExit(f"{path}: no cookie records found")
+    return profiles
+
+
+def _load_batch(path: str) -> List[BatchItem]:
+    """
+    One JSON object per line: a create payload, or { "id"?, "payload": {...}, "profile"? }.
+    Blank lines and lines starting with '#' are skipped.
+    """
+    items: List[BatchItem] = []
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for n, line in enumerate(f, start=1):
+            text = line.strip()
+            if not text or text.startswith("#"):
+                continue
+            try:
+                obj = json.loads(text)
+            except json.JSONDecodeError as e:
+                raise SystemExit(f"{path}:{n}: invalid JSON: {e}") from e
+            if not isinstance(obj, dict):
+                raise SystemExit(f"{path}:{n}: expected a JSON object")
+            payload = obj.get("payload") if isinstance(obj.get("payload"), dict) else obj
+            item_id = str(obj.get("id") or obj.get("request_id") or f"line{n}")
+            items.append(BatchItem(line=n, id=item_id, payload=payload, profile=str(obj.get("profile") or "")))
+    return items
+
+
+class _HistoryPoller:
+    """
+    One thread polls history for every pending task: each round fetches the first pages
+    once per account and resolves all of that account's tasks from them, instead of one
+    poll loop per task.
+    """
+
+    def __init__(self, session_for: Any, url: str, origin: str, pages: int, size: int, interval: float, timeout: float) -> None:
+        self._session_for = session_for
+        self._url = url
+        self._origin = origin
+        self._pages = max(1, pages)
+        self._size = size
+        self._interval = interval
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        # task id -> [profile, referer, deadline, done event, result]
+        self._pending: Dict[str, List[Any]] = {}
+        # Set (under _lock) once the loop has ended; later waits return at once.
+        self._closed = False
+        self._stop = threading.Event()
+        self.calls = 0
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="history-poller")
+        self._thread.start()
+
+    def wait(self, profile: BatchProfile, referer: str, task_id: str) -> Tuple[Optional[Dict[str, Any]], str]:
+        """
+        Block until the task is complete in history (hit, status) or times out (None, last status).
+        """
+        done = threading.Event()
+        entry = [profile, referer, time.monotonic() + self._timeout, done, (None, "")]
+        with self._lock:
+            if self._closed:
+                return None, ""
+            self._pending[task_id] = entry
+        while not done.wait(1.0):
+            # The loop releases everyone when it ends; this only guards against a hard thread death.
+            if not self._thread.is_alive():
+                self._finish(task_id, (None, entry[4][1]))
+        return entry[4]
+
+    def close(self) -> None:
+        """
+        Stop polling; pending waits return (None, last status).
+        """
+        self._stop.set()
+        self._release_all()
+
+    def _release_all(self) -> None:
+        with self._lock:
+            self._closed = True
+            task_ids = list(self._pending)
+        for task_id in task_ids:
+            with self._lock:
+                entry = self._pending.get(task_id)
+            if entry is not None:
+                self._finish(task_id, (None, entry[4][1]))
+
+    def _loop(self) -> None:
+        try:
+            while not self._stop.wait(self._interval):
+                with self._lock:
+                    pending = dict(self._pending)
+                if not pending:
+                    continue
+                by_profile: Dict[str, List[str]] = {}
+                for task_id, entry in pending.items():
+                    by_profile.setdefault(entry[0].name, []).append(task_id)
+                for task_ids in by_profile.values():
+                    try:
+                        self._poll_profile(task_ids, pending)
+                    except Exception as e:
+                        # One account's bad round (session, headers, odd history shape) must
+                        # not end polling for everyone; its deadlines still apply next round.
+                        print(f"[rh_create] history poll failed: {e}")
+                        self._expire(task_ids, pending)
+        finally:
+            self._release_all()
+
+    def _poll_profile(self, task_ids: List[str], pending: Dict[str, List[Any]]) -> None:
+        profile, referer = pending[task_ids[0]][0], pending[task_ids[0]][1]
+        session = self._session_for(profile)
+        headers = _make_headers({}, profile.token, referer, self._origin)
+        left = set(task_ids)
+        for page in range(1, self._pages + 1):
+            try:
+                self.calls += 1
+                r = session.post(self._url, headers=headers, json=_make_history_body(self._size, page, ""), timeout=25)
+                h_json = r.json() if "application/json" in r.headers.get("content-type", "").lower() else None
+            except Exception:
+                continue
+            for task_id in list(left):
+                hit = _find_task_in_history(h_json, task_id)
+                if hit is None:
+                    continue
+                status = str(hit.get("taskStatus") or hit.get("status") or "")
+                pending[task_id][4] = (None, status)
+                if _is_task_complete(status):
+                    self._finish(task_id, (hit, status))
+                left.discard(task_id)
+            if not left:
+                break
+        self._expire(task_ids, pending)
+
+    def _expire(self, task_ids: List[str], pending: Dict[str, List[Any]]) -> None:
+        now = time.monotonic()
+        for task_id in task_ids:
+            entry = pending[task_id]
+            if now >= entry[2]:
+                self._finish(task_id, (None, entry[4][1]))
+
+    def _finish(self, task_id: str, result: Tuple[Optional[Dict[str, Any]], str]) -> None:
+        with self._lock:
+            entry = self._pending.pop(task_id, None)
+        if entry is not None:
+            entry[4] = result
+            entry[3].set()
+
+
+def _run_batch(args: argparse.Namespace, origin: str) -> int:
+    try:
+        import requests  # type: ignore
+    except Exception as e:
+        raise SystemExit("missing dependency: requests. Install with: pip install requests") from e
+
+    items = _load_batch(args.batch)
+    if args.multicookies:
+        profiles = _parse_multicookies(args.multicookies)
+    else:
+        dump = _parse_tokendump(args.cookies)
+        profiles = [BatchProfile(name="default", dump=dump, token=_extract_access_token(dump))]
+    for p in profiles:
+        if args.token.strip():
+            p.token = args.token.strip()
+        if args.no_auth:
+            p.token = ""
+    names = {p.name for p in profiles}
+    for it in items:
+        if it.profile and it.profile not in names:
+            raise SystemExit(f"{args.batch}:{it.line}: unknown profile {it.profile!r}")
+
+    per_profile = max(1, int(args.per_profile))
+    print(f"[rh_create] batch: {len(items)} payloads, {len(profiles)} profiles x {per_profile} slots, url={args.url}")
+    if args.dry_run:
+        print("[rh_create] dry-run: not sending requests")
+        return 0
+
+    local = threading.local()
+
+    def session_for(profile: BatchProfile) -> Any:
+        # requests.Session is not meant to be shared across threads: one per thread and profile.
+        sessions = getattr(local, "sessions", None)
+        if sessions is None:
+            sessions = local.sessions = {}
+        s = sessions.get(profile.name)
+        if s is None:
+            s = requests.Session()
+            _install_cookies(s, profile.dump)
+            sessions[profile.name] = s
+        return s
+
+    poller = _HistoryPoller(
+        session_for, args.history_url, origin, int(args.history_pages), int(args.history_size),
+        float(args.history_interval), float(args.history_timeout),
+    )
+    downloads = ThreadPoolExecutor(max_workers=max(1, int(args.download_workers)), thread_name_prefix="download")
+    out_dir = Path(args.download_dir)
+
+    # Pinned items go to their profile's queue; the rest are shared.
+    work_lock = threading.Lock()
+    shared: List[BatchItem] = [it for it in items if not it.profile]
+    pinned: Dict[str, List[BatchItem]] = {}
+    for it in items:
+        if it.profile:
+            pinned.setdefault(it.profile, []).append(it)
+    shared.reverse()
+    for q in pinned.values():
+        q.reverse()
+
+    results_lock = threading.Lock()
+    results_path = Path(args.results)
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    results_file = open(results_path, "w", encoding="utf-8")
+    summary: Dict[str, int] = {}
+
+    def emit(record: Dict[str, Any]) -> None:
+        with results_lock:
+            results_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            results_file.flush()
+            summary[record["status"]] = summary.get(record["status"], 0) + 1
+            print(f"[rh_create] {record['id']}: {record['status']}" + (f" ({record['error']})" if record.get("error") else ""))
+
+    def next_item(profile: BatchProfile) -> Optional[BatchItem]:
+        with work_lock:
+            own = pinned.get(profile.name)
+            if own:
+                return own.pop()
+            return shared.pop() if shared else None
+
+    def create(session: Any, item: BatchItem, profile: BatchProfile, referer: str) -> Any:
+        # 429: honor Retry-After a few times before giving up on the item.
+        for attempt in range(4):
+            resp = session.post(args.url, headers=_make_headers(item.payload, profile.token, referer, origin), json=item.payload, timeout=args.timeout)
+            if resp.status_code != 429 or attempt == 3:
+                resp.raise_for_status()
+                return resp.json()
+            time.sleep(float(resp.headers.get("retry-after") or 2 ** attempt))
+        return None
+
+    def download(record: Dict[str, Any], session_profile: BatchProfile, file_url: str, filename: str, started: float) -> None:
+        try:
+            path = _download_file(session_for(session_profile), file_url, out_dir, filename, bool(args.overwrite), float(args.timeout))
+            record["path"] = str(path)
+        except Exception as e:
+            record["status"] = "download_failed"
+            record["error"] = str(e)
+        record["seconds"] = round(time.monotonic() - started, 3)
+        emit(record)
+
+    def worker(profile: BatchProfile) -> None:
+        while True:
+            item = next_item(profile)
+            if item is None:
+                return
+            started = time.monotonic()
+            record: Dict[str, Any] = {"id": item.id, "line": item.line, "profile": profile.name, "taskId": "", "status": "failed"}
+            try:
+                referer = _build_referer(item.payload, args.referer.strip(), origin)
+                data = create(session_for(profile), item, profile, referer)
+                task_id = _extract_task_id(data)
+                record["taskId"] = task_id
+                if not task_id:
+                    record["error"] = f"no taskId in create response: {json.dumps(data, ensure_ascii=False)[:200]}"
+                elif args.no_history:
+                    record["status"] = "created"
+                else:
+                    # The slot is held until the task finishes upstream; downloads run on their own pool.
+                    hit, status = poller.wait(profile, referer, task_id)
+                    record["taskStatus"] = status
+                    if hit is None:
+                        record["status"] = "timeout"
+                    else:
+                        file_url = str(hit.get("fileUrl") or hit.get("file_url") or "")
+                        record["fileUrl"] = file_url
+                        record["status"] = "success" if status.upper() == "SUCCESS" else "failed"
+                        if file_url and not args.no_download:
+                            output_name = str(hit.get("outputName") or hit.get("output_name") or "").strip()
+                            filename = f"{item.id}-{output_name or _default_name_from_url(file_url)}"
+                            downloads.submit(download, record, profile, file_url, filename, started)
+                            continue
+            except Exception as e:
+                record["error"] = str(e)
+            record["seconds"] = round(time.monotonic() - started, 3)
+            emit(record)
+
+    started = time.monotonic()
+    threads = [
+        threading.Thread(target=worker, args=(p,), daemon=True, name=f"batch-{p.name}-{i}")
+        for p in profiles
+        for i in range(per_profile)
+    ]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        downloads.shutdown(wait=True)
+    finally:
+        poller.close()
+        results_file.close()
+
+    elapsed = time.monotonic() - started
+    parts = ", ".join(f"{k}={v}" for k, v in sorted(summary.items()))
+    print(f"[rh_create] batch done in {elapsed:.1f}s: {parts}; history calls={poller.calls}; results={results_path}")
+    return 0 if summary.get("success", 0) + summary.get("created", 0) == len(items) else 1
+
+
 def main(argv: list[str]) -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument("--cookies", default="cookies.txt", help="TokenMaster export JSON (default: cookies.txt)")
-    ap.add_argument("--payload", required=True, help="create payload JSON file (object), e.g. create_payload.json")
-    ap.add_argument("--url", default=CREATE_URL, help=f"create endpoint URL (default: {CREATE_URL})")
+    ap.add_argument("--payload", default="", help="create payload JSON file (object), e.g. create_payload.json")
+    ap.add_argument("--batch", default="", help="JSONL of payloads (or {id, payload, profile} objects) to run concurrently")
+    ap.add_argument("--multicookies", default="", help="batch: TokenMaster multi export; tasks are spread over its profiles")
+    ap.add_argument("--per-profile", type=int, default=1, help="batch: concurrent tasks per profile (default: 1)")
+    ap.add_argument("--download-workers", type=int, default=4, help="batch: parallel downloads (default: 4)")
+    ap.add_argument("--results", default="results.jsonl", help="batch: per-payload results JSONL (default: results.jsonl)")
+    ap.add_argument(
+        "--base-url",
+        default=os.environ.get("RH_BASE_URL", "").strip() or ORIGIN,
+        help=f"RunningHub base URL, e.g. a local run_fake_rh.py (env RH_BASE_URL; default: {ORIGIN})",
+    )
+    ap.add_argument("--url", default="", help=f"create endpoint URL (default: <base-url>{CREATE_PATH})")
     ap.add_argument("--referer", default="", help="override Referer header (default: derived from payload.webappId)")
     ap.add_argument("--token", default="", help="override Authorization token (Bearer ... without Bearer)")
     ap.add_argument("--no-auth", action="store_true", help="do not send Authorization even if token is available")
     ap.add_argument("--timeout", type=float, default=25.0)
     ap.add_argument("--out", default="", help="write response JSON/text to this file")
     ap.add_argument("--no-history", action="store_true", help="do not poll history after create")
-    ap.add_argument("--history-url", default=HISTORY_URL, help=f"history endpoint URL (default: {HISTORY_URL})")
+    ap.add_argument("--history-url", default="", help=f"history endpoint URL (default: <base-url>{HISTORY_PATH})")
     ap.add_argument("--history-interval", type=float, default=3.0, help="poll interval seconds (default: 3)")
     ap.add_argument("--history-timeout", type=float, default=600.0, help="max wait seconds (default: 600)")
     ap.add_argument("--history-pages", type=int, default=3, help="pages to scan per poll (default: 3)")
@@ -270,6 +642,14 @@ def main(argv: list[str]) -> int:
     ap.add_argument("--overwrite", action="store_true", help="overwrite existing downloaded file")
     ap.add_argument("--dry-run", action="store_true", help="print request summary but do not send")
     args = ap.parse_args(argv)
+    origin = args.base_url.strip().rstrip("/") or ORIGIN
+    args.url = args.url.strip() or origin + CREATE_PATH
+    args.history_url = args.history_url.strip() or origin + HISTORY_PATH
+
+    if args.batch:
+        return _run_batch(args, origin)
+    if not args.payload:
+        ap.error("--payload or --batch is required")
 
     dump = _parse_tokendump(args.cookies)
     payload = _load_payload(args.payload)
@@ -278,8 +658,8 @@ def main(argv: list[str]) -> int:
     if args.no_auth:
         token = ""
 
-    referer = _build_referer(payload, args.referer.strip())
-    headers = _make_headers(payload, token, referer)
+    referer = _build_referer(payload, args.referer.strip(), origin)
+    headers = _make_headers(payload, token, referer, origin)
 
     try:
         import requests  # type: ignore
@@ -349,7 +729,7 @@ def main(argv: list[str]) -> int:
             hit: Optional[Dict[str, Any]] = None
             for page in range(1, max(1, int(args.history_pages)) + 1):
                 body = _make_history_body(int(args.history_size), page, "")
-                h_headers = _make_headers(payload, token, referer)
+                h_headers = _make_headers(payload, token, referer, origin)
                 h_resp = s.post(args.history_url, headers=h_headers, json=body, timeout=args.timeout)
                 h_ct = h_resp.headers.get("content-type", "")
                 if "application/json" not in h_ct.lower():
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Benchmark the job pipeline and storage layer against the local RunningHub stand-in.
+
+Starts webapp/fake_rh.py and the web app in-process (temp data/download dirs, nothing
+touches webapp/data), then measures:
+- end-to-end jobs/minute per jobConcurrency level, and history calls per completed task
+- read_json / write_json throughput vs collection size
+- list_downloads latency vs file count
+- zip extraction MB/s
+
+Writes a JSON report; --compare OLD.json prints the change per metric and exits 1 when
+a metric regressed by more than --threshold.
+
+    python run_bench.py --out bench.json
+    python run_bench.py --quick --compare bench.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+
+ROOT = Path(__file__).resolve().parent
+
+# Metric name suffixes where bigger is better (--compare); "ms"/"seconds" are smaller-is-better.
+HIGHER_IS_BETTER = ("per_min", "per_sec")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return int(s.getsockname()[1])
+
+
+def _serve(app: Any, port: int) -> Tuple[Any, threading.Thread]:
+    import uvicorn  # type: ignore
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True, name=f"bench-server-{port}")
+    thread.start()
+    deadline = time.monotonic() + 15
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise SystemExit(f"server on port {port} did not start")
+        time.sleep(0.05)
+    return server, thread
+
+
+def _timed(fn: Callable[[], Any], repeat: int) -> float:
+    """
+    Median wall time of `repeat` calls, in seconds.
+    """
+    runs: List[float] = []
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - started)
+    return statistics.median(runs)
+
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10)
+        return out.stdout.strip()
+    except Exception:
+        return ""
+
+
+# ---- pipeline ----
+
+
+def bench_pipeline(api: str, fake: str, levels: List[int], jobs_per_slot: int, latency: str, timeout: float) -> List[Dict[str, Any]]:
+    import requests
+
+    s = requests.Session()
+
+    def call(method: str, path: str, base: str = api, **kw: Any) -> Any:
+        r = s.request(method, base + path, timeout=30, **kw)
+        r.raise_for_status()
+        return r.json()
+
+    lo, _, hi = latency.partition("-")
+    call("POST", "/fake/config", base=fake, json={"latency_min": float(lo), "latency_max": float(hi or lo)})
+    template = call("POST", "/api/templates", json={"name": "bench", "payload": {"webappId": "1", "inputs": []}})["template"]
+
+    # One account per slot: the stand-in keeps history per token, like RunningHub.
+    for i in range(max(levels)):
+        record = {
+            "name": f"bench-{i}",
+            "data": [
+                {"type": "localStorage", "key": "Rh-Accesstoken", "value": f"bench-token-{i}"},
+                {"type": "localStorage", "key": "userInfo", "value": json.dumps({"id": str(i), "totalCoin": "1000"})},
+            ],
+        }
+        call("POST", "/api/cookies/import", json={"host": "www.runninghub.ai", "record": record})
+    profiles = [p["id"] for p in call("GET", "/api/cookies")["profiles"]]
+
+    results: List[Dict[str, Any]] = []
+    for level in levels:
+        n_jobs = level * jobs_per_slot
+        call("PUT", "/api/settings", json={"jobConcurrency": level, "jobQueueDepth": max(200, n_jobs), "historyIntervalSec": 0.5})
+        call("POST", "/fake/reset", base=fake)
+        started = time.monotonic()
+        ids = [
+            call(
+                "POST",
+                "/api/jobs",
+                json={"templateId": template["id"], "profileId": profiles[i % level], "payload": {"webappId": "1", "n": i}, "batchId": f"bench-{level}"},
+            )["job"]["id"]
+            for i in range(n_jobs)
+        ]
+        while True:
+            jobs = call("GET", f"/api/jobs?batchId=bench-{level}")["jobs"]
+            if all(j["status"] not in ("queued", "running") for j in jobs):
+                break
+            if time.monotonic() - started > timeout:
+                call("POST", "/api/jobs/cancel", json={"batchId": f"bench-{level}"})
+                break
+            time.sleep(0.1)
+        elapsed = time.monotonic() - started
+        ok = sum(1 for j in jobs if j["status"] == "success")
+        calls = call("GET", "/fake/stats", base=fake)["calls"]
+        results.append(
+            {
+                "concurrency": level,
+                "jobs": len(ids),
+                "succeeded": ok,
+                "seconds": round(elapsed, 3),
+                "jobs_per_min": round(ok / elapsed * 60, 2) if elapsed > 0 else 0.0,
+                "history_calls_per_task": round(calls.get("history", 0) / ok, 2) if ok else None,
+                "stage_avg_sec": call("GET", "/api/queue")["stageAvgSec"],
+            }
+        )
+        print(f"[bench] pipeline c={level}: {ok}/{len(ids)} ok in {elapsed:.1f}s -> {results[-1]['jobs_per_min']} jobs/min")
+    return results
+
+
+# ---- storage / downloads / zip ----
+
+
+def bench_storage(work: Path, sizes: List[int], repeat: int) -> List[Dict[str, Any]]:
+    from webapp.storage import read_json, write_json
+
+    out: List[Dict[str, Any]] = []
+    for n in sizes:
+        path = work / f"storage-{n}.json"
+        data = {
+            "schemaVersion": 1,
+            "templates": [
+                {"id": f"{i:032x}", "name": f"template {i}", "payload": {"webappId": str(i), "inputs": [{"nodeId": "1", "fieldName": "text", "fieldValue": "x" * 64}]}}
+                for i in range(n)
+            ],
+        }
+        write_s = _timed(lambda: write_json(path, data), repeat)
+        read_s = _timed(lambda: read_json(path, None), repeat)
+        mb = path.stat().st_size / 1e6
+        out.append(
+            {
+                "records": n,
+                "mb": round(mb, 3),
+                "write_ms": round(write_s * 1000, 3),
+                "read_ms": round(read_s * 1000, 3),
+                "write_mb_per_sec": round(mb / write_s, 2) if write_s else None,
+                "read_mb_per_sec": round(mb / read_s, 2) if read_s else None,
+            }
+        )
+        print(f"[bench] storage n={n}: write {out[-1]['write_ms']} ms, read {out[-1]['read_ms']} ms")
+    return out
+
+
+def bench_list_downloads(download_dir: Path, counts: List[int], repeat: int) -> List[Dict[str, Any]]:
+    from webapp import app as webapp
+
+    out: List[Dict[str, Any]] = []
+    made = 0
+    for n in sorted(counts):
+        for i in range(made, n):
+            # Mix of top-level files and extracted-zip folders, like real downloads.
+            sub = download_dir / f"job{i // 20}" if i % 2 else download_dir
+            sub.mkdir(parents=True, exist_ok=True)
+            (sub / f"out-{i}.png").write_bytes(b"\x89PNG")
+        made = n
+        secs = _timed(webapp.list_downloads, repeat)
+        out.append({"files": n, "ms": round(secs * 1000, 3)})
+        print(f"[bench] list_downloads files={n}: {out[-1]['ms']} ms")
+    return out
+
+
+def bench_zip(work: Path, mb: int, entries: int, repeat: int) -> Dict[str, Any]:
+    from webapp import app as webapp
+
+    src = work / "bench.zip"
+    per = max(1, mb * 1_000_000 // entries)
+    with zipfile.ZipFile(src, "w", compression=zipfile.ZIP_STORED) as zf:
+        for i in range(entries):
+            zf.writestr(f"out/{i:04d}.png", os.urandom(per))
+    dest = work / "unzipped"
+
+    def run() -> None:
+        shutil.rmtree(dest, ignore_errors=True)
+        webapp._safe_extract_zip(src, dest)
+
+    secs = _timed(run, repeat)
+    total_mb = per * entries / 1e6
+    print(f"[bench] unzip {total_mb:.0f} MB / {entries} files: {total_mb / secs:.1f} MB/s")
+    return {"mb": round(total_mb, 1), "entries": entries, "seconds": round(secs, 3), "mb_per_sec": round(total_mb / secs, 2)}
+
+
+# ---- compare ----
+
+
+def _flatten(prefix: str, value: Any, out: Dict[str, float]) -> None:
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}.{k}" if prefix else k, v, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = float(value)
+
+
+def _keyed(results: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Flatten results with list rows keyed by their size parameter (concurrency/records/files).
+    """
+    flat: Dict[str, float] = {}
+    for section, rows in results.items():
+        if isinstance(rows, list):
+            for row in rows:
+                key = next((f"{k}={row[k]}" for k in ("concurrency", "records", "files") if k in row), "")
+                _flatten(f"{section}[{key}]", {k: v for k, v in row.items() if k not in ("concurrency", "records", "files")}, flat)
+        else:
+            _flatten(section, rows, flat)
+    return flat
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float) -> int:
+    a, b = _keyed(old.get("results", {})), _keyed(new.get("results", {}))
+    tracked = [k for k in sorted(a) if k in b and k.rsplit(".", 1)[-1].endswith(("ms", "seconds") + HIGHER_IS_BETTER)]
+    regressions = 0
+    print(f"[bench] compare {old.get('commit') or '?'} -> {new.get('commit') or '?'} (threshold {threshold:.0%})")
+    for k in tracked:
+        if not a[k]:
+            continue
+        change = (b[k] - a[k]) / a[k]
+        worse = -change if k.endswith(HIGHER_IS_BETTER) else change
+        flag = "REGRESSION" if worse > threshold else ""
+        regressions += bool(flag)
+        print(f"  {k:<60} {a[k]:>12.3f} -> {b[k]:>12.3f} {change:+7.1%} {flag}")
+    return 1 if regressions else 0
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description="job pipeline / storage benchmarks against the local RunningHub stand-in")
+    ap.add_argument("--out", default="bench-report.json", help="report path (default: bench-report.json)")
+    ap.add_argument("--compare", default="", help="earlier report to diff against")
+    ap.add_argument("--threshold", type=float, default=0.15, help="relative change counted as a regression (default: 0.15)")
+    ap.add_argument("--concurrency", default="1,4,8,16", help="jobConcurrency levels (default: 1,4,8,16)")
+    ap.add_argument("--jobs-per-slot", type=int, default=4, help="jobs per concurrency level = level * this (default: 4)")
+    ap.add_argument("--latency", default="1-2", help="fake generation seconds 'N' or 'MIN-MAX' (default: 1-2)")
+    ap.add_argument("--output-bytes", type=int, default=1_000_000, help="fake output size (default: 1 MB)")
+    ap.add_argument("--storage-sizes", default="100,1000,10000")
+    ap.add_argument("--download-counts", default="100,1000,5000")
+    ap.add_argument("--zip-mb", type=int, default=200)
+    ap.add_argument("--zip-entries", type=int, default=50)
+    ap.add_argument("--repeat", type=int, default=5, help="runs per micro-benchmark; the median is reported")
+    ap.add_argument("--job-timeout", type=float, default=600.0, help="give up on a pipeline level after this many seconds")
+    ap.add_argument("--quick", action="store_true", help="small sizes for a smoke run")
+    ap.add_argument("--skip-pipeline", action="store_true")
+    args = ap.parse_args(argv)
+
+    if args.quick:
+        args.concurrency, args.jobs_per_slot, args.latency = "1,4", 2, "0.5"
+        args.storage_sizes, args.download_counts, args.zip_mb, args.zip_entries, args.repeat = "100,1000", "100,1000", 20, 10, 3
+
+    work = Path(tempfile.mkdtemp(prefix="rh_bench_"))
+    # Must be set before webapp.app / rh_client are imported.
+    os.environ["RH_DATA_DIR"] = str(work / "data")
+    os.environ["RH_DOWNLOAD_DIR"] = str(work / "downloads")
+    os.environ["RH_RESOURCE_FILES_DIR"] = str(work / "resource_files")
+    fake_port, api_port = _free_port(), _free_port()
+    os.environ["RH_BASE_URL"] = f"http://127.0.0.1:{fake_port}"
+    sys.path.insert(0, str(ROOT))
+
+    from webapp.fake_rh import FakeConfig, create_app
+
+    report: Dict[str, Any] = {
+        "schemaVersion": 1,
+        "commit": _git_commit(),
+        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "results": {},
+    }
+    results = report["results"]
+    servers: List[Any] = []
+    try:
+        if not args.skip_pipeline:
+            from webapp import app as webapp
+
+            fake_server, _ = _serve(create_app(FakeConfig(output_bytes=args.output_bytes, seed=1)), fake_port)
+            api_server, _ = _serve(webapp.app, api_port)
+            servers = [api_server, fake_server]
+            levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+            results["pipeline"] = bench_pipeline(
+                f"http://127.0.0.1:{api_port}", f"http://127.0.0.1:{fake_port}", levels, args.jobs_per_slot, args.latency, args.job_timeout
+            )
+        results["storage"] = bench_storage(work, [int(x) for x in args.storage_sizes.split(",") if x.strip()], args.repeat)
+        bench_dl = work / "downloads-bench"
+        from webapp import app as webapp
+
+        webapp.DOWNLOAD_DIR = bench_dl
+        results["list_downloads"] = bench_list_downloads(bench_dl, [int(x) for x in args.download_counts.split(",") if x.strip()], args.repeat)
+        results["unzip"] = bench_zip(work, args.zip_mb, args.zip_entries, max(1, args.repeat // 2))
+    finally:
+        for server in servers:
+            server.should_exit = True
+        time.sleep(0.5)
+        shutil.rmtree(work, ignore_errors=True)
+
+    Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"[bench] wrote {args.out}")
+    if args.compare:
+        old = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        return compare(old, report, args.threshold)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Run the local RunningHub stand-in (webapp/fake_rh.py) for offline load tests.
+
+Then point the web app / rh_create.py at it:
+    RH_BASE_URL=http://127.0.0.1:8790 python run_webapp.py
+    python rh_create.py --base-url http://127.0.0.1:8790 --payload create_payload.json
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+
+def main(argv: list[str]) -> int:
+    os.environ.setdefault("PYTHONDONTWRITEBYTECODE", "1")
+
+    ap = argparse.ArgumentParser(description="fake RunningHub server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8790)
+    ap.add_argument("--latency", default="2-5", help="generation seconds, 'N' or 'MIN-MAX' (default: 2-5)")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="fraction of tasks ending FAILED")
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of API calls answered 429")
+    ap.add_argument("--request-latency", type=float, default=0.0, help="seconds added to every API call")
+    ap.add_argument("--history-lag", type=int, default=0, help="history polls that miss a new task")
+    ap.add_argument("--history-noise", type=int, default=0, help="unrelated tasks added to history per create")
+    ap.add_argument("--history-max-page-size", type=int, default=50)
+    ap.add_argument("--output", choices=("png", "zip"), default="png")
+    ap.add_argument("--output-bytes", type=int, default=256 * 1024)
+    ap.add_argument("--zip-entries", type=int, default=4)
+    ap.add_argument("--outputs", type=int, default=1, help="outputs per task (multi-output workflows)")
+    ap.add_argument("--require-auth", action="store_true", help="401 without a Bearer token")
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args(argv)
+
+    try:
+        import uvicorn  # type: ignore
+    except Exception:
+        print("Missing dependency: uvicorn")
+        print("Install: pip install -r requirements-webapp.txt")
+        return 1
+
+    from webapp.fake_rh import FakeConfig, create_app
+
+    lo, _, hi = args.latency.partition("-")
+    config = FakeConfig(
+        latency_min=float(lo),
+        latency_max=float(hi or lo),
+        fail_rate=args.fail_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        request_latency=args.request_latency,
+        history_lag_polls=args.history_lag,
+        history_noise=args.history_noise,
+        history_max_page_size=args.history_max_page_size,
+        output=args.output,
+        output_bytes=args.output_bytes,
+        zip_entries=args.zip_entries,
+        outputs=args.outputs,
+        require_auth=args.require_auth,
+        seed=args.seed,
+    )
+    print(f"[fake_rh] RH_BASE_URL=http://{args.host}:{args.port}")
+    uvicorn.run(create_app(config), host=args.host, port=args.port, reload=False, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Run a headless job worker against the shared queue (webapp/jobstore.py).
+
+Start the web app and any number of workers with the same queue and data directories:
+    RH_JOB_QUEUE=/shared/jobs.sqlite RH_DATA_DIR=/shared/data RH_DOWNLOAD_DIR=/shared/downloads python run_webapp.py
+    RH_DATA_DIR=/shared/data RH_DOWNLOAD_DIR=/shared/downloads python run_worker.py --queue /shared/jobs.sqlite
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import socket
+import sys
+
+
+def main(argv: list[str]) -> int:
+    os.environ.setdefault("PYTHONDONTWRITEBYTECODE", "1")
+
+    ap = argparse.ArgumentParser(description="RunningHub job worker")
+    ap.add_argument("--queue", default=os.environ.get("RH_JOB_QUEUE", ""), help="shared queue database (env RH_JOB_QUEUE)")
+    ap.add_argument("--concurrency", type=int, default=0, help="jobs run at once (default: jobConcurrency setting)")
+    ap.add_argument("--id", default="", help="worker name shown on jobs (default: host-pid)")
+    args = ap.parse_args(argv)
+
+    if not args.queue:
+        print("--queue or RH_JOB_QUEUE required")
+        return 2
+    os.environ["RH_JOB_QUEUE"] = args.queue
+
+    from pathlib import Path
+
+    from webapp import app, jobstore, worker
+
+    concurrency = args.concurrency or int(app._load_settings().get("jobConcurrency", app.MAX_CONCURRENT_JOBS))
+    worker_id = args.id or f"{socket.gethostname()}-{os.getpid()}"
+    worker.serve(jobstore.JobStore(Path(args.queue)), worker_id, max(1, concurrency))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
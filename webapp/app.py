@@ -1,36 +1,61 @@
 from __future__ import annotations
 
+import asyncio
+import calendar
+import contextvars
+import hashlib
+import heapq
+import hmac
 import json
+import math
+import os
 import shutil
 import threading
 import time
 import uuid
 import zipfile
+from collections import deque
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed
+from concurrent.futures import wait as futures_wait
+from concurrent.futures import TimeoutError as FuturesTimeout
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 import requests
 import mimetypes
-from urllib.parse import quote
-from fastapi import Body, FastAPI, HTTPException
-from fastapi import File, Form, UploadFile
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import Body, FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-from . import rh_client
-from .storage import read_json, write_json
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header  # type: ignore
+
+from . import jobstore, jsonstream, metrics, postprocess, profiler, rh_client, template_slots, tracing
+from .storage import file_signature, read_json, write_json
 
 
 ROOT = Path(__file__).resolve().parent
-DATA_DIR = ROOT / "data"
+# RH_DATA_DIR / RH_DOWNLOAD_DIR / RH_RESOURCE_FILES_DIR relocate state, e.g. for benchmarks.
+DATA_DIR = Path(os.environ.get("RH_DATA_DIR") or ROOT / "data")
 STATIC_DIR = ROOT / "static"
-DOWNLOAD_DIR = ROOT / "downloads"
-RESOURCE_FILES_DIR = ROOT / "resource_files"
+DOWNLOAD_DIR = Path(os.environ.get("RH_DOWNLOAD_DIR") or ROOT / "downloads")
+RESOURCE_FILES_DIR = Path(os.environ.get("RH_RESOURCE_FILES_DIR") or ROOT / "resource_files")
+# Partial uploads; same filesystem as RESOURCE_FILES_DIR so finished files are renamed, not copied.
+STAGING_DIR = DATA_DIR / "staging"
+# Resumable upload sessions: <id>.json (metadata) + <id>.part (bytes received so far).
+UPLOAD_SESSIONS_DIR = STAGING_DIR / "sessions"
 
 TEMPLATES_PATH = DATA_DIR / "templates.json"
 COOKIES_PATH = DATA_DIR / "cookies.json"
 RESOURCES_PATH = DATA_DIR / "resources.json"
 SETTINGS_PATH = DATA_DIR / "settings.json"
+# Post-processing results per download (path relative to DOWNLOAD_DIR -> hook -> result),
+# one file per job: workers on a shared volume never rewrite each other's entries.
+DOWNLOADS_META_DIR = DATA_DIR / "downloads_meta"
 
 
 DATA_DIR.mkdir(parents=True, exist_ok=True)
@@ -44,10 +69,117 @@ app.mount("/resource-files", StaticFiles(directory=str(RESOURCE_FILES_DIR)), nam
 
 
 MAX_CONCURRENT_JOBS = 6
-_job_slots = threading.Semaphore(MAX_CONCURRENT_JOBS)
 _shutdown_event = threading.Event()
 _jobs_lock = threading.Lock()
 _jobs: Dict[str, Dict[str, Any]] = {}
+# Idempotency key / dedupe hash -> job id (guarded by _jobs_lock); entries that can no
+# longer coalesce are swept by _coalesced_job at most every JOB_KEYS_PRUNE_SEC.
+_job_keys: Dict[str, str] = {}
+JOB_KEYS_PRUNE_SEC = 60.0
+_job_keys_pruned_at = 0.0
+# job id -> stop event for queued/running jobs (guarded by _jobs_lock); set on cancel or shutdown.
+_job_stop_events: Dict[str, threading.Event] = {}
+JOB_ACTIVE_STATUSES = ("queued", "running")
+
+# Admission control: accepted jobs wait in a bounded priority heap of
+# (priority, seq, job id, runner); the dispatcher thread starts one runner per free slot.
+# Lock order: _jobs_lock may be held while taking _job_queue_cv, never the reverse.
+JOB_PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+_job_queue_cv = threading.Condition()
+_job_queue: List[Tuple[int, int, str, Any]] = []
+_job_queue_seq = 0
+_active_job_slots: set = set()
+_job_dispatcher: Optional[threading.Thread] = None
+
+# RH_JOB_QUEUE=<sqlite path>: jobs go to a queue shared with worker processes (run_worker.py)
+# instead of the dispatcher above; _jobs then mirrors the store, refreshed by a sync thread.
+JOB_QUEUE_PATH = os.environ.get("RH_JOB_QUEUE") or ""
+JOB_STORE_SYNC_SEC = 1.0
+_job_store: Optional[jobstore.JobStore] = jobstore.JobStore(Path(JOB_QUEUE_PATH)) if JOB_QUEUE_PATH else None
+_job_store_sync: Optional[threading.Thread] = None
+# job id -> chain/callbackUrl attached by coalesced submissions (guarded by _jobs_lock);
+# re-applied over each store row until the job finishes, since the mirror is overwritten.
+_job_attached: Dict[str, Dict[str, Any]] = {}
+
+# Finished jobs, for GET /api/jobs/completions and callback URLs. Sequence numbers start
+# at the current epoch-ms so a client's cursor from before a restart stays below new ones.
+COMPLETIONS_KEEP = 10000
+COMPLETIONS_KEEPALIVE_SEC = 15.0
+_completions_lock = threading.Lock()
+_completions: Deque[Dict[str, Any]] = deque(maxlen=COMPLETIONS_KEEP)
+_completion_seq = int(time.time() * 1000)
+# Open feed requests: (event loop, asyncio.Event) woken on each completion.
+_completion_waiters: Set[Tuple[Any, Any]] = set()
+# batchId -> callback URL for every job of the batch (in memory, like _jobs).
+_batch_callbacks: Dict[str, str] = {}
+CALLBACK_ATTEMPTS = 5
+_callback_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="callback")
+
+# Parsed DOWNLOADS_META_DIR files: file name -> (file_signature, entries).
+_downloads_meta_lock = threading.Lock()
+_downloads_meta_cache: Dict[str, Tuple[Any, Dict[str, Any]]] = {}
+
+# Stage name -> (samples, EWMA seconds) of finished jobs, for queue wait estimates.
+STAGE_EWMA_ALPHA = 0.2
+DEFAULT_JOB_RUN_SEC = 60.0
+_stage_stats_lock = threading.Lock()
+_stage_stats: Dict[str, Tuple[int, float]] = {}
+
+# RunningHub uploads run here (not in the request threadpool) while the request body streams in.
+UPLOAD_WORKERS = 8
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+_upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload")
+
+# Derived per-profile summaries, rebuilt only when cookies.json changes on disk.
+_cookie_summaries_lock = threading.Lock()
+_cookie_summaries_sig: Any = None
+_cookie_summaries: List[Dict[str, Any]] = []
+
+# (sha256, profileId) -> resource and remote name -> resource, rebuilt only when resources.json changes.
+_resource_hash_lock = threading.Lock()
+_resource_hash_sig: Any = None
+_resource_hash_index: Dict[Tuple[str, str], Dict[str, Any]] = {}
+_resource_name_index: Dict[str, Dict[str, Any]] = {}
+# Held across every load-modify-save of resources.json (uploads finish on several threads).
+_resources_lock = threading.Lock()
+# Same for templates.json and cookies.json (imports stream for minutes before they merge).
+_templates_lock = threading.Lock()
+_cookies_lock = threading.Lock()
+# (sha256, profileId) -> resource record once the bulk upload already sending these bytes
+# to that profile is saved (None if it failed); identical parts wait instead of re-uploading.
+_bulk_inflight: Dict[Tuple[str, str], "asyncio.Future[Optional[Dict[str, Any]]]"] = {}
+
+# Resumable uploads: sessions with a PUT or finalize in progress, and a running hash plus
+# an upstream transfer fed as the bytes arrive for sessions whose chunks came in order
+# (lost on restart, on a gap longer than the idle limit or on a resend; finalize then
+# re-reads the file).
+UPLOAD_SESSION_TTL_SEC = 7 * 24 * 3600
+UPLOAD_SESSION_TEE_IDLE_SEC = 60.0
+_upload_sessions_lock = threading.Lock()
+_upload_sessions_busy: set = set()
+_upload_session_hashers: Dict[str, Tuple[int, Any]] = {}
+_upload_session_tees: Dict[str, "_UpstreamTee"] = {}
+
+# Template summaries + search text and id -> template, rebuilt only when templates.json changes.
+_template_index_lock = threading.Lock()
+_template_index_sig: Any = None
+_template_index: List[Tuple[str, Dict[str, Any]]] = []
+_templates_by_id: Dict[str, Dict[str, Any]] = {}
+
+# templateId -> (updatedAt, compiled skeleton + slots); filled on save, or lazily after a restart.
+_compiled_templates_lock = threading.Lock()
+_compiled_templates: Dict[str, Tuple[str, template_slots.CompiledTemplate]] = {}
+
+# profileId -> (monotonic time, totalCoin) of the last successful getUserInfo.
+_user_info_cache_lock = threading.Lock()
+_user_info_cache: Dict[str, Tuple[float, str]] = {}
+
+# profileId -> (monotonic time, usable, reason) from the last probe or upstream auth error.
+_profile_health_lock = threading.Lock()
+_profile_health: Dict[str, Tuple[float, bool, str]] = {}
+
+# Treat tokens expiring within this window as already expired (a job needs time to finish).
+TOKEN_EXPIRY_MARGIN_SEC = 60
 
 
 def _now_iso() -> str:
@@ -58,6 +190,19 @@ def _gen_id() -> str:
     return uuid.uuid4().hex
 
 
+def _epoch_iso(ts: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
+
+
+def _iso_epoch(s: Any) -> Optional[float]:
+    if not isinstance(s, str) or not s.strip():
+        return None
+    try:
+        return float(calendar.timegm(time.strptime(s.strip(), "%Y-%m-%dT%H:%M:%SZ")))
+    except Exception:
+        return None
+
+
 def _mtime_iso(path: Path) -> str:
     try:
         st = path.stat()
@@ -85,6 +230,28 @@ def _default_settings() -> Dict[str, Any]:
         "historyIntervalSec": 3.0,
         # Per-request timeout for create/history/download.
         "requestTimeoutSec": 25.0,
+        # Balances younger than this are not re-fetched by "refresh all".
+        "userInfoTtlSec": 300,
+        # Parallel getUserInfo calls for "refresh all".
+        "userInfoConcurrency": 8,
+        # Parallel RunningHub transfers for bulk uploads.
+        "uploadConcurrency": 4,
+        # How long a probe result (valid/invalid profile) is trusted before dispatch.
+        "profileProbeTtlSec": 600,
+        # Identical submissions (idempotency key or dedupe hash) reuse a successful job this long.
+        "jobDedupeTtlSec": 600,
+        # Jobs running at once (create/poll/download); the rest wait in the queue.
+        "jobConcurrency": MAX_CONCURRENT_JOBS,
+        # Queued (not yet running) jobs accepted before POST /api/jobs answers 429.
+        "jobQueueDepth": 200,
+        # Outputs of one job downloaded at once (multi-output workflows).
+        "downloadConcurrency": 4,
+        # Hooks run on every downloaded/extracted file (webapp/postprocess.py); [] disables.
+        "postprocessHooks": ["sha256", "media"],
+        # Post-processing processes; 0 = one per CPU core.
+        "postprocessWorkers": 0,
+        # HMAC-SHA256 key for X-RH-Signature on callback POSTs (unsigned when empty).
+        "callbackSecret": "",
     }
 
 
@@ -113,16 +280,32 @@ def _load_settings() -> Dict[str, Any]:
         base["requestTimeoutSec"] = 25.0
     base["requestTimeoutSec"] = max(3.0, min(120.0, base["requestTimeoutSec"]))
 
+    base["userInfoTtlSec"] = max(0, min(24 * 3600, _coerce_int(base.get("userInfoTtlSec"), 300)))
+    base["userInfoConcurrency"] = max(1, min(32, _coerce_int(base.get("userInfoConcurrency"), 8)))
+    base["uploadConcurrency"] = max(1, min(UPLOAD_WORKERS, _coerce_int(base.get("uploadConcurrency"), 4)))
+    base["profileProbeTtlSec"] = max(0, min(7 * 24 * 3600, _coerce_int(base.get("profileProbeTtlSec"), 600)))
+    base["jobDedupeTtlSec"] = max(0, min(7 * 24 * 3600, _coerce_int(base.get("jobDedupeTtlSec"), 600)))
+    base["jobConcurrency"] = max(1, min(64, _coerce_int(base.get("jobConcurrency"), MAX_CONCURRENT_JOBS)))
+    base["jobQueueDepth"] = max(1, min(100000, _coerce_int(base.get("jobQueueDepth"), 200)))
+    base["downloadConcurrency"] = max(1, min(16, _coerce_int(base.get("downloadConcurrency"), 4)))
+    hooks = base.get("postprocessHooks")
+    base["postprocessHooks"] = [str(h).strip() for h in hooks if str(h).strip()] if isinstance(hooks, list) else ["sha256", "media"]
+    base["postprocessWorkers"] = max(0, min(256, _coerce_int(base.get("postprocessWorkers"), 0)))
+    base["callbackSecret"] = str(base.get("callbackSecret") or "")
+
     return base
 
 
 def _save_settings(next_settings: Dict[str, Any]) -> Dict[str, Any]:
     merged = _load_settings()
     if isinstance(next_settings, dict):
-        for k in ("jobTimeoutSec", "historyIntervalSec", "requestTimeoutSec"):
-            if k in next_settings:
+        for k in _default_settings():
+            if k != "schemaVersion" and k in next_settings:
                 merged[k] = next_settings[k]
     write_json(SETTINGS_PATH, merged)
+    with _job_queue_cv:
+        # A higher jobConcurrency takes effect right away.
+        _job_queue_cv.notify_all()
     return _load_settings()
 
 
@@ -130,6 +313,12 @@ def _save_settings(next_settings: Dict[str, Any]) -> Dict[str, Any]:
 def _on_shutdown() -> None:
     # Let background job threads stop quickly on Ctrl+C / uvicorn shutdown.
     _shutdown_event.set()
+    with _jobs_lock:
+        for ev in _job_stop_events.values():
+            ev.set()
+    with _job_queue_cv:
+        _job_queue_cv.notify_all()
+    postprocess.shutdown()
 
 
 def _safe_extract_zip(zip_path: Path, dest_dir: Path) -> List[Path]:
@@ -202,6 +391,45 @@ def _save_resources(resources: List[Dict[str, Any]]) -> None:
     write_json(RESOURCES_PATH, {"schemaVersion": 1, "resources": resources})
 
 
+def _refresh_resource_index() -> None:
+    global _resource_hash_sig, _resource_hash_index, _resource_name_index
+    sig = file_signature(RESOURCES_PATH)
+    if sig == _resource_hash_sig:
+        return
+    by_hash: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    by_name: Dict[str, Dict[str, Any]] = {}
+    # Oldest first so the newest upload of the same bytes wins.
+    for r in reversed(_load_resources()):
+        name = r.get("name")
+        if not isinstance(name, str) or not name.strip():
+            continue
+        by_name[name] = r
+        h = str(r.get("sha256") or "").strip().lower()
+        if h:
+            by_hash[(h, str(r.get("profileId") or ""))] = r
+    _resource_hash_index = by_hash
+    _resource_name_index = by_name
+    _resource_hash_sig = sig
+
+
+def _find_resource_by_hash(sha256: str, profile_id: str) -> Optional[Dict[str, Any]]:
+    if not sha256:
+        return None
+    with _resource_hash_lock:
+        _refresh_resource_index()
+        hit = _resource_hash_index.get((sha256.lower(), profile_id))
+        return dict(hit) if hit else None
+
+
+def _find_resource_by_name(name: str) -> Optional[Dict[str, Any]]:
+    if not name:
+        return None
+    with _resource_hash_lock:
+        _refresh_resource_index()
+        hit = _resource_name_index.get(name)
+        return dict(hit) if hit else None
+
+
 def _extract_kv_from_record(record: Dict[str, Any], key: str) -> str:
     data = record.get("data")
     if not isinstance(data, list):
@@ -276,6 +504,10 @@ def _normalize_resource(r: Dict[str, Any]) -> Dict[str, Any]:
         "localUrl": str(r.get("localUrl") or ""),
         "mime": str(r.get("mime") or ""),
         "size": _coerce_int(r.get("size"), 0),
+        # Content hash of the uploaded bytes (dedupes re-uploads per profile).
+        "sha256": str(r.get("sha256") or "").strip().lower(),
+        # Set on replicas: the resource whose local copy was re-uploaded for this profile.
+        "sourceId": str(r.get("sourceId") or ""),
         "createdAt": created_at,
         "updatedAt": updated_at,
     }
@@ -319,11 +551,84 @@ def _normalize_template(t: Dict[str, Any]) -> Dict[str, Any]:
         "webappId": webapp_id,
         "referer": referer,
         "payload": payload,
+        # Indexed inputs (file/text/seed/...), so clients and jobs need not walk the payload.
+        "slots": template_slots.build_slots(payload),
         "createdAt": created_at,
         "updatedAt": updated_at,
     }
 
 
+def _template_summary(t: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Template without its payload, for lists and dropdowns.
+    """
+    payload = t.get("payload") if isinstance(t.get("payload"), dict) else {}
+    inputs = payload.get("inputs") if isinstance(payload.get("inputs"), list) else []
+    fields: List[str] = []
+    for inp in inputs:
+        if isinstance(inp, dict) and inp.get("fieldName") and str(inp["fieldName"]) not in fields:
+            fields.append(str(inp["fieldName"]))
+    return {
+        "id": str(t.get("id") or ""),
+        "name": str(t.get("name") or ""),
+        "webappId": str(t.get("webappId") or ""),
+        "referer": str(t.get("referer") or ""),
+        "inputCount": len(inputs),
+        "fields": fields,
+        "createdAt": str(t.get("createdAt") or ""),
+        "updatedAt": str(t.get("updatedAt") or ""),
+    }
+
+
+def _template_search_text(t: Dict[str, Any]) -> str:
+    payload = t.get("payload") if isinstance(t.get("payload"), dict) else {}
+    inputs = payload.get("inputs") if isinstance(payload.get("inputs"), list) else []
+    parts = [str(t.get("name") or ""), str(t.get("webappId") or "")]
+    for inp in inputs:
+        if isinstance(inp, dict):
+            parts.extend(str(inp.get(k) or "") for k in ("fieldName", "nodeName", "description"))
+    return "\n".join(parts).lower()
+
+
+def _load_template_index() -> Tuple[List[Tuple[str, Dict[str, Any]]], Dict[str, Dict[str, Any]]]:
+    """
+    ([(search text, summary)] in stored order, {id: template}). Treat both as read-only.
+    """
+    global _template_index_sig, _template_index, _templates_by_id
+    sig = file_signature(TEMPLATES_PATH)
+    with _template_index_lock:
+        if sig != _template_index_sig:
+            templates = _load_templates()
+            _template_index = [(_template_search_text(t), _template_summary(t)) for t in templates]
+            _templates_by_id = {str(t.get("id") or ""): t for t in templates}
+            _template_index_sig = sig
+        return _template_index, _templates_by_id
+
+
+def _get_template(template_id: str) -> Optional[Dict[str, Any]]:
+    return _load_template_index()[1].get(template_id)
+
+
+def _compiled_template(t: Dict[str, Any]) -> template_slots.CompiledTemplate:
+    tid = str(t.get("id") or "")
+    stamp = str(t.get("updatedAt") or "")
+    with _compiled_templates_lock:
+        hit = _compiled_templates.get(tid)
+    if hit is not None and hit[0] == stamp:
+        return hit[1]
+    payload = t.get("payload") if isinstance(t.get("payload"), dict) else {}
+    slots = t.get("slots") if isinstance(t.get("slots"), list) else None
+    compiled = template_slots.compile_payload(payload, slots)
+    with _compiled_templates_lock:
+        _compiled_templates[tid] = (stamp, compiled)
+    return compiled
+
+
+def _record_token_expiry(host: str, record: Dict[str, Any]) -> Optional[float]:
+    auth = rh_client.parse_record(host, record)
+    return rh_client.parse_token_expiry(rh_client.extract_access_token(auth))
+
+
 def _normalize_cookie_profile(host: str, record: Dict[str, Any]) -> Dict[str, Any]:
     h = host.strip() if isinstance(host, str) and host.strip() else "www.runninghub.ai"
     rec = record if isinstance(record, dict) else {}
@@ -338,6 +643,7 @@ def _normalize_cookie_profile(host: str, record: Dict[str, Any]) -> Dict[str, An
     ui = _extract_user_info_from_record(rec)
     user_id = _extract_user_id_from_record(rec)
     total_coin = _extract_total_coin_from_user_info(ui)
+    exp = _record_token_expiry(h, rec)
     return {
         "id": pid,
         "host": h,
@@ -345,12 +651,809 @@ def _normalize_cookie_profile(host: str, record: Dict[str, Any]) -> Dict[str, An
         "userId": user_id,
         "totalCoin": total_coin,
         "userInfoUpdatedAt": "",
+        "tokenExpiresAt": _epoch_iso(exp) if exp else "",
         "record": rec,
         "createdAt": now,
         "updatedAt": now,
     }
 
 
+def _coin_value(total_coin: Any) -> Optional[float]:
+    try:
+        s = str(total_coin if total_coin is not None else "").strip()
+        return float(s) if s else None
+    except Exception:
+        return None
+
+
+def _cookie_summary(p: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Slim projection of a cookie profile for lists/dropdowns (no TokenMaster record).
+    """
+    rec = p.get("record") if isinstance(p.get("record"), dict) else {}
+    user_id = str(p.get("userId") or "").strip()
+    total_coin = str(p.get("totalCoin") or "").strip()
+    if rec and (not user_id or not total_coin):
+        ui = _extract_user_info_from_record(rec)
+        if not user_id:
+            uid = ui.get("id")
+            user_id = str(uid).strip() if uid else ""
+        if not total_coin:
+            total_coin = _extract_total_coin_from_user_info(ui)
+    expires_at = str(p.get("tokenExpiresAt") or "")
+    if not expires_at and rec:
+        exp = _record_token_expiry(str(p.get("host") or ""), rec)
+        expires_at = _epoch_iso(exp) if exp else ""
+    return {
+        "id": str(p.get("id") or ""),
+        "host": str(p.get("host") or ""),
+        "name": str(p.get("name") or ""),
+        "userId": user_id,
+        "totalCoin": total_coin,
+        "userInfoUpdatedAt": str(p.get("userInfoUpdatedAt") or ""),
+        "tokenExpiresAt": expires_at,
+        "createdAt": str(p.get("createdAt") or ""),
+        "updatedAt": str(p.get("updatedAt") or ""),
+    }
+
+
+def _load_cookie_summaries() -> List[Dict[str, Any]]:
+    global _cookie_summaries_sig, _cookie_summaries
+    sig = file_signature(COOKIES_PATH)
+    with _cookie_summaries_lock:
+        if sig != _cookie_summaries_sig:
+            _cookie_summaries = [_cookie_summary(p) for p in _load_cookies()]
+            _cookie_summaries_sig = sig
+        return [dict(s) for s in _cookie_summaries]
+
+
+def _set_profile_health(profile_id: str, usable: bool, reason: str = "") -> None:
+    with _profile_health_lock:
+        _profile_health[profile_id] = (time.monotonic(), usable, reason)
+
+
+def _profile_problem(profile: Dict[str, Any], *, probe: bool = False, ttl: Optional[float] = None) -> str:
+    """
+    Why this profile should not be dispatched ("" if it looks usable).
+
+    Checks the token `exp` claim first (free), then the cached probe result. With
+    probe=True and no fresh cached result, calls getUserInfo once to find out.
+    """
+    pid = str(profile.get("id") or "")
+    if "tokenExpiresAt" in profile:
+        exp = _iso_epoch(profile.get("tokenExpiresAt"))
+    else:
+        rec = profile.get("record")
+        exp = _record_token_expiry(str(profile.get("host") or ""), rec) if isinstance(rec, dict) else None
+    if exp is not None and exp - TOKEN_EXPIRY_MARGIN_SEC <= time.time():
+        return f"token expired at {_epoch_iso(exp)}"
+
+    if ttl is None:
+        ttl = float(_load_settings().get("profileProbeTtlSec", 600))
+    with _profile_health_lock:
+        cached = _profile_health.get(pid)
+    if cached is not None and time.monotonic() - cached[0] < ttl:
+        return "" if cached[1] else (cached[2] or "profile invalid")
+
+    if probe and isinstance(profile.get("record"), dict):
+        req_timeout = float(_load_settings().get("requestTimeoutSec", 25.0))
+        try:
+            _request_total_coin(profile, "", req_timeout)
+        except Exception:
+            # Network trouble is not proof of a dead account; auth failures were recorded.
+            pass
+        with _profile_health_lock:
+            cached = _profile_health.get(pid)
+        if cached is not None and not cached[1]:
+            return cached[2] or "profile invalid"
+    return ""
+
+
+def _busy_profile_ids() -> set:
+    with _jobs_lock:
+        return {
+            str(j.get("profileId") or "")
+            for j in _jobs.values()
+            if j.get("status") in ("queued", "running")
+        }
+
+
+def _pick_alternative_profile(profile: Dict[str, Any], *, probe: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Best usable replacement on the same host: not busy, highest known balance first.
+    """
+    host = str(profile.get("host") or "")
+    busy = _busy_profile_ids()
+    candidates = [
+        p for p in _load_cookies()
+        if p.get("id") != profile.get("id") and str(p.get("host") or "") == host and str(p.get("id") or "") not in busy
+    ]
+    candidates.sort(key=lambda p: _coin_value(p.get("totalCoin")) or 0.0, reverse=True)
+    for p in candidates:
+        if not _profile_problem(p, probe=probe):
+            return p
+    return None
+
+
+def _job_dedupe_hash(
+    template_id: str,
+    profile_id: str,
+    payload_text: str,
+    no_auth: bool,
+    token_override: str,
+) -> str:
+    h = hashlib.sha256()
+    for part in (template_id, profile_id, "1" if no_auth else "0", hashlib.sha256(token_override.encode("utf-8")).hexdigest()):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    h.update(payload_text.encode("utf-8"))
+    return "hash:" + h.hexdigest()
+
+
+def _coalesced_job(keys: List[str], ttl: float) -> Optional[Dict[str, Any]]:
+    """
+    An in-flight job, or a successful one finished within `ttl`, registered under any of
+    `keys`. Caller holds _jobs_lock.
+    """
+    global _job_keys_pruned_at
+    now = time.time()
+
+    def live(j: Optional[Dict[str, Any]]) -> bool:
+        if j is None:
+            return False
+        status = j.get("status")
+        return status in ("queued", "running") or (status == "success" and now - (_iso_epoch(j.get("updatedAt")) or 0.0) <= ttl)
+
+    if now - _job_keys_pruned_at >= JOB_KEYS_PRUNE_SEC:
+        _job_keys_pruned_at = now
+        for key in [k for k, jid in _job_keys.items() if not live(_jobs.get(jid))]:
+            del _job_keys[key]
+    for key in keys:
+        j = _jobs.get(_job_keys.get(key, ""))
+        if live(j):
+            return j
+    return None
+
+
+def _attach_to_coalesced(
+    hit: Dict[str, Any],
+    chain: List[Dict[str, Any]],
+    callback_url: str,
+    batch_id: str,
+    batch_callback_url: str,
+) -> Optional[Dict[str, Any]]:
+    """
+    Carry a coalesced submission's `then` chain and callbacks over to the job it attaches to,
+    so a retried submission does not lose them. 409 if that job already has a different
+    chain or callbackUrl, or belongs to another batch than batchCallbackUrl names.
+
+    Returns what still has to run when the job has already succeeded (for
+    _run_late_followups), else None. Caller holds _jobs_lock.
+    """
+    job_id = str(hit.get("id") or "")
+    fields: Dict[str, Any] = {}
+    if chain and hit.get("chain") != chain:
+        if hit.get("chain"):
+            raise HTTPException(status_code=409, detail=f"identical job {job_id} already has a different chain")
+        fields["chain"] = chain
+    if callback_url and hit.get("callbackUrl") != callback_url:
+        if hit.get("callbackUrl"):
+            raise HTTPException(status_code=409, detail=f"identical job {job_id} already has a different callbackUrl")
+        fields["callbackUrl"] = callback_url
+    urls = [callback_url] if "callbackUrl" in fields else []
+    if batch_callback_url:
+        if str(hit.get("batchId") or "") != batch_id:
+            raise HTTPException(status_code=409, detail=f"identical job {job_id} is not in batch {batch_id}")
+        if _batch_callbacks.get(batch_id) != batch_callback_url:
+            _batch_callbacks[batch_id] = batch_callback_url
+            urls.append(batch_callback_url)
+
+    hit["coalesced"] = int(hit.get("coalesced") or 0) + 1
+    if not fields and not urls:
+        return None
+    hit.update(fields)
+    if hit.get("status") in JOB_ACTIVE_STATUSES:
+        # _job_finished picks them up from the record.
+        if _job_store is not None and fields:
+            _job_attached.setdefault(job_id, {}).update(fields)
+        return {"job": dict(hit), "fields": fields, "urls": [], "chain": False}
+    return {"job": dict(hit), "fields": fields, "urls": urls, "chain": "chain" in fields}
+
+
+def _run_late_followups(late: Optional[Dict[str, Any]]) -> None:
+    """
+    Record what _attach_to_coalesced attached, and deliver the callbacks / start the chain
+    a finished job would have run had they been there when it ended.
+    """
+    if late is None:
+        return
+    job = late["job"]
+    job_id = str(job.get("id") or "")
+    if late["fields"]:
+        _note_job(job_id, f"coalesced submission attached {', '.join(sorted(late['fields']))}", **late["fields"])
+    if late["urls"]:
+        with _completions_lock:
+            event = next((e for e in reversed(_completions) if e["job"].get("id") == job_id), None)
+        event = event or _completion_event(job, 0)
+        for url in dict.fromkeys(late["urls"]):
+            _callback_pool.submit(_deliver_callback, job_id, url, event)
+    if late["chain"]:
+        _upload_pool.submit(_continue_chain, job)
+
+
+# Stages that overlap others ("first_history_hit" is part of "generate") or happen outside a
+# slot ("queue"): histogram only, kept out of the averages behind the wait estimate.
+HISTOGRAM_ONLY_STAGES = ("queue", "first_history_hit")
+
+
+def _record_stage(stage: str, seconds: float, sink: Optional[Dict[str, List[float]]] = None) -> None:
+    """
+    Observe a stage timing; also collect it in `sink` (a worker job's timings, replayed by
+    the webapp through _replay_shared_traces).
+    """
+    if stage in HISTOGRAM_ONLY_STAGES:
+        metrics.STAGE_SECONDS.observe(seconds, stage)
+    else:
+        _observe_stage(stage, seconds)
+    if sink is not None:
+        sink.setdefault(stage, []).append(round(seconds, 6))
+
+
+def _observe_stage(stage: str, seconds: float) -> None:
+    metrics.STAGE_SECONDS.observe(seconds, stage)
+    with _stage_stats_lock:
+        n, avg = _stage_stats.get(stage, (0, 0.0))
+        avg = seconds if n == 0 else avg + STAGE_EWMA_ALPHA * (seconds - avg)
+        _stage_stats[stage] = (n + 1, avg)
+
+
+def _stage_averages() -> Dict[str, float]:
+    with _stage_stats_lock:
+        return {k: round(v[1], 3) for k, v in _stage_stats.items()}
+
+
+def _expected_run_sec() -> float:
+    """
+    Typical slot hold time: observed run time, else the sum of observed stages, else a default.
+    """
+    avgs = _stage_averages()
+    if "run" in avgs:
+        return max(1.0, avgs["run"])
+    stages = sum(v for k, v in avgs.items() if k != "run")
+    return max(1.0, stages) if stages else DEFAULT_JOB_RUN_SEC
+
+
+def _estimate_wait_sec(ahead: int, active: int, concurrency: int) -> float:
+    """
+    Time until a job with `ahead` queued jobs in front of it gets a slot.
+    """
+    busy = ahead + active
+    if busy < concurrency:
+        return 0.0
+    return math.ceil((busy - concurrency + 1) / concurrency) * _expected_run_sec()
+
+
+def _job_dispatch_loop() -> None:
+    while not _shutdown_event.is_set():
+        concurrency = int(_load_settings().get("jobConcurrency", MAX_CONCURRENT_JOBS))
+        with _job_queue_cv:
+            while _job_queue and len(_active_job_slots) < concurrency:
+                _, _, job_id, fn = heapq.heappop(_job_queue)
+                _active_job_slots.add(job_id)
+                # Keep threads daemon so Ctrl+C can exit.
+                threading.Thread(target=fn, daemon=True, name=f"job-{job_id}").start()
+            _job_queue_cv.wait(timeout=1.0)
+
+
+def _queue_full_error(queued: int, active: int, concurrency: int) -> HTTPException:
+    wait = _estimate_wait_sec(queued, active, concurrency)
+    # On average one slot frees up every run/concurrency seconds.
+    retry_after = max(1, math.ceil(_expected_run_sec() / concurrency))
+    return HTTPException(
+        status_code=429,
+        detail=f"job queue full ({queued} queued, {active} running); estimated wait {int(wait)}s",
+        headers={"Retry-After": str(retry_after), "X-Estimated-Wait": str(int(wait))},
+    )
+
+
+def _enqueue_job(job_id: str, priority: int, fn: Any, depth: int, concurrency: int) -> float:
+    """
+    Queue a job runner; returns the estimated wait in seconds. Raises 429 (with
+    Retry-After) when `depth` jobs are already waiting.
+    """
+    global _job_dispatcher, _job_queue_seq
+    with _job_queue_cv:
+        queued = len(_job_queue)
+        active = len(_active_job_slots)
+        if queued >= depth:
+            raise _queue_full_error(queued, active, concurrency)
+        ahead = sum(1 for item in _job_queue if item[0] <= priority)
+        _job_queue_seq += 1
+        heapq.heappush(_job_queue, (priority, _job_queue_seq, job_id, fn))
+        if _job_dispatcher is None or not _job_dispatcher.is_alive():
+            _job_dispatcher = threading.Thread(target=_job_dispatch_loop, daemon=True, name="job-dispatcher")
+            _job_dispatcher.start()
+        _job_queue_cv.notify_all()
+    return _estimate_wait_sec(ahead, active, concurrency)
+
+
+def _dequeue_job(job_id: str) -> bool:
+    """
+    Drop a job that is still waiting in the queue. False if it was not queued.
+    """
+    with _job_queue_cv:
+        for i, item in enumerate(_job_queue):
+            if item[2] == job_id:
+                _job_queue[i] = _job_queue[-1]
+                _job_queue.pop()
+                heapq.heapify(_job_queue)
+                return True
+    return False
+
+
+def _release_job_slot(job_id: str) -> None:
+    """
+    Give the job's slot back to the dispatcher. Safe to call more than once.
+    """
+    with _job_queue_cv:
+        if job_id in _active_job_slots:
+            _active_job_slots.discard(job_id)
+            _job_queue_cv.notify_all()
+
+
+def _enqueue_shared_job(job: Dict[str, Any], spec: JobSpec, priority: int, depth: int, concurrency: int) -> float:
+    """
+    Put a job on the shared queue (RH_JOB_QUEUE) for a worker; returns the estimated wait.
+    `concurrency` stands in for the workers' combined capacity in the estimate. Raises 429
+    like _enqueue_job. Does I/O on the shared volume: never call with _jobs_lock held.
+    """
+    assert _job_store is not None
+    counts = _job_store.counts()
+    queued, active = counts.get("queued", 0), counts.get("running", 0)
+    if queued >= depth:
+        raise _queue_full_error(queued, active, concurrency)
+    wait = _estimate_wait_sec(_job_store.queued_ahead(priority), active, concurrency)
+    # enqueuedAt: the worker measures the queue stage from it (createdAt has 1s resolution).
+    _job_store.enqueue(dict(job, estimatedWaitSec=wait), dict(spec.to_dict(), enqueuedAt=time.time()), priority)
+    _start_job_store_sync()
+    return wait
+
+
+def _mirror_shared_jobs(rows: List[Dict[str, Any]]) -> None:
+    """
+    Copy store records over their _jobs mirrors (keeping the local coalesce count).
+    """
+    finished: List[Dict[str, Any]] = []
+    with _jobs_lock:
+        for row in rows:
+            j = _jobs.get(str(row.get("id") or ""))
+            if j is None:
+                continue
+            was_active = j.get("status") in JOB_ACTIVE_STATUSES
+            coalesced = j.get("coalesced")
+            j.clear()
+            j.update(row)
+            if coalesced:
+                j["coalesced"] = coalesced
+            j.update(_job_attached.get(j["id"], {}))
+            if j.get("status") not in JOB_ACTIVE_STATUSES:
+                _job_attached.pop(j["id"], None)
+                if was_active:
+                    finished.append(dict(j))
+    if finished:
+        _replay_shared_traces([str(j["id"]) for j in finished], observe=True)
+    for job in finished:
+        _job_finished(job)
+
+
+def _replay_shared_traces(job_ids: List[str], *, observe: bool) -> None:
+    """
+    Load timelines recorded by workers (saved before a job's final status is written) into
+    this process's trace buffer; with `observe`, also feed their stage timings to /metrics
+    and the wait estimate. Caller must not hold _jobs_lock (shared volume I/O).
+    """
+    assert _job_store is not None
+    try:
+        saved = _job_store.traces(job_ids)
+    except Exception:
+        return
+    for job_id, data in saved.items():
+        tracing.load(job_id, data)
+        if observe:
+            for stage, values in (data.get("stages") or {}).items():
+                for seconds in values:
+                    _record_stage(stage, float(seconds))
+
+
+def _job_store_sync_loop() -> None:
+    assert _job_store is not None
+    while not _shutdown_event.wait(JOB_STORE_SYNC_SEC):
+        with _jobs_lock:
+            ids = [jid for jid, j in _jobs.items() if j.get("status") in JOB_ACTIVE_STATUSES]
+        if not ids:
+            continue
+        try:
+            rows = _job_store.jobs(ids)
+        except Exception:
+            # Shared volume hiccup (locked/unreachable); retry next round.
+            continue
+        _mirror_shared_jobs(rows)
+
+
+def _start_job_store_sync() -> None:
+    global _job_store_sync
+    with _job_queue_cv:
+        if _job_store_sync is None or not _job_store_sync.is_alive():
+            _job_store_sync = threading.Thread(target=_job_store_sync_loop, daemon=True, name="job-store-sync")
+            _job_store_sync.start()
+
+
+@app.on_event("startup")
+def _load_shared_jobs() -> None:
+    # Shared queue: show jobs enqueued before this process started (and keep them fresh).
+    if _job_store is None:
+        return
+    rows = _job_store.jobs(limit=1000)
+    with _jobs_lock:
+        for row in rows:
+            _jobs.setdefault(str(row.get("id") or ""), row)
+    _start_job_store_sync()
+
+
+def _queue_snapshot() -> Tuple[Dict[int, int], int]:
+    """
+    (queued jobs per priority level, running jobs), from the shared queue when configured.
+    """
+    if _job_store is not None:
+        return _job_store.queued_by_priority(), _job_store.counts().get("running", 0)
+    with _job_queue_cv:
+        by_level: Dict[int, int] = {}
+        for item in _job_queue:
+            by_level[item[0]] = by_level.get(item[0], 0) + 1
+        return by_level, len(_active_job_slots)
+
+
+@app.get("/api/queue")
+def queue_status() -> Any:
+    settings = _load_settings()
+    concurrency = int(settings.get("jobConcurrency", MAX_CONCURRENT_JOBS))
+    by_level, active = _queue_snapshot()
+    queued = sum(by_level.values())
+    by_priority = {name: by_level.get(level, 0) for name, level in JOB_PRIORITIES.items()}
+    return {
+        "ok": True,
+        "shared": _job_store is not None,
+        "queued": queued,
+        "active": active,
+        "concurrency": concurrency,
+        "depth": int(settings.get("jobQueueDepth", 200)),
+        "byPriority": by_priority,
+        "stageAvgSec": _stage_averages(),
+        "estimatedWaitSec": _estimate_wait_sec(queued, active, concurrency),
+    }
+
+
+def _queue_gauges() -> Dict[Tuple[str, ...], float]:
+    by_level, _ = _queue_snapshot()
+    return {(name,): float(by_level.get(level, 0)) for name, level in JOB_PRIORITIES.items()}
+
+
+def _slot_gauges() -> Dict[Tuple[str, ...], float]:
+    _, active = _queue_snapshot()
+    concurrency = int(_load_settings().get("jobConcurrency", MAX_CONCURRENT_JOBS))
+    return {("active",): float(active), ("limit",): float(concurrency)}
+
+
+def _job_status_gauges() -> Dict[Tuple[str, ...], float]:
+    counts: Dict[Tuple[str, ...], float] = {}
+    with _jobs_lock:
+        for j in _jobs.values():
+            key = (str(j.get("status") or ""),)
+            counts[key] = counts.get(key, 0.0) + 1
+    return counts
+
+
+metrics.register(metrics.Gauge("rh_job_queue_depth", "Jobs waiting for a slot, per priority.", ("priority",), _queue_gauges))
+metrics.register(metrics.Gauge("rh_job_slots", "Job slots in use (active) and the configured jobConcurrency (limit).", ("kind",), _slot_gauges))
+metrics.register(metrics.Gauge("rh_jobs", "Jobs in memory per status.", ("status",), _job_status_gauges))
+
+
+@app.get("/metrics")
+def get_metrics() -> Any:
+    """
+    Prometheus text format: queue/slot gauges, stage and upstream latency histograms,
+    upstream status codes, transfer bytes and storage timings.
+    """
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.post("/api/admin/profile")
+def profile_server(seconds: float = 10.0, intervalMs: float = 5.0, format: str = "collapsed") -> Any:
+    """
+    Sample all threads (request handlers, job threads, dispatcher) for `seconds`, then return
+    collapsed stacks (format=collapsed, for flamegraph.pl / speedscope) or a pstats-like
+    table (format=top). Blocks for the duration; one run at a time.
+    """
+    fmt = format.strip().lower()
+    if fmt not in ("collapsed", "top"):
+        raise HTTPException(status_code=400, detail="format must be collapsed or top")
+    try:
+        prof = profiler.sample(seconds, intervalMs / 1000.0, stop=_shutdown_event)
+    except profiler.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    text = prof.collapsed() if fmt == "collapsed" else prof.top()
+    return Response(
+        content=text,
+        media_type="text/plain; charset=utf-8",
+        headers={"X-Profile-Samples": str(prof.samples), "X-Profile-Seconds": f"{prof.seconds:.3f}"},
+    )
+
+
+def _cancel_job(job_id: str, reason: str = "cancelled") -> bool:
+    """
+    Stop a queued/running job and hand its slot back at once. The job thread notices the
+    stop event at its next check (an in-flight HTTP request is not interrupted, but it no
+    longer holds a slot). False if the job is not active.
+    """
+    if _job_store is not None:
+        # The worker running it notices at its next heartbeat.
+        cancelled = _job_store.cancel(job_id, reason, _now_iso())
+        _mirror_shared_jobs(_job_store.jobs([job_id]))
+        return cancelled
+    with _jobs_lock:
+        j = _jobs.get(job_id)
+        if j is None or j.get("status") not in JOB_ACTIVE_STATUSES:
+            return False
+        j["status"] = "cancelled"
+        j["error"] = reason
+        j["logs"].append(f"[{_now_iso()}] cancelled: {reason}")
+        j["updatedAt"] = _now_iso()
+        ev = _job_stop_events.get(job_id)
+        finished = dict(j)
+    if ev is not None:
+        ev.set()
+    _job_finished(finished)
+    if _dequeue_job(job_id):
+        with _jobs_lock:
+            _job_stop_events.pop(job_id, None)
+    else:
+        _release_job_slot(job_id)
+    return True
+
+
+def _job_matches(j: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    for key in ("batchId", "templateId", "profileId"):
+        want = filters.get(key)
+        if want and str(j.get(key) or "") != str(want):
+            return False
+    return True
+
+
+def _completion_event(job: Dict[str, Any], seq: int) -> Dict[str, Any]:
+    return {
+        "seq": seq,
+        "event": "job.finished",
+        "job": {k: job.get(k) for k in (
+            "id", "status", "error", "batchId", "templateId", "templateName", "profileId", "taskId",
+            "taskStatus", "fileUrl", "downloadPath", "downloadPaths", "extractedFiles", "createdAt", "updatedAt",
+        )},
+    }
+
+
+def _job_finished(job: Dict[str, Any]) -> None:
+    """
+    A job reached a final status: append it to the completions feed, wake feed readers
+    and POST to its callback URLs.
+    """
+    global _completion_seq
+    with _completions_lock:
+        _completion_seq += 1
+        event = _completion_event(job, _completion_seq)
+        _completions.append(event)
+        waiters = list(_completion_waiters)
+    for loop, ev in waiters:
+        try:
+            loop.call_soon_threadsafe(ev.set)
+        except RuntimeError:
+            # Loop already closed; its request is gone.
+            pass
+    urls = [str(job.get("callbackUrl") or "")]
+    with _jobs_lock:
+        urls.append(_batch_callbacks.get(str(job.get("batchId") or ""), ""))
+    for url in dict.fromkeys(u for u in urls if u):
+        _callback_pool.submit(_deliver_callback, str(job.get("id") or ""), url, event)
+    if job.get("chain"):
+        if job.get("status") == "success":
+            # Upload + submit off this thread (a job thread or the store sync loop).
+            _upload_pool.submit(_continue_chain, job)
+        else:
+            _note_job(str(job.get("id") or ""), f"chain stopped: job {job.get('status')}")
+
+
+def _callback_headers(body: bytes, secret: str) -> Dict[str, str]:
+    """
+    X-RH-Signature: sha256=HMAC(secret, "<X-RH-Timestamp>." + body), hex. Receivers should
+    recompute it and reject stale timestamps.
+    """
+    ts = str(int(time.time()))
+    headers = {"Content-Type": "application/json", "X-RH-Event": "job.finished", "X-RH-Timestamp": ts, "X-RH-Delivery": _gen_id()}
+    if secret:
+        mac = hmac.new(secret.encode("utf-8"), ts.encode("ascii") + b"." + body, hashlib.sha256)
+        headers["X-RH-Signature"] = "sha256=" + mac.hexdigest()
+    return headers
+
+
+def _deliver_callback(job_id: str, url: str, event: Dict[str, Any]) -> None:
+    settings = _load_settings()
+    body = json.dumps(event, ensure_ascii=False).encode("utf-8")
+    timeout = float(settings.get("requestTimeoutSec", 25.0))
+    result = ""
+    for attempt in range(1, CALLBACK_ATTEMPTS + 1):
+        try:
+            resp = requests.post(url, data=body, headers=_callback_headers(body, str(settings.get("callbackSecret") or "")), timeout=timeout)
+            result = f"HTTP {resp.status_code}"
+            if resp.status_code < 500 and resp.status_code != 429:
+                break
+        except requests.RequestException as e:
+            result = type(e).__name__
+        # 1s, 2s, 4s, 8s between attempts; give up early on shutdown.
+        if attempt == CALLBACK_ATTEMPTS or _shutdown_event.wait(2 ** (attempt - 1)):
+            break
+    _note_job(job_id, f"callback {'ok' if result.startswith('HTTP 2') else 'failed'}: {url} -> {result} (attempt {attempt})")
+
+
+def _note_job(job_id: str, msg: str, **fields: Any) -> None:
+    """
+    Log a line (and set fields, never status) on a job that may already be finished;
+    also in the shared queue, where the mirror is no longer refreshed.
+    """
+    if _job_store is not None:
+        now = _now_iso()
+        _job_store.update(job_id, dict(fields, updatedAt=now), log=f"[{now}] {msg}")
+    if fields:
+        _update_local_job(job_id, **fields)
+    _log_local_job(job_id, msg)
+
+
+def _completions_after(after: int, batch_id: str) -> List[Dict[str, Any]]:
+    with _completions_lock:
+        events = [e for e in _completions if e["seq"] > after]
+    if batch_id:
+        events = [e for e in events if e["job"].get("batchId") == batch_id]
+    return events
+
+
+def _callback_url(body: Dict[str, Any], key: str) -> str:
+    url = str(body.get(key) or "").strip()
+    if url and not url.startswith(("http://", "https://")):
+        raise HTTPException(status_code=400, detail=f"{key} must be an http(s) URL")
+    return url
+
+
+def _parse_chain(raw: Any) -> List[Dict[str, Any]]:
+    """
+    Validate `then` of POST /api/jobs: one step or a list of steps run one after another,
+    each { templateId, slot?, slotValues?, profileId?, output?, priority?, callbackUrl? }.
+    `slot` is the file slot (key or input index) that receives the previous job's output
+    (default: the template's first file slot); `output` picks that output (default 0, in
+    extractedFiles, else downloadPaths order).
+    """
+    steps = [raw] if isinstance(raw, dict) else raw
+    if not isinstance(steps, list):
+        raise HTTPException(status_code=400, detail="then must be an object or a list")
+    profile_ids = {str(p.get("id") or "") for p in _load_cookies()}
+    out: List[Dict[str, Any]] = []
+    for n, step in enumerate(steps, start=1):
+        if not isinstance(step, dict):
+            raise HTTPException(status_code=400, detail=f"then[{n}] must be an object")
+        template = _get_template(str(step.get("templateId") or ""))
+        if not template:
+            raise HTTPException(status_code=404, detail=f"then[{n}]: template not found")
+        compiled = _compiled_template(template)
+        slot = str(step.get("slot") or "").strip()
+        if slot:
+            idx = compiled.by_key.get(slot)
+            if idx is None:
+                raise HTTPException(status_code=400, detail=f"then[{n}]: unknown slot: {slot}")
+        else:
+            idx = next((i for i, sl in enumerate(compiled.slots) if sl.get("kind") == "file"), None)
+            if idx is None:
+                raise HTTPException(status_code=400, detail=f"then[{n}]: template has no file slot; set slot")
+        values = step.get("slotValues") or {}
+        _resolve_slot_values(compiled, values)
+        profile_id = str(step.get("profileId") or "")
+        if profile_id and profile_id not in profile_ids:
+            raise HTTPException(status_code=404, detail=f"then[{n}]: cookie profile not found")
+        out.append(
+            {
+                "templateId": template["id"],
+                "slot": compiled.slots[idx]["key"],
+                "slotValues": values,
+                "profileId": profile_id,
+                "output": max(0, _coerce_int(step.get("output"), 0)),
+                "priority": step.get("priority", "normal"),
+                "callbackUrl": _callback_url(step, "callbackUrl"),
+            }
+        )
+    return out
+
+
+def _stage_for_upload(path: Path) -> Path:
+    """
+    Staging copy of a downloaded file for _save_uploaded_resources (which moves it into
+    resource_files): a hard link when possible, so the bytes are not copied.
+    """
+    STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    staged = STAGING_DIR / f"{_gen_id()}.part"
+    try:
+        os.link(path, staged)
+    except OSError:
+        shutil.copyfile(path, staged)
+    return staged
+
+
+def _continue_chain(parent: Dict[str, Any]) -> None:
+    """
+    Feed a finished job's output into the next step of its chain: upload the downloaded
+    file for the next profile (or reuse an earlier upload of the same bytes), then submit
+    the next job with the remaining steps.
+    """
+    parent_id = str(parent.get("id") or "")
+    step, rest = parent["chain"][0], parent["chain"][1:]
+    try:
+        outputs = list(parent.get("extractedFiles") or []) or list(parent.get("downloadPaths") or [])
+        if step["output"] >= len(outputs):
+            raise RuntimeError(f"output {step['output']} not found ({len(outputs)} outputs)")
+        link = outputs[step["output"]]
+        path = DOWNLOAD_DIR / link[len("/downloads/"):]
+        if not path.is_file():
+            raise RuntimeError(f"output file missing: {link}")
+
+        profile_id = step["profileId"] or str(parent.get("profileId") or "")
+        profile = next((p for p in _load_cookies() if p.get("id") == profile_id), None)
+        if profile is None:
+            raise RuntimeError("cookie profile not found")
+        template = _get_template(step["templateId"]) or {}
+        webapp_id = str(template.get("webappId") or "")
+
+        # The post-processing hash, when it ran, saves reading the file again.
+        pp = (parent.get("postprocess") or {}).get(link) or {}
+        sha256 = str((pp.get("sha256") or {}).get("sha256") or "")
+        if not sha256:
+            h = hashlib.sha256()
+            for chunk in _iter_file_chunks(path):
+                h.update(chunk)
+            sha256 = h.hexdigest()
+        res = _find_resource_by_hash(sha256, profile_id)
+        if res is None:
+            size = int(path.stat().st_size)
+            mime = mimetypes.guess_type(path.name)[0] or ""
+            name, out = _upload_to_runninghub(profile, webapp_id, path.name, mime, _iter_file_chunks(path), size)
+            res = _save_uploaded_resources([(profile, name, out)], webapp_id, path.name, _stage_for_upload(path), sha256, size, mime)[0]
+            _note_job(parent_id, f"chain: uploaded {path.name} as {name}")
+        else:
+            _note_job(parent_id, f"chain: reusing upload {res.get('name')} of {path.name}")
+
+        body: Dict[str, Any] = {
+            "templateId": step["templateId"],
+            "profileId": profile_id,
+            "slotValues": dict(step["slotValues"], **{step["slot"]: res["name"]}),
+            "batchId": parent.get("batchId") or "",
+            "priority": step["priority"],
+            "chainParent": parent_id,
+        }
+        if step["callbackUrl"]:
+            body["callbackUrl"] = step["callbackUrl"]
+        if rest:
+            body["then"] = rest
+        child = start_job(body)["job"]
+        _note_job(parent_id, f"chain: started job {child['id']}", chainNext=child["id"])
+    except HTTPException as e:
+        _note_job(parent_id, f"chain failed: HTTP {e.status_code} {e.detail}")
+    except Exception as e:
+        _note_job(parent_id, f"chain failed: {e}")
+
+
 def _get_job(job_id: str) -> Dict[str, Any]:
     with _jobs_lock:
         j = _jobs.get(job_id)
@@ -364,12 +1467,36 @@ def index() -> Any:
     return (STATIC_DIR / "index.html").read_text(encoding="utf-8")
 
 
+def _load_downloads_meta() -> Dict[str, Any]:
+    """
+    All post-processing results, merged from the per-job files (re-read only when changed).
+    """
+    try:
+        paths = list(DOWNLOADS_META_DIR.glob("*.json"))
+    except OSError:
+        paths = []
+    merged: Dict[str, Any] = {}
+    with _downloads_meta_lock:
+        for path in paths:
+            sig = file_signature(path)
+            hit = _downloads_meta_cache.get(path.name)
+            if hit is None or hit[0] != sig:
+                data = read_json(path, {}, kind="downloads_meta")
+                hit = (sig, data if isinstance(data, dict) else {})
+                _downloads_meta_cache[path.name] = hit
+            merged.update(hit[1])
+        for name in set(_downloads_meta_cache) - {p.name for p in paths}:
+            del _downloads_meta_cache[name]
+    return merged
+
+
 @app.get("/api/downloads")
 def list_downloads() -> Any:
     """
     List files under webapp/downloads for the "下载" tab.
     """
     items: List[Dict[str, Any]] = []
+    meta = _load_downloads_meta()
     try:
         if not DOWNLOAD_DIR.exists():
             return {"ok": True, "items": []}
@@ -393,6 +1520,8 @@ def list_downloads() -> Any:
                         "mime": mime or "",
                     }
                 )
+                if rel in meta:
+                    items[-1]["postprocess"] = meta[rel]
             except Exception:
                 continue
     except Exception:
@@ -417,141 +1546,292 @@ def put_settings(body: Dict[str, Any] = Body(...)) -> Any:
 # ---------------- Templates ----------------
 
 @app.get("/api/templates")
-def list_templates() -> Any:
-    return {"ok": True, "templates": _load_templates()}
+def list_templates(q: str = "", webappId: str = "", offset: int = 0, limit: int = 0, full: bool = False) -> Any:
+    """
+    Template summaries (without `payload`) in stored order (new ones first). Optional filters:
+    - q: whitespace-separated terms, each matched (case-insensitive) against name, webappId
+      and input fieldName/nodeName/description
+    - webappId: exact match
+    - offset/limit: paging (limit=0 returns all matches); `total` is the match count
+    - full=1: legacy shape, every template with its payload
+    """
+    if full:
+        return {"ok": True, "templates": _load_templates()}
+
+    index, _ = _load_template_index()
+    terms = q.lower().split()
+    wid = webappId.strip()
+    matched = [
+        summary for text, summary in index
+        if (not wid or summary["webappId"] == wid) and all(term in text for term in terms)
+    ]
+    offset = max(0, offset)
+    page = matched[offset:offset + limit] if limit > 0 else matched[offset:]
+    return {
+        "ok": True,
+        "templates": [dict(x) for x in page],
+        "total": len(matched),
+        "offset": offset,
+        "limit": max(0, limit),
+    }
 
 
 @app.post("/api/templates")
 def create_template(body: Dict[str, Any] = Body(...)) -> Any:
-    templates = _load_templates()
     t = _normalize_template(body)
-    templates = [x for x in templates if x.get("id") != t["id"]]
-    templates.insert(0, t)
-    _save_templates(templates)
+    with _templates_lock:
+        templates = [x for x in _load_templates() if x.get("id") != t["id"]]
+        templates.insert(0, t)
+        _save_templates(templates)
+    _compiled_template(t)
     return {"ok": True, "template": t}
 
 
 @app.put("/api/templates/{template_id}")
 def update_template(template_id: str, body: Dict[str, Any] = Body(...)) -> Any:
-    templates = _load_templates()
-    idx = next((i for i, x in enumerate(templates) if x.get("id") == template_id), -1)
-    if idx < 0:
-        raise HTTPException(status_code=404, detail="template not found")
-
-    merged = dict(templates[idx])
-    merged.update(body)
-    merged["id"] = template_id
-    t = _normalize_template(merged)
-    templates[idx] = t
-    _save_templates(templates)
+    with _templates_lock:
+        templates = _load_templates()
+        idx = next((i for i, x in enumerate(templates) if x.get("id") == template_id), -1)
+        if idx < 0:
+            raise HTTPException(status_code=404, detail="template not found")
+
+        merged = dict(templates[idx])
+        merged.update(body)
+        merged["id"] = template_id
+        t = _normalize_template(merged)
+        templates[idx] = t
+        _save_templates(templates)
+    _compiled_template(t)
     return {"ok": True, "template": t}
 
 
 @app.delete("/api/templates/{template_id}")
 def delete_template(template_id: str) -> Any:
-    templates = _load_templates()
-    next_list = [x for x in templates if x.get("id") != template_id]
-    _save_templates(next_list)
+    with _templates_lock:
+        next_list = [x for x in _load_templates() if x.get("id") != template_id]
+        _save_templates(next_list)
+    with _compiled_templates_lock:
+        _compiled_templates.pop(template_id, None)
     return {"ok": True}
 
 
-@app.post("/api/templates/import")
-def import_templates(payload: Any = Body(...)) -> Any:
-    # Accept: {templates:[...]} or [...] or single template object
-    incoming: List[Dict[str, Any]] = []
-    if isinstance(payload, dict) and isinstance(payload.get("templates"), list):
-        incoming = [x for x in payload["templates"] if isinstance(x, dict)]
-    elif isinstance(payload, list):
-        incoming = [x for x in payload if isinstance(x, dict)]
-    elif isinstance(payload, dict):
-        incoming = [payload]
+async def _import_events(request: Request, stream_paths: List[Tuple[str, ...]], fmt: str) -> AsyncIterator[jsonstream.Event]:
+    """
+    Parse an import body as it streams in: JSON, or NDJSON when the content type says so
+    (or ?format=ndjson). Only one record is held in memory at a time.
+    """
+    ndjson = jsonstream.is_ndjson(request.headers.get("content-type", ""), fmt)
+    try:
+        async for ev in jsonstream.aiter_events(request.stream(), stream_paths, ndjson=ndjson):
+            yield ev
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"invalid import body: {e}")
+
+
+def _export_response(pieces: Iterator[str], fmt: str, download: bool, stem: str) -> StreamingResponse:
+    ndjson = jsonstream.is_ndjson("", fmt)
+    headers = {}
+    if download:
+        headers["Content-Disposition"] = f'attachment; filename="{stem}.{"ndjson" if ndjson else "json"}"'
+    return StreamingResponse(
+        (piece.encode("utf-8") for piece in pieces),
+        media_type="application/x-ndjson" if ndjson else "application/json",
+        headers=headers,
+    )
 
-    templates = _load_templates()
-    by_id = {str(t.get("id")): t for t in templates if isinstance(t.get("id"), str)}
 
-    added = 0
-    for raw in incoming:
+@app.post("/api/templates/import")
+async def import_templates(request: Request, format: str = "") -> Any:
+    """
+    Accept: {templates:[...]} or [...] or single template object, or NDJSON (one template per line).
+    """
+    # Records by id in first-seen order (a repeated id keeps the last version).
+    incoming: Dict[str, Dict[str, Any]] = {}
+    imported_ids: List[str] = []
+
+    def upsert(raw: Dict[str, Any]) -> None:
         t = _normalize_template(raw)
-        by_id[t["id"]] = t
-        added += 1
+        incoming[t["id"]] = t
+        imported_ids.append(t["id"])
+
+    streamed = False
+    root: Dict[str, Any] = {}
+    async for kind, path, value in _import_events(request, [(), ("templates",)], format):
+        if kind == "begin":
+            streamed = True
+        elif kind == "item":
+            if isinstance(value, dict):
+                upsert(value)
+        elif len(path) == 1:
+            root[path[0]] = value
+    if not streamed and root:
+        upsert(root)
+
+    def merge() -> int:
+        # Read the stored list only now, under the lock, so edits made while the body
+        # streamed in are kept. Existing ids are replaced in place, new ones go to the
+        # front in import order.
+        with _templates_lock:
+            templates = _load_templates()
+            pos = {str(t.get("id")): i for i, t in enumerate(templates) if isinstance(t.get("id"), str)}
+            fresh: List[Dict[str, Any]] = []
+            for tid, t in incoming.items():
+                if tid in pos:
+                    templates[pos[tid]] = t
+                else:
+                    fresh.append(t)
+            merged = fresh + templates
+            _save_templates(merged)
+        return len(merged)
+
+    count = await run_in_threadpool(merge)
+    with _compiled_templates_lock:
+        for tid in imported_ids:
+            _compiled_templates.pop(tid, None)
+    return {"ok": True, "count": count, "imported": len(imported_ids)}
+
+
+def _resolve_slot_values(compiled: template_slots.CompiledTemplate, values: Any) -> Dict[int, Any]:
+    if not isinstance(values, dict):
+        raise HTTPException(status_code=400, detail="slotValues must be an object")
+    try:
+        return template_slots.resolve_values(compiled, values)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"unknown slot: {e.args[0]}")
 
-    merged = list(by_id.values())
-    merged.sort(key=lambda x: x.get("updatedAt", ""), reverse=True)
-    _save_templates(merged)
-    return {"ok": True, "count": len(merged), "imported": added}
+
+@app.post("/api/templates/{template_id}/render")
+def render_template(template_id: str, body: Optional[Dict[str, Any]] = Body(None)) -> Any:
+    """
+    Payload for a slot -> value map: { values: { "nodeId:fieldName" | inputIndex: value } }.
+    """
+    template = _get_template(template_id)
+    if not template:
+        raise HTTPException(status_code=404, detail="template not found")
+    compiled = _compiled_template(template)
+    values = (body or {}).get("values") if isinstance(body, dict) else None
+    resolved = _resolve_slot_values(compiled, values or {})
+    text = template_slots.render(compiled, resolved)
+    return Response(content='{"ok":true,"payload":' + text + "}", media_type="application/json")
 
 
 @app.get("/api/templates/export")
-def export_templates() -> Any:
-    return {"schemaVersion": 1, "templates": _load_templates()}
+def export_templates(format: str = "", download: bool = False) -> Any:
+    """
+    Streamed {schemaVersion, templates:[...]}, or NDJSON with ?format=ndjson.
+    """
+    templates = _load_templates()
+    if jsonstream.is_ndjson("", format):
+        pieces = jsonstream.iter_ndjson(templates)
+    else:
+        pieces = jsonstream.iter_json_document({"schemaVersion": 1}, "templates", templates)
+    return _export_response(pieces, format, download, "templates")
+
+
+@app.get("/api/templates/{template_id}")
+def get_template(template_id: str) -> Any:
+    """
+    Full template including payload and slots.
+    """
+    template = _get_template(template_id)
+    if not template:
+        raise HTTPException(status_code=404, detail="template not found")
+    return {"ok": True, "template": template}
 
 
 # ---------------- Cookies ----------------
 
 @app.get("/api/cookies")
-def list_cookies() -> Any:
-    out: List[Dict[str, Any]] = []
-    for p in _load_cookies():
-        q = dict(p)
-        rec = q.get("record")
-        if isinstance(rec, dict):
-            if not isinstance(q.get("userId"), str) or not str(q.get("userId") or "").strip():
-                q["userId"] = _extract_user_id_from_record(rec)
-            if not isinstance(q.get("totalCoin"), str) or not str(q.get("totalCoin") or "").strip():
-                ui = _extract_user_info_from_record(rec)
-                q["totalCoin"] = _extract_total_coin_from_user_info(ui)
-        out.append(q)
+def list_cookies(q: str = "", sort: str = "", full: bool = False) -> Any:
+    """
+    Profile summaries (without `record`). Optional filters:
+    - q: case-insensitive match on name/host/userId
+    - sort: "coin" (ascending) or "-coin" (descending); unknown balances go last
+    - full=1: legacy shape including the TokenMaster record
+    """
+    if full:
+        return {"ok": True, "profiles": [dict(p, **_cookie_summary(p)) for p in _load_cookies()]}
+
+    out = _load_cookie_summaries()
+    needle = q.strip().lower()
+    if needle:
+        out = [
+            p for p in out
+            if needle in p["name"].lower() or needle in p["host"].lower() or needle in p["userId"].lower()
+        ]
+
+    key = sort.strip().lower()
+    if key in ("coin", "-coin"):
+        desc = key.startswith("-")
+        known = [p for p in out if _coin_value(p["totalCoin"]) is not None]
+        unknown = [p for p in out if _coin_value(p["totalCoin"]) is None]
+        known.sort(key=lambda p: _coin_value(p["totalCoin"]) or 0.0, reverse=desc)
+        out = known + unknown
+    ttl = float(_load_settings().get("profileProbeTtlSec", 600))
+    for p in out:
+        p["problem"] = _profile_problem(p, ttl=ttl)
     return {"ok": True, "profiles": out}
 
 
 @app.delete("/api/cookies/{profile_id}")
 def delete_cookie(profile_id: str) -> Any:
-    profiles = _load_cookies()
-    next_list = [x for x in profiles if x.get("id") != profile_id]
-    _save_cookies(next_list)
+    with _cookies_lock:
+        next_list = [x for x in _load_cookies() if x.get("id") != profile_id]
+        _save_cookies(next_list)
     return {"ok": True}
 
 
 @app.post("/api/cookies/import")
-def import_cookies(payload: Any = Body(...)) -> Any:
+async def import_cookies(request: Request, format: str = "") -> Any:
     """
     Supports:
     - cookies.txt (single): { host, record: {...} }
     - multicookies.txt (multi): { records: { host: [record, ...] } }
     - bare multi root: { "www.runninghub.ai": [record, ...] }
+    - NDJSON: one { host, record } (or bare record) per line
     """
-    profiles = _load_cookies()
-    added = 0
+    added: List[Dict[str, Any]] = []
 
     def add_one(host: str, record: Dict[str, Any]) -> None:
-        nonlocal profiles, added
-        p = _normalize_cookie_profile(host, record)
-        profiles.insert(0, p)
-        added += 1
+        added.append(_normalize_cookie_profile(host, record))
+
+    ndjson = jsonstream.is_ndjson(request.headers.get("content-type", ""), format)
+    root: Dict[str, Any] = {}
+    async for kind, path, value in _import_events(request, [("records", "*"), ("*",)], format):
+        if kind == "item" and isinstance(value, dict):
+            if ndjson:
+                rec = value.get("record")
+                if isinstance(rec, dict):
+                    add_one(str(value.get("host") or value.get("hostname") or "www.runninghub.ai"), rec)
+                else:
+                    add_one("www.runninghub.ai", value)
+            else:
+                add_one(str(path[-1]), value)
+        elif kind == "value" and len(path) == 1:
+            root[path[0]] = value
+    if isinstance(root.get("record"), dict):
+        add_one(str(root.get("host") or root.get("hostname") or "www.runninghub.ai"), root["record"])
 
-    if isinstance(payload, dict) and isinstance(payload.get("record"), dict):
-        host = payload.get("host") or payload.get("hostname") or "www.runninghub.ai"
-        add_one(str(host), payload["record"])
-    else:
-        root = payload
-        if isinstance(payload, dict) and isinstance(payload.get("records"), dict):
-            root = payload["records"]
+    # Newest first, as if each record had been inserted at the front.
+    added.reverse()
 
-        if isinstance(root, dict):
-            for host, recs in root.items():
-                if not isinstance(recs, list):
-                    continue
-                for r in recs:
-                    if isinstance(r, dict):
-                        add_one(str(host), r)
+    def merge() -> int:
+        # Re-read under the lock: balance refreshes and probes rewrite cookies.json while
+        # a large import is still streaming.
+        with _cookies_lock:
+            profiles = added + _load_cookies()
+            _save_cookies(profiles)
+        return len(profiles)
 
-    _save_cookies(profiles)
-    return {"ok": True, "added": added, "count": len(profiles)}
+    count = await run_in_threadpool(merge)
+    return {"ok": True, "added": len(added), "count": count}
 
 
 @app.get("/api/cookies/export")
-def export_cookies() -> Any:
-    # Export as multi-records shape (multicookies.txt).
+def export_cookies(format: str = "", download: bool = False) -> Any:
+    """
+    Streamed multi-records shape (multicookies.txt), or NDJSON { host, record } lines with ?format=ndjson.
+    """
     profiles = _load_cookies()
     out: Dict[str, List[Dict[str, Any]]] = {}
     for p in profiles:
@@ -560,48 +1840,85 @@ def export_cookies() -> Any:
         if not isinstance(host, str) or not isinstance(record, dict):
             continue
         out.setdefault(host, []).append(record)
-    return {"schemaVersion": 1, "records": out}
+
+    def pieces() -> Iterator[str]:
+        yield '{"schemaVersion": 1, "records": {'
+        for i, (host, records) in enumerate(out.items()):
+            yield ("\n" if i == 0 else ",\n") + json.dumps(host, ensure_ascii=False) + ": ["
+            for j, record in enumerate(records):
+                yield ("\n" if j == 0 else ",\n") + json.dumps(record, ensure_ascii=False)
+            yield "\n]"
+        yield "\n}}"
+
+    if jsonstream.is_ndjson("", format):
+        lines = jsonstream.iter_ndjson({"host": host, "record": r} for host, records in out.items() for r in records)
+        return _export_response(lines, format, download, "multicookies")
+    return _export_response(pieces(), format, download, "multicookies")
+
+
+@app.get("/api/cookies/{profile_id}")
+def get_cookie(profile_id: str) -> Any:
+    profile = next((p for p in _load_cookies() if p.get("id") == profile_id), None)
+    if not profile:
+        raise HTTPException(status_code=404, detail="cookie profile not found")
+    return {"ok": True, "profile": dict(profile, **_cookie_summary(profile))}
 
 
 # ---------------- User Info ----------------
 
 def _update_cookie_profile_fields(profile_id: str, **fields: Any) -> Dict[str, Any]:
-    profiles = _load_cookies()
-    idx = next((i for i, p in enumerate(profiles) if p.get("id") == profile_id), -1)
-    if idx < 0:
-        raise HTTPException(status_code=404, detail="cookie profile not found")
-    next_p = dict(profiles[idx])
-    next_p.update(fields)
-    next_p["updatedAt"] = _now_iso()
-    profiles[idx] = next_p
-    _save_cookies(profiles)
+    with _cookies_lock:
+        profiles = _load_cookies()
+        idx = next((i for i, p in enumerate(profiles) if p.get("id") == profile_id), -1)
+        if idx < 0:
+            raise HTTPException(status_code=404, detail="cookie profile not found")
+        next_p = dict(profiles[idx])
+        next_p.update(fields)
+        next_p["updatedAt"] = _now_iso()
+        profiles[idx] = next_p
+        _save_cookies(profiles)
     return next_p
 
 
-@app.post("/api/getUserInfo")
-def get_user_info(body: Dict[str, Any] = Body(...)) -> Any:
-    """
-    Call RunningHub /uc/getUserInfo for a cookie profile and persist totalCoin.
-    """
-    if not isinstance(body, dict):
-        raise HTTPException(status_code=400, detail="invalid body")
-    profile_id = body.get("profileId")
-    if not isinstance(profile_id, str) or not profile_id.strip():
-        raise HTTPException(status_code=400, detail="profileId required")
+def _update_cookie_profiles_bulk(updates: Dict[str, Dict[str, Any]]) -> None:
+    if not updates:
+        return
+    with _cookies_lock:
+        profiles = _load_cookies()
+        now = _now_iso()
+        for i, p in enumerate(profiles):
+            fields = updates.get(str(p.get("id") or ""))
+            if fields:
+                next_p = dict(p)
+                next_p.update(fields)
+                next_p["updatedAt"] = now
+                profiles[i] = next_p
+        _save_cookies(profiles)
 
-    profiles = _load_cookies()
-    profile = next((p for p in profiles if p.get("id") == profile_id), None)
-    if not profile:
-        raise HTTPException(status_code=404, detail="cookie profile not found")
 
+def _http_error_detail(e: Exception) -> str:
+    try:
+        msg = f"{e}"
+        if getattr(e, "response", None) is not None:
+            msg = f"{msg}: {e.response.status_code} {e.response.text}"
+        return msg
+    except Exception:
+        return str(e)
+
+
+def _request_total_coin(profile: Dict[str, Any], user_id: str, req_timeout: float) -> Tuple[str, str]:
+    """
+    Call RunningHub /uc/getUserInfo for one profile. Returns (userId, totalCoin).
+
+    Raises HTTPException for local problems (bad record / missing userId) and for a
+    rejected request (502); lets upstream errors (requests exceptions) propagate.
+    """
     host = str(profile.get("host") or "www.runninghub.ai")
     record = profile.get("record")
     if not isinstance(record, dict):
         raise HTTPException(status_code=400, detail="cookie record invalid")
 
     # userId comes from record.localStorage.userInfo.id by default.
-    user_id = body.get("userId") if isinstance(body.get("userId"), str) else ""
-    user_id = user_id.strip() if user_id else ""
     if not user_id:
         user_id = str(profile.get("userId") or "").strip()
     if not user_id:
@@ -615,6 +1932,51 @@ def get_user_info(body: Dict[str, Any] = Body(...)) -> Any:
     # Best-effort request; auth token is usually required, but cookies may also be needed.
     session = requests.Session()
     rh_client.install_cookies(session, auth)
+    pid = str(profile.get("id") or "")
+    try:
+        resp = rh_client.get_user_info(session, token=token, user_id=user_id, referer=f"{rh_client.ORIGIN}/", timeout=req_timeout)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code in (401, 403):
+            _set_profile_health(pid, False, f"getUserInfo HTTP {e.response.status_code}")
+        raise
+
+    # Parse totalCoin from response.data.totalCoin
+    data = resp.get("data") if isinstance(resp, dict) else None
+    if not isinstance(data, dict):
+        # Logged-out accounts get a JSON error envelope without data. Not a balance: drop any
+        # cached one rather than serving (or persisting) a blank.
+        msg = str(resp.get("msg") or resp.get("message") or "") if isinstance(resp, dict) else ""
+        problem = f"getUserInfo rejected: {msg}" if msg else "getUserInfo rejected"
+        _set_profile_health(pid, False, problem)
+        with _user_info_cache_lock:
+            _user_info_cache.pop(pid, None)
+        raise HTTPException(status_code=502, detail=problem)
+    total_coin = str(data.get("totalCoin") or "").strip()
+    _set_profile_health(pid, True)
+
+    with _user_info_cache_lock:
+        _user_info_cache[pid] = (time.monotonic(), total_coin)
+    return user_id, total_coin
+
+
+@app.post("/api/getUserInfo")
+def get_user_info(body: Dict[str, Any] = Body(...)) -> Any:
+    """
+    Call RunningHub /uc/getUserInfo for a cookie profile and persist totalCoin.
+    """
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="invalid body")
+    profile_id = body.get("profileId")
+    if not isinstance(profile_id, str) or not profile_id.strip():
+        raise HTTPException(status_code=400, detail="profileId required")
+
+    profiles = _load_cookies()
+    profile = next((p for p in profiles if p.get("id") == profile_id), None)
+    if not profile:
+        raise HTTPException(status_code=404, detail="cookie profile not found")
+
+    user_id = body.get("userId") if isinstance(body.get("userId"), str) else ""
+    user_id = user_id.strip() if user_id else ""
 
     settings = _load_settings()
     try:
@@ -623,25 +1985,14 @@ def get_user_info(body: Dict[str, Any] = Body(...)) -> Any:
         req_timeout = 25.0
 
     try:
-        resp = rh_client.get_user_info(session, token=token, user_id=user_id, referer=f"{rh_client.ORIGIN}/", timeout=req_timeout)
+        user_id, total_coin = _request_total_coin(profile, user_id, req_timeout)
+    except HTTPException:
+        raise
     except requests.HTTPError as e:
-        try:
-            msg = f"{e}"
-            if getattr(e, "response", None) is not None:
-                msg = f"{msg}: {e.response.status_code} {e.response.text}"
-        except Exception:
-            msg = str(e)
-        raise HTTPException(status_code=502, detail=msg)
+        raise HTTPException(status_code=502, detail=_http_error_detail(e))
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
 
-    # Parse totalCoin from response.data.totalCoin
-    total_coin = ""
-    if isinstance(resp, dict):
-        data = resp.get("data")
-        if isinstance(data, dict):
-            total_coin = str(data.get("totalCoin") or "").strip()
-
     next_p = _update_cookie_profile_fields(
         profile_id,
         userId=user_id,
@@ -651,6 +2002,92 @@ def get_user_info(body: Dict[str, Any] = Body(...)) -> Any:
     return {"ok": True, "profile": next_p, "userId": user_id, "totalCoin": total_coin}
 
 
+@app.post("/api/cookies/refresh-all")
+def refresh_all_user_info(body: Optional[Dict[str, Any]] = Body(None)) -> Any:
+    """
+    Refresh totalCoin for many profiles in parallel.
+
+    Body (optional): { profileIds?: [...], force?: bool }
+    Streams NDJSON: one line per profile as it finishes, then a final {"done": true, ...}.
+    Balances fetched within settings.userInfoTtlSec are reported from cache unless force=true.
+    """
+    body = body if isinstance(body, dict) else {}
+    force = bool(body.get("force", False))
+    wanted = body.get("profileIds")
+    wanted_ids = {str(x) for x in wanted} if isinstance(wanted, list) else None
+
+    profiles = [p for p in _load_cookies() if wanted_ids is None or str(p.get("id") or "") in wanted_ids]
+    settings = _load_settings()
+    ttl = float(settings.get("userInfoTtlSec", 300))
+    workers = int(settings.get("userInfoConcurrency", 8))
+    req_timeout = float(settings.get("requestTimeoutSec", 25.0))
+
+    def line(obj: Dict[str, Any]) -> str:
+        return json.dumps(obj, ensure_ascii=False) + "\n"
+
+    def gen() -> Iterator[str]:
+        total = len(profiles)
+        done = 0
+        failed = 0
+        updates: Dict[str, Dict[str, Any]] = {}
+        pending: List[Dict[str, Any]] = []
+
+        now = time.monotonic()
+        for p in profiles:
+            pid = str(p.get("id") or "")
+            with _user_info_cache_lock:
+                hit = _user_info_cache.get(pid)
+            if not force and hit is not None and now - hit[0] < ttl:
+                done += 1
+                yield line({"profileId": pid, "ok": True, "cached": True, "totalCoin": hit[1], "done": done, "total": total})
+            else:
+                pending.append(p)
+
+        def one(p: Dict[str, Any]) -> Tuple[str, str]:
+            return _request_total_coin(p, "", req_timeout)
+
+        pool = ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending) or 1)), thread_name_prefix="userinfo")
+        try:
+            futs = {pool.submit(one, p): p for p in pending}
+            for fut in as_completed(futs):
+                pid = str(futs[fut].get("id") or "")
+                done += 1
+                try:
+                    user_id, total_coin = fut.result()
+                except HTTPException as e:
+                    failed += 1
+                    yield line({"profileId": pid, "ok": False, "error": str(e.detail), "done": done, "total": total})
+                    continue
+                except Exception as e:
+                    failed += 1
+                    yield line({"profileId": pid, "ok": False, "error": _http_error_detail(e), "done": done, "total": total})
+                    continue
+                updates[pid] = {"userId": user_id, "totalCoin": total_coin, "userInfoUpdatedAt": _now_iso()}
+                yield line({"profileId": pid, "ok": True, "cached": False, "totalCoin": total_coin, "done": done, "total": total})
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            # One write for the whole batch, even if the client went away mid-stream.
+            _update_cookie_profiles_bulk(updates)
+
+        yield line({"done": True, "total": total, "refreshed": len(updates), "failed": failed})
+
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
+
+
+@app.post("/api/cookies/{profile_id}/probe")
+def probe_cookie(profile_id: str) -> Any:
+    """
+    Force a validity probe (ignores the cached result) and report whether the profile is usable.
+    """
+    profile = next((p for p in _load_cookies() if p.get("id") == profile_id), None)
+    if not profile:
+        raise HTTPException(status_code=404, detail="cookie profile not found")
+    with _profile_health_lock:
+        _profile_health.pop(profile_id, None)
+    problem = _profile_problem(profile, probe=True)
+    return {"ok": True, "profileId": profile_id, "usable": not problem, "problem": problem}
+
+
 @app.post("/api/cookies/{profile_id}/getUserInfo")
 def get_user_info_by_id(profile_id: str) -> Any:
     # Convenience alias for the UI.
@@ -668,13 +2105,16 @@ def list_resources() -> Any:
 
 @app.delete("/api/resources/{resource_id}")
 def delete_resource(resource_id: str) -> Any:
-    resources = _load_resources()
-    victim = next((r for r in resources if r.get("id") == resource_id), None)
-    next_list = [r for r in resources if r.get("id") != resource_id]
-    _save_resources(next_list)
+    with _resources_lock:
+        resources = _load_resources()
+        victim = next((r for r in resources if r.get("id") == resource_id), None)
+        next_list = [r for r in resources if r.get("id") != resource_id]
+        _save_resources(next_list)
     try:
         lp = victim.get("localPath") if isinstance(victim, dict) else ""
-        if isinstance(lp, str) and lp.strip():
+        # Several profiles' records may share one local copy; keep it while referenced.
+        shared = any(r.get("localPath") == lp for r in next_list)
+        if isinstance(lp, str) and lp.strip() and not shared:
             p = (RESOURCE_FILES_DIR / lp.strip())
             if p.exists() and p.is_file():
                 p.unlink(missing_ok=True)
@@ -684,52 +2124,145 @@ def delete_resource(resource_id: str) -> Any:
 
 
 @app.get("/api/resources/export")
-def export_resources() -> Any:
-    return {"schemaVersion": 1, "resources": _load_resources()}
+def export_resources(format: str = "", download: bool = False) -> Any:
+    """
+    Streamed {schemaVersion, resources:[...]}, or NDJSON with ?format=ndjson.
+    """
+    resources = _load_resources()
+    if jsonstream.is_ndjson("", format):
+        pieces = jsonstream.iter_ndjson(resources)
+    else:
+        pieces = jsonstream.iter_json_document({"schemaVersion": 1}, "resources", resources)
+    return _export_response(pieces, format, download, "resources")
 
 
 @app.post("/api/resources/import")
-def import_resources(payload: Any = Body(...)) -> Any:
-    incoming: List[Dict[str, Any]] = []
-    if isinstance(payload, dict) and isinstance(payload.get("resources"), list):
-        incoming = [x for x in payload["resources"] if isinstance(x, dict)]
-    elif isinstance(payload, list):
-        incoming = [x for x in payload if isinstance(x, dict)]
-    elif isinstance(payload, dict):
-        incoming = [payload]
-
-    resources = _load_resources()
-    by_id = {str(r.get("id")): r for r in resources if isinstance(r.get("id"), str)}
+async def import_resources(request: Request, format: str = "") -> Any:
+    """
+    Accept: {resources:[...]} or [...] or single resource object, or NDJSON (one resource per line).
+    """
+    by_id: Dict[str, Dict[str, Any]] = {}
     added = 0
-    for raw in incoming:
-        nr = _normalize_resource(raw)
+    streamed = False
+    root: Dict[str, Any] = {}
+    async for kind, path, value in _import_events(request, [(), ("resources",)], format):
+        if kind == "begin":
+            streamed = True
+        elif kind == "item":
+            if isinstance(value, dict):
+                nr = _normalize_resource(value)
+                by_id[nr["id"]] = nr
+                added += 1
+        elif len(path) == 1:
+            root[path[0]] = value
+    if not streamed and root:
+        nr = _normalize_resource(root)
         by_id[nr["id"]] = nr
         added += 1
 
-    merged = list(by_id.values())
-    merged.sort(key=lambda r: r.get("updatedAt", ""), reverse=True)
-    _save_resources(merged)
-    return {"ok": True, "count": len(merged), "imported": added}
+    def merge() -> int:
+        # Read the current list only now, under the lock, so uploads that finished while
+        # the body streamed in are kept.
+        with _resources_lock:
+            current = {str(r.get("id")): r for r in _load_resources() if isinstance(r.get("id"), str)}
+            current.update(by_id)
+            merged = list(current.values())
+            merged.sort(key=lambda r: r.get("updatedAt", ""), reverse=True)
+            _save_resources(merged)
+        return len(merged)
 
+    count = await run_in_threadpool(merge)
+    return {"ok": True, "count": count, "imported": added}
 
-@app.post("/api/resources/upload")
-def upload_resource(
-    profileId: str = Form(...),
-    file: UploadFile = File(...),
-    webappId: str = Form(""),
-) -> Any:
+
+class _MultipartReader:
     """
-    Upload any file to RunningHub upload API (per upload.txt).
+    Incremental multipart/form-data reader over `request.stream()`.
 
-    RunningHub expects:
-    - POST https://www.runninghub.ai/upload/image?Rh-Comfy-Auth=...&Rh-Identify=...
-    - multipart field name "image"
+    Yields ("field", name, value), ("file", name, filename, content_type), ("data", bytes)
+    and ("end_file",) events as bytes arrive. File parts are never spooled, so callers
+    can hash/store/forward them in the same pass.
     """
-    profiles = _load_cookies()
-    profile = next((p for p in profiles if p.get("id") == profileId), None)
-    if not profile:
-        raise HTTPException(status_code=404, detail="cookie profile not found")
 
+    MAX_FIELD_BYTES = 1024 * 1024
+
+    def __init__(self, content_type_header: str) -> None:
+        ctype, params = parse_options_header(content_type_header or "")
+        boundary = params.get(b"boundary")
+        if ctype != b"multipart/form-data" or not boundary:
+            raise HTTPException(status_code=400, detail="expected multipart/form-data")
+        self._events: List[Tuple[Any, ...]] = []
+        self._hdr_field = b""
+        self._hdr_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._is_file = False
+        self._name = ""
+        self._buf = bytearray()
+        self._parser = MultipartParser(
+            boundary,
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+        self._is_file = False
+        self._name = ""
+        self._buf = bytearray()
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._hdr_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._hdr_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._hdr_field.strip().lower()] = self._hdr_value.strip()
+        self._hdr_field = b""
+        self._hdr_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._name = params.get(b"name", b"").decode("utf-8", "replace")
+        filename = params.get(b"filename")
+        if filename is not None:
+            self._is_file = True
+            ctype = self._headers.get(b"content-type", b"").decode("latin-1")
+            self._events.append(("file", self._name, filename.decode("utf-8", "replace"), ctype))
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._is_file:
+            self._events.append(("data", bytes(data[start:end])))
+            return
+        self._buf += data[start:end]
+        if len(self._buf) > self.MAX_FIELD_BYTES:
+            raise HTTPException(status_code=413, detail=f"form field too large: {self._name}")
+
+    def _on_part_end(self) -> None:
+        if self._is_file:
+            self._events.append(("end_file",))
+        else:
+            self._events.append(("field", self._name, self._buf.decode("utf-8", "replace")))
+
+    async def events(self, stream: AsyncIterator[bytes]) -> AsyncIterator[Tuple[Any, ...]]:
+        async for chunk in stream:
+            if chunk:
+                self._parser.write(chunk)
+            while self._events:
+                yield self._events.pop(0)
+        self._parser.finalize()
+        while self._events:
+            yield self._events.pop(0)
+
+
+def _upload_credentials(profile: Dict[str, Any]) -> Tuple[rh_client.ParsedAuth, str, str, str]:
     host = str(profile.get("host") or "www.runninghub.ai")
     record = profile.get("record")
     if not isinstance(record, dict):
@@ -742,127 +2275,1661 @@ def upload_resource(
     identify = _extract_kv_from_record(record, "Rh-Identify")
     if not comfy_auth or not identify:
         raise HTTPException(status_code=400, detail="missing Rh-Comfy-Auth or Rh-Identify in record.localStorage")
+    return auth, token, comfy_auth, identify
 
-    # Build upload url and headers (both query and headers are used by browser).
-    upload_url = f"https://www.runninghub.ai/upload/image?Rh-Comfy-Auth={quote(comfy_auth, safe='')}&Rh-Identify={quote(identify, safe='')}"
-    referer = f"{rh_client.ORIGIN}/ai-detail/{webappId}" if webappId else f"{rh_client.ORIGIN}/"
-    headers = rh_client.make_headers(token=token, referer=referer)
-    # Let requests set correct multipart Content-Type.
-    headers.pop("content-type", None)
-    headers["rh-comfy-auth"] = comfy_auth
-    headers["rh-identify"] = identify
+
+def _upload_to_runninghub(
+    profile: Dict[str, Any],
+    webapp_id: str,
+    filename: str,
+    content_type: str,
+    chunks: Iterable[bytes],
+    size: int,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Blocking RunningHub upload for one profile. Returns (remote name, upload response).
+    """
+    auth, token, comfy_auth, identify = _upload_credentials(profile)
+    referer = f"{rh_client.ORIGIN}/ai-detail/{webapp_id}" if webapp_id else f"{rh_client.ORIGIN}/"
 
     session = requests.Session()
     rh_client.install_cookies(session, auth)
-
-    content_type = file.content_type or "application/octet-stream"
-    # requests will generate the multipart boundary for us.
-    resp = session.post(
-        upload_url,
-        headers=headers,
-        files={"image": (file.filename or "file.bin", file.file, content_type)},
-        timeout=60.0,
-    )
-    if resp.status_code >= 400:
-        raise HTTPException(status_code=resp.status_code, detail=resp.text)
-
     try:
-        out = resp.json()
-    except Exception:
+        out = rh_client.upload_file(
+            session,
+            token=token,
+            comfy_auth=comfy_auth,
+            identify=identify,
+            filename=filename or "file.bin",
+            content_type=content_type or "application/octet-stream",
+            chunks=chunks,
+            size=size,
+            referer=referer,
+            timeout=60.0,
+        )
+    except requests.HTTPError as e:
+        resp = e.response
+        raise HTTPException(status_code=resp.status_code if resp is not None else 502, detail=resp.text if resp is not None else str(e))
+    except requests.exceptions.JSONDecodeError:
         raise HTTPException(status_code=500, detail="upload response not json")
+    except ValueError as e:
+        # Body/declared-size mismatch raised while streaming the multipart body.
+        raise HTTPException(status_code=400, detail=str(e))
+    except requests.RequestException as e:
+        raise HTTPException(status_code=502, detail=str(e))
 
     name = out.get("name") if isinstance(out, dict) else None
     if not isinstance(name, str) or not name.strip():
         raise HTTPException(status_code=500, detail="upload response missing name")
+    return name, out if isinstance(out, dict) else {}
 
-    # Save a local copy for inline preview in the "资源库" tab.
-    local_path = ""
-    local_url = ""
-    local_size = 0
-    local_mime = file.content_type or ""
-    try:
-        safe_name = rh_client.safe_filename(name.strip())
-        dest = RESOURCE_FILES_DIR / safe_name
+
+def _iter_file_chunks(path: Path, chunk_size: int = UPLOAD_CHUNK_BYTES) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _save_uploaded_resources(
+    uploads: List[Tuple[Dict[str, Any], str, Dict[str, Any]]],
+    webapp_id: str,
+    original_filename: str,
+    staged: Optional[Path],
+    sha256: str,
+    size: int,
+    mime: str,
+    *,
+    local_path: str = "",
+    local_url: str = "",
+    source_id: str = "",
+) -> List[Dict[str, Any]]:
+    """
+    Record one resource per (profile, remote name, upload response) for the same bytes.
+
+    All records share a single local copy: the staged file (moved into resource_files and
+    named after the first remote name), or an existing `local_path` for replicas.
+    """
+    # Move the staged bytes into resource_files for inline preview in the "资源库" tab.
+    local_size = size if local_path else 0
+    local_mime = mime or ""
+    if staged is not None and uploads:
         try:
-            file.file.seek(0)
+            dest = RESOURCE_FILES_DIR / rh_client.safe_filename(uploads[0][1].strip())
+            os.replace(staged, dest)
+            local_size = size
+            if not local_mime:
+                local_mime = mimetypes.guess_type(dest.name)[0] or ""
+            local_path = dest.name
+            local_url = "/resource-files/" + dest.name
+        except Exception:
+            # Local copy is a best-effort feature; upload still succeeds without it.
+            staged.unlink(missing_ok=True)
+
+    with _resources_lock:
+        return _record_resources(uploads, webapp_id, original_filename, sha256, mime, local_path, local_url, local_size, local_mime, source_id)
+
+
+def _record_resources(
+    uploads: List[Tuple[Dict[str, Any], str, Dict[str, Any]]],
+    webapp_id: str,
+    original_filename: str,
+    sha256: str,
+    mime: str,
+    local_path: str,
+    local_url: str,
+    local_size: int,
+    local_mime: str,
+    source_id: str,
+) -> List[Dict[str, Any]]:
+    # Caller holds _resources_lock.
+    resources = _load_resources()
+    now = _now_iso()
+    saved: List[Dict[str, Any]] = []
+    for profile, name, upload_response in uploads:
+        # Deduplicate by name.
+        existing_idx = next((i for i, r in enumerate(resources) if r.get("name") == name), -1)
+        res = {
+            "id": resources[existing_idx]["id"] if existing_idx >= 0 and isinstance(resources[existing_idx].get("id"), str) else _gen_id(),
+            "name": name,
+            "originalFilename": original_filename or "",
+            "webappId": webapp_id or "",
+            "profileId": str(profile.get("id") or ""),
+            "profileName": str(profile.get("name") or ""),
+            "uploadResponse": upload_response,
+            "localPath": local_path,
+            "localUrl": local_url,
+            "mime": local_mime,
+            "size": local_size,
+            "sha256": sha256,
+            "sourceId": source_id,
+            "createdAt": resources[existing_idx].get("createdAt", now) if existing_idx >= 0 else now,
+            "updatedAt": now,
+        }
+
+        if existing_idx >= 0:
+            resources[existing_idx] = res
+        else:
+            resources.insert(0, res)
+        saved.append(res)
+    _save_resources(resources)
+    return saved
+
+
+class _UpstreamTee:
+    """
+    A RunningHub upload whose multipart body is fed chunk by chunk while the bytes are
+    still arriving (from one request body, or from the in-order PUTs of an upload
+    session), so the file is not read back from disk afterwards.
+
+    The transfer runs on the upload pool. With `idle_sec`, it gives up when no chunk comes
+    for that long (a session whose client went away).
+    """
+
+    def __init__(
+        self,
+        profile: Dict[str, Any],
+        webapp_id: str,
+        filename: str,
+        content_type: str,
+        size: int,
+        idle_sec: Optional[float] = None,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=16)
+        aborted = threading.Event()
+
+        def chunks() -> Iterator[bytes]:
+            while True:
+                fut = asyncio.run_coroutine_threadsafe(queue.get(), loop)
+                idle = 0.0
+                while True:
+                    try:
+                        chunk = fut.result(timeout=1.0)
+                        break
+                    except FuturesTimeout:
+                        idle += 1.0
+                        if aborted.is_set() or (idle_sec is not None and idle >= idle_sec):
+                            fut.cancel()
+                            raise rh_client.StopRequested("upload aborted")
+                if chunk is None:
+                    return
+                yield chunk
+
+        self.fed = 0
+        self._queue: Optional[asyncio.Queue] = queue
+        self._aborted = aborted
+        self._upstream: asyncio.Future = loop.run_in_executor(
+            _upload_pool,
+            lambda: _upload_to_runninghub(profile, webapp_id, filename, content_type, chunks(), size),
+        )
+        # An abandoned transfer's error is expected; keep asyncio from reporting it.
+        self._upstream.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    @property
+    def failed(self) -> bool:
+        """
+        The transfer ended before the last chunk was fed (upstream error, idle or abort).
+        """
+        return self._upstream.done() and self._queue is not None
+
+    async def feed(self, chunk: Optional[bytes]) -> bool:
+        """
+        Hand a chunk (None = end of body) to the transfer. False if it already ended, in
+        which case the caller falls back to uploading a staged copy (or reports the error).
+        """
+        # Stop feeding if the upstream request already ended (error) instead of blocking forever.
+        while self._queue is not None:
+            if self._upstream.done():
+                return False
+            try:
+                await asyncio.wait_for(self._queue.put(chunk), timeout=1.0)
+            except asyncio.TimeoutError:
+                continue
+            if chunk is None:
+                self._queue = None
+            else:
+                self.fed += len(chunk)
+            return True
+        return False
+
+    async def result(self) -> Tuple[str, Dict[str, Any]]:
+        await self.feed(None)
+        return await self._upstream
+
+    def abort(self) -> None:
+        # Thread-safe: the transfer thread notices within a second.
+        self._aborted.set()
+
+
+class _UploadSink:
+    """
+    One file part on its way to RunningHub.
+
+    Every chunk is hashed and written to a staging file as it arrives. When the client
+    declared the size, the same chunks are also fed to the upstream multipart body
+    (_UpstreamTee), so the file is read exactly once; the hash still dedupes the record
+    afterwards. Otherwise the staged copy is uploaded after it is complete.
+    """
+
+    def __init__(self, profile: Dict[str, Any], webapp_id: str, filename: str, content_type: str, declared_size: Optional[int]) -> None:
+        self.profile = profile
+        self.webapp_id = webapp_id
+        self.filename = filename
+        self.content_type = content_type
+        self.declared_size = declared_size
+        self.staged = STAGING_DIR / f"{_gen_id()}.part"
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self._fh: Any = None
+        self._tee: Optional[_UpstreamTee] = None
+
+    async def begin(self, tee: bool) -> None:
+        STAGING_DIR.mkdir(parents=True, exist_ok=True)
+        self._fh = open(self.staged, "wb")
+        if tee and self.declared_size is not None:
+            self._tee = _UpstreamTee(self.profile, self.webapp_id, self.filename, self.content_type, self.declared_size)
+
+    async def _feed(self, chunk: bytes) -> None:
+        if self._tee is not None:
+            await self._tee.feed(chunk)
+
+    def _store(self, chunk: bytes) -> None:
+        self.hasher.update(chunk)
+        self._fh.write(chunk)
+
+    async def write(self, chunk: bytes) -> None:
+        # Disk write and hash on a thread (blocking calls would stall every request on the
+        # event loop), alongside handing the chunk to the upstream body.
+        await asyncio.gather(run_in_threadpool(self._store, chunk), self._feed(chunk))
+        self.size += len(chunk)
+
+    def complete(self) -> str:
+        """
+        Close the staging file and return the SHA-256 of everything written.
+        """
+        self._fh.close()
+        return self.hasher.hexdigest()
+
+    async def finish(self) -> Dict[str, Any]:
+        sha256 = self.complete()
+        pid = str(self.profile.get("id") or "")
+        loop = asyncio.get_running_loop()
+
+        if self._tee is not None:
+            name, out = await self._tee.result()
+            existing = _find_resource_by_hash(sha256, pid)
+            if existing is not None:
+                # Sent anyway (the size alone cannot dedupe); keep one record per bytes.
+                self.staged.unlink(missing_ok=True)
+                return {"resource": existing, "deduped": True}
+        else:
+            existing = _find_resource_by_hash(sha256, pid)
+            if existing is not None:
+                self.staged.unlink(missing_ok=True)
+                return {"resource": existing, "deduped": True}
+            staged, size = self.staged, self.size
+            name, out = await loop.run_in_executor(
+                _upload_pool,
+                lambda: _upload_to_runninghub(self.profile, self.webapp_id, self.filename, self.content_type, _iter_file_chunks(staged), size),
+            )
+
+        saved = await run_in_threadpool(
+            _save_uploaded_resources,
+            [(self.profile, name, out)],
+            self.webapp_id,
+            self.filename,
+            self.staged,
+            sha256,
+            self.size,
+            self.content_type,
+        )
+        return {"resource": saved[0], "deduped": False}
+
+    def abort(self) -> None:
+        if self._tee is not None:
+            self._tee.abort()
+        try:
+            if self._fh is not None and not self._fh.closed:
+                self._fh.close()
         except Exception:
             pass
-        with open(dest, "wb") as out_f:
-            shutil.copyfileobj(file.file, out_f, length=1024 * 1024)
+        self.staged.unlink(missing_ok=True)
+
+
+@app.get("/api/resources/lookup")
+def lookup_resource(sha256: str, profileId: str) -> Any:
+    """
+    Find an existing upload of the same bytes for this profile (lets the browser skip the transfer).
+    """
+    return {"ok": True, "resource": _find_resource_by_hash(sha256.strip().lower(), profileId)}
+
+
+@app.post("/api/resources/upload")
+async def upload_resource(request: Request) -> Any:
+    """
+    Upload any file to RunningHub upload API (per upload.txt).
+
+    RunningHub expects:
+    - POST https://www.runninghub.ai/upload/image?Rh-Comfy-Auth=...&Rh-Identify=...
+    - multipart field name "image"
+
+    Form fields: profileId, webappId (optional), size (optional, enables the single-pass
+    tee), sha256 (optional, early dedupe), then the "file" part. The body is parsed as it
+    streams in and the transfer runs on the upload pool, not the request threadpool.
+    """
+    reader = _MultipartReader(request.headers.get("content-type", ""))
+    fields: Dict[str, str] = {}
+    sink: Optional[_UploadSink] = None
+    result: Optional[Dict[str, Any]] = None
+    try:
+        async for ev in reader.events(request.stream()):
+            kind = ev[0]
+            if kind == "field":
+                fields[ev[1]] = ev[2]
+            elif kind == "file" and ev[1] == "file" and sink is None and result is None:
+                profile_id = fields.get("profileId", "")
+                profiles = await run_in_threadpool(_load_cookies)
+                profile = next((p for p in profiles if p.get("id") == profile_id), None)
+                if not profile:
+                    raise HTTPException(status_code=404, detail="cookie profile not found")
+                _upload_credentials(profile)
+
+                declared_sha = fields.get("sha256", "").strip().lower()
+                existing = _find_resource_by_hash(declared_sha, profile_id)
+                if existing is not None:
+                    result = {"resource": existing, "deduped": True}
+                    break
+
+                declared_size = _coerce_int(fields.get("size"), -1)
+                sink = _UploadSink(
+                    profile,
+                    fields.get("webappId", ""),
+                    ev[2],
+                    ev[3],
+                    declared_size if declared_size >= 0 else None,
+                )
+                await sink.begin(tee=True)
+            elif kind == "data" and sink is not None and result is None:
+                await sink.write(ev[1])
+            elif kind == "end_file" and sink is not None and result is None:
+                result = await sink.finish()
+                sink = None
+    except BaseException:
+        if sink is not None:
+            sink.abort()
+        raise
+
+    if result is None:
+        if "profileId" not in fields:
+            raise HTTPException(status_code=400, detail="profileId required")
+        raise HTTPException(status_code=400, detail="file required")
+    return {"ok": True, **result}
+
+
+async def _bulk_upload_file(
+    sink: _UploadSink,
+    sha256: str,
+    profiles: List[Dict[str, Any]],
+    sem: asyncio.Semaphore,
+) -> Dict[str, Any]:
+    """
+    Upload one staged file to every profile (each transfer holds a slot of `sem`).
+
+    Profiles that already have these bytes are answered from the hash index. All new
+    records share the single local copy, which is placed once every transfer is done.
+    """
+    loop = asyncio.get_running_loop()
+    staged, size = sink.staged, sink.size
+    # Claim (sha256, profile) pairs nobody is uploading yet; checked and set without an
+    # await in between, so identical parts (in this request or another) upload once.
+    owned: Dict[str, "asyncio.Future[Optional[Dict[str, Any]]]"] = {}
+    for p in profiles:
+        key = (sha256, str(p.get("id") or ""))
+        if key not in _bulk_inflight and _find_resource_by_hash(sha256, key[1]) is None:
+            owned[key[1]] = _bulk_inflight[key] = loop.create_future()
+
+    async def one(profile: Dict[str, Any]) -> Dict[str, Any]:
+        pid = str(profile.get("id") or "")
+        if pid not in owned:
+            pending = _bulk_inflight.get((sha256, pid))
+            existing = await asyncio.shield(pending) if pending is not None else _find_resource_by_hash(sha256, pid)
+            if existing is None:
+                return {"profileId": pid, "ok": False, "error": "identical upload failed"}
+            return {"profileId": pid, "ok": True, "deduped": True, "resource": existing}
+        async with sem:
+            try:
+                name, out = await loop.run_in_executor(
+                    _upload_pool,
+                    lambda: _upload_to_runninghub(profile, sink.webapp_id, sink.filename, sink.content_type, _iter_file_chunks(staged), size),
+                )
+            except HTTPException as e:
+                return {"profileId": pid, "ok": False, "error": str(e.detail)}
+            except Exception as e:
+                return {"profileId": pid, "ok": False, "error": str(e)}
+        return {"profileId": pid, "ok": True, "deduped": False, "name": name, "out": out, "profile": profile}
+
+    results: List[Dict[str, Any]] = []
+    try:
+        results = list(await asyncio.gather(*(one(p) for p in profiles)))
+
+        fresh = [r for r in results if r.get("ok") and not r.get("deduped")]
+        if fresh:
+            saved = await run_in_threadpool(
+                _save_uploaded_resources,
+                [(r["profile"], r["name"], r["out"]) for r in fresh],
+                sink.webapp_id,
+                sink.filename,
+                staged,
+                sha256,
+                size,
+                sink.content_type,
+            )
+            for r, res in zip(fresh, saved):
+                r["resource"] = res
+        else:
+            staged.unlink(missing_ok=True)
+    finally:
+        for pid, fut in owned.items():
+            _bulk_inflight.pop((sha256, pid), None)
+            if not fut.done():
+                fut.set_result(next((r.get("resource") for r in results if r.get("profileId") == pid), None))
+
+    for r in fresh:
+        r.pop("name", None)
+        r.pop("out", None)
+        r.pop("profile", None)
+    return {
+        "filename": sink.filename,
+        "size": size,
+        "sha256": sha256,
+        "ok": all(r.get("ok") for r in results),
+        "results": list(results),
+    }
+
+
+@app.post("/api/resources/upload-bulk")
+async def upload_resources_bulk(request: Request) -> Any:
+    """
+    Upload many files, optionally to several profiles, with parallel transfers.
+
+    Form fields (before the files): profileIds (comma separated and/or repeated profileId),
+    webappId, concurrency (default settings.uploadConcurrency). Then any number of "file" parts.
+    Each file is staged+hashed as it arrives and its transfers start immediately, while later
+    files are still being received. Responds with NDJSON: one line per file as it finishes,
+    then {"done": true, ...}.
+    """
+    reader = _MultipartReader(request.headers.get("content-type", ""))
+    fields: Dict[str, str] = {}
+    profile_ids: List[str] = []
+    profiles: List[Dict[str, Any]] = []
+    sem: Optional[asyncio.Semaphore] = None
+    sink: Optional[_UploadSink] = None
+    tasks: List[asyncio.Task] = []
+
+    try:
+        async for ev in reader.events(request.stream()):
+            kind = ev[0]
+            if kind == "field":
+                if ev[1] == "profileId":
+                    profile_ids.append(ev[2].strip())
+                elif ev[1] == "profileIds":
+                    profile_ids.extend(x.strip() for x in ev[2].split(","))
+                else:
+                    fields[ev[1]] = ev[2]
+            elif kind == "file" and ev[1] == "file":
+                if sem is None:
+                    wanted = [x for x in dict.fromkeys(profile_ids) if x]
+                    if not wanted:
+                        raise HTTPException(status_code=400, detail="profileIds required")
+                    by_id = {str(p.get("id") or ""): p for p in await run_in_threadpool(_load_cookies)}
+                    missing = [x for x in wanted if x not in by_id]
+                    if missing:
+                        raise HTTPException(status_code=404, detail=f"cookie profile not found: {', '.join(missing)}")
+                    profiles = [by_id[x] for x in wanted]
+                    for p in profiles:
+                        _upload_credentials(p)
+                    default_limit = int((await run_in_threadpool(_load_settings)).get("uploadConcurrency", 4))
+                    limit = _coerce_int(fields.get("concurrency"), default_limit)
+                    sem = asyncio.Semaphore(max(1, min(UPLOAD_WORKERS, limit)))
+                sink = _UploadSink(profiles[0], fields.get("webappId", ""), ev[2], ev[3], None)
+                await sink.begin(tee=False)
+            elif kind == "data" and sink is not None:
+                await sink.write(ev[1])
+            elif kind == "end_file" and sink is not None:
+                sha256 = sink.complete()
+                tasks.append(asyncio.ensure_future(_bulk_upload_file(sink, sha256, profiles, sem)))
+                sink = None
+    except BaseException:
+        if sink is not None:
+            sink.abort()
+        raise
+
+    if not tasks:
+        raise HTTPException(status_code=400, detail="file required")
+
+    async def gen() -> AsyncIterator[str]:
+        total = len(tasks)
+        done = 0
+        failed = 0
+        for fut in asyncio.as_completed(tasks):
+            item = await fut
+            done += 1
+            if not item["ok"]:
+                failed += 1
+            yield json.dumps(dict(item, done=done, total=total), ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True, "total": total, "failed": failed}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
+
+
+def _upload_session_paths(session_id: str) -> Tuple[Path, Path]:
+    sid = "".join(ch for ch in session_id if ch.isalnum())
+    if not sid:
+        raise HTTPException(status_code=404, detail="upload session not found")
+    return UPLOAD_SESSIONS_DIR / f"{sid}.json", UPLOAD_SESSIONS_DIR / f"{sid}.part"
+
+
+def _load_upload_session(session_id: str) -> Dict[str, Any]:
+    meta_path, part_path = _upload_session_paths(session_id)
+    meta = read_json(meta_path, None, kind="upload_session")
+    if not isinstance(meta, dict):
+        raise HTTPException(status_code=404, detail="upload session not found")
+    # The part file is the source of truth for progress (survives crashes mid-chunk).
+    try:
+        meta["received"] = int(part_path.stat().st_size)
+    except OSError:
+        meta["received"] = 0
+    return meta
+
+
+def _drop_upload_session(session_id: str, *, keep_part: bool = False) -> None:
+    meta_path, part_path = _upload_session_paths(session_id)
+    with _upload_sessions_lock:
+        _upload_session_hashers.pop(session_id, None)
+        tee = _upload_session_tees.pop(session_id, None)
+    if tee is not None:
+        tee.abort()
+    if not keep_part:
+        part_path.unlink(missing_ok=True)
+    meta_path.unlink(missing_ok=True)
+
+
+def _purge_stale_upload_sessions() -> None:
+    cutoff = time.time() - UPLOAD_SESSION_TTL_SEC
+    try:
+        metas = list(UPLOAD_SESSIONS_DIR.glob("*.json"))
+    except OSError:
+        return
+    for meta_path in metas:
         try:
-            local_size = int(dest.stat().st_size)
+            part_path = meta_path.with_suffix(".part")
+            last = max(meta_path.stat().st_mtime, part_path.stat().st_mtime if part_path.exists() else 0)
+            if last < cutoff:
+                _drop_upload_session(meta_path.stem)
         except Exception:
-            local_size = 0
-        if not local_mime:
-            local_mime = mimetypes.guess_type(dest.name)[0] or ""
-        local_path = dest.name
-        local_url = "/resource-files/" + dest.name
-    except Exception:
-        # Local copy is a best-effort feature; upload still succeeds without it.
-        local_path = ""
-        local_url = ""
-        local_size = 0
+            continue
+
+
+def _claim_upload_session(session_id: str) -> None:
+    with _upload_sessions_lock:
+        if session_id in _upload_sessions_busy:
+            raise HTTPException(status_code=409, detail="upload session busy")
+        _upload_sessions_busy.add(session_id)
+
+
+def _release_upload_session(session_id: str) -> None:
+    with _upload_sessions_lock:
+        _upload_sessions_busy.discard(session_id)
+
+
+@app.post("/api/resources/upload-sessions")
+def create_upload_session(body: Dict[str, Any] = Body(...)) -> Any:
+    """
+    Start (or resume) a chunked upload.
+
+    Body: { profileId, webappId?, filename, contentType?, size, sha256?, clientKey? }.
+    A session with the same profileId + clientKey + size is returned as-is so the browser
+    can continue after a reload. A known sha256 for this profile is answered immediately
+    with {deduped: true} and no session.
+    """
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="body must be object")
+    profile_id = str(body.get("profileId") or "").strip()
+    profile = next((p for p in _load_cookies() if p.get("id") == profile_id), None)
+    if not profile:
+        raise HTTPException(status_code=404, detail="cookie profile not found")
+    _upload_credentials(profile)
+
+    size = _coerce_int(body.get("size"), -1)
+    if size < 0:
+        raise HTTPException(status_code=400, detail="size required")
+    sha256 = str(body.get("sha256") or "").strip().lower()
+    existing = _find_resource_by_hash(sha256, profile_id)
+    if existing is not None:
+        return {"ok": True, "session": None, "resource": existing, "deduped": True}
+
+    _purge_stale_upload_sessions()
+    client_key = str(body.get("clientKey") or "").strip()
+    if client_key:
+        for meta_path in UPLOAD_SESSIONS_DIR.glob("*.json"):
+            meta = read_json(meta_path, None, kind="upload_session")
+            if (
+                isinstance(meta, dict)
+                and meta.get("clientKey") == client_key
+                and meta.get("profileId") == profile_id
+                and meta.get("size") == size
+            ):
+                return {"ok": True, "session": _load_upload_session(meta_path.stem), "deduped": False}
 
-    resources = _load_resources()
-    # Deduplicate by name.
-    existing_idx = next((i for i, r in enumerate(resources) if r.get("name") == name), -1)
     now = _now_iso()
-    res = {
-        "id": resources[existing_idx]["id"] if existing_idx >= 0 and isinstance(resources[existing_idx].get("id"), str) else _gen_id(),
-        "name": name,
-        "originalFilename": file.filename or "",
-        "webappId": webappId or "",
-        "profileId": profileId,
-        "profileName": str(profile.get("name") or ""),
-        "uploadResponse": out if isinstance(out, dict) else {},
-        "localPath": local_path,
-        "localUrl": local_url,
-        "mime": local_mime,
-        "size": local_size,
-        "createdAt": resources[existing_idx].get("createdAt", now) if existing_idx >= 0 else now,
+    meta = {
+        "id": _gen_id(),
+        "profileId": profile_id,
+        "webappId": str(body.get("webappId") or ""),
+        "filename": str(body.get("filename") or "") or "file.bin",
+        "contentType": str(body.get("contentType") or ""),
+        "size": size,
+        "sha256": sha256,
+        "clientKey": client_key,
+        "createdAt": now,
         "updatedAt": now,
     }
+    meta_path, part_path = _upload_session_paths(meta["id"])
+    UPLOAD_SESSIONS_DIR.mkdir(parents=True, exist_ok=True)
+    part_path.touch()
+    write_json(meta_path, meta, kind="upload_session")
+    with _upload_sessions_lock:
+        _upload_session_hashers[meta["id"]] = (0, hashlib.sha256())
+    return {"ok": True, "session": dict(meta, received=0), "deduped": False}
 
-    if existing_idx >= 0:
-        resources[existing_idx] = res
-    else:
-        resources.insert(0, res)
-    _save_resources(resources)
 
-    return {"ok": True, "resource": res}
+@app.get("/api/resources/upload-sessions/{session_id}")
+def get_upload_session(session_id: str) -> Any:
+    return {"ok": True, "session": _load_upload_session(session_id)}
+
+
+@app.put("/api/resources/upload-sessions/{session_id}")
+async def put_upload_chunk(session_id: str, request: Request, offset: int = 0) -> Any:
+    """
+    Write the raw request body at `offset`.
+
+    Chunks must not leave gaps (offset <= received); re-sending bytes already received is
+    allowed, so a client that lost a response can simply retry. Responds with the new
+    `received`, which is where the next chunk starts.
+
+    While the chunks arrive in order from offset 0 they are also fed to the RunningHub
+    transfer, which finalize then completes instead of reading the file back.
+    """
+    meta = await run_in_threadpool(_load_upload_session, session_id)
+    received = int(meta["received"])
+    size = int(meta["size"])
+    if offset < 0 or offset > received:
+        raise HTTPException(status_code=409, detail=f"offset {offset} does not match received {received}")
+
+    _claim_upload_session(session_id)
+    _, part_path = _upload_session_paths(session_id)
+    with _upload_sessions_lock:
+        hashed = _upload_session_hashers.get(session_id)
+        tee = _upload_session_tees.pop(session_id, None)
+    # Keep the running hash and the upstream transfer only while the chunks arrive
+    # strictly in order (a resend may carry different bytes than were already sent).
+    hasher = hashed[1] if hashed is not None and hashed[0] == offset == received else None
+    if tee is not None and (hasher is None or tee.failed or tee.fed != offset):
+        tee.abort()
+        tee = None
+    if tee is None and hasher is not None and offset == 0:
+        profile_id = str(meta.get("profileId") or "")
+        profile = next((p for p in await run_in_threadpool(_load_cookies) if p.get("id") == profile_id), None)
+        if profile is not None:
+            tee = _UpstreamTee(
+                profile,
+                str(meta.get("webappId") or ""),
+                str(meta.get("filename") or ""),
+                str(meta.get("contentType") or ""),
+                size,
+                idle_sec=UPLOAD_SESSION_TEE_IDLE_SEC,
+            )
+    pos = offset
+
+    async def feed(chunk: bytes) -> None:
+        nonlocal tee
+        if tee is not None and not await tee.feed(chunk):
+            tee = None
+
+    def store(fh: Any, chunk: bytes) -> None:
+        fh.write(chunk)
+        if hasher is not None:
+            hasher.update(chunk)
+
+    try:
+        with open(part_path, "r+b") as fh:
+            fh.seek(offset)
+            async for chunk in request.stream():
+                if not chunk:
+                    continue
+                if pos + len(chunk) > size:
+                    raise HTTPException(status_code=400, detail="chunk exceeds declared size")
+                # Off the event loop, like _UploadSink.write.
+                await asyncio.gather(run_in_threadpool(store, fh, chunk), feed(chunk))
+                pos += len(chunk)
+    except BaseException:
+        with _upload_sessions_lock:
+            _upload_session_hashers.pop(session_id, None)
+        if tee is not None:
+            tee.abort()
+        raise
+    finally:
+        _release_upload_session(session_id)
+
+    with _upload_sessions_lock:
+        if hasher is not None:
+            _upload_session_hashers[session_id] = (pos, hasher)
+            if tee is not None:
+                _upload_session_tees[session_id] = tee
+        elif pos > received:
+            _upload_session_hashers.pop(session_id, None)
+    return {"ok": True, "received": max(received, pos), "size": size}
+
+
+@app.post("/api/resources/upload-sessions/{session_id}/finalize")
+async def finalize_upload_session(session_id: str) -> Any:
+    """
+    Hash the assembled file, dedupe, upload it to RunningHub and record the resource.
+
+    A transfer already fed by in-order PUTs is completed instead of reading the file back.
+    If the RunningHub transfer fails the session is kept, so finalize can be retried
+    without sending the bytes again.
+    """
+    meta = await run_in_threadpool(_load_upload_session, session_id)
+    if int(meta["received"]) != int(meta["size"]):
+        raise HTTPException(status_code=409, detail=f"incomplete: received {meta['received']} of {meta['size']}")
+    profile_id = str(meta.get("profileId") or "")
+    profile = next((p for p in await run_in_threadpool(_load_cookies) if p.get("id") == profile_id), None)
+    if not profile:
+        raise HTTPException(status_code=404, detail="cookie profile not found")
+
+    _claim_upload_session(session_id)
+    tee: Optional[_UpstreamTee] = None
+    try:
+        _, part_path = _upload_session_paths(session_id)
+        size = int(meta["size"])
+        with _upload_sessions_lock:
+            hashed = _upload_session_hashers.get(session_id)
+            tee = _upload_session_tees.pop(session_id, None)
+        if hashed is not None and hashed[0] == size:
+            sha256 = hashed[1].hexdigest()
+        else:
+            if tee is not None:
+                tee.abort()
+                tee = None
+
+            def rehash() -> str:
+                h = hashlib.sha256()
+                for chunk in _iter_file_chunks(part_path):
+                    h.update(chunk)
+                return h.hexdigest()
+
+            sha256 = await asyncio.get_running_loop().run_in_executor(_upload_pool, rehash)
+
+        declared = str(meta.get("sha256") or "")
+        if declared and declared != sha256:
+            # Corrupt assembly: start over rather than upload the wrong bytes.
+            await run_in_threadpool(part_path.write_bytes, b"")
+            with _upload_sessions_lock:
+                _upload_session_hashers[session_id] = (0, hashlib.sha256())
+            raise HTTPException(status_code=409, detail="sha256 mismatch; session reset, upload again")
+
+        existing = _find_resource_by_hash(sha256, profile_id)
+        if existing is not None:
+            await run_in_threadpool(_drop_upload_session, session_id)
+            return {"ok": True, "resource": existing, "deduped": True}
+
+        webapp_id = str(meta.get("webappId") or "")
+        filename = str(meta.get("filename") or "")
+        content_type = str(meta.get("contentType") or "")
+        fed, tee = tee, None
+        if fed is not None and fed.fed == size and not fed.failed:
+            try:
+                name, out = await fed.result()
+            except Exception:
+                fed = None
+        else:
+            if fed is not None:
+                fed.abort()
+            fed = None
+        if fed is None:
+            name, out = await asyncio.get_running_loop().run_in_executor(
+                _upload_pool,
+                lambda: _upload_to_runninghub(profile, webapp_id, filename, content_type, _iter_file_chunks(part_path), size),
+            )
+        saved = await run_in_threadpool(
+            _save_uploaded_resources,
+            [(profile, name, out)],
+            webapp_id,
+            filename,
+            part_path,
+            sha256,
+            size,
+            content_type,
+        )
+        await run_in_threadpool(_drop_upload_session, session_id, keep_part=True)
+        return {"ok": True, "resource": saved[0], "deduped": False}
+    finally:
+        if tee is not None:
+            tee.abort()
+        _release_upload_session(session_id)
+
+
+@app.delete("/api/resources/upload-sessions/{session_id}")
+def delete_upload_session(session_id: str) -> Any:
+    _load_upload_session(session_id)
+    _claim_upload_session(session_id)
+    try:
+        _drop_upload_session(session_id)
+    finally:
+        _release_upload_session(session_id)
+    return {"ok": True}
+
+
+def _replicate_resource(res: Dict[str, Any], profiles: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Re-upload a resource's local copy to other profiles in parallel (blocking).
+
+    Profiles that already hold the same bytes are answered from the hash index. Each new
+    remote name is recorded as its own resource (same localPath, sourceId=res.id).
+    Returns one result per profile.
+    """
+    lp = str(res.get("localPath") or "").strip()
+    local = RESOURCE_FILES_DIR / lp if lp else None
+    if local is None or not local.is_file():
+        raise HTTPException(status_code=409, detail="resource has no local copy to replicate from")
+
+    size = int(local.stat().st_size)
+    sha256 = str(res.get("sha256") or "").strip().lower()
+    if not sha256:
+        h = hashlib.sha256()
+        for chunk in _iter_file_chunks(local):
+            h.update(chunk)
+        sha256 = h.hexdigest()
+
+    filename = str(res.get("originalFilename") or "") or local.name
+    mime = str(res.get("mime") or "") or (mimetypes.guess_type(local.name)[0] or "")
+    webapp_id = str(res.get("webappId") or "")
+
+    results: List[Dict[str, Any]] = []
+    futs: Dict[Any, Dict[str, Any]] = {}
+    for p in profiles:
+        pid = str(p.get("id") or "")
+        existing = res if pid == str(res.get("profileId") or "") else _find_resource_by_hash(sha256, pid)
+        if existing is not None:
+            results.append({"profileId": pid, "ok": True, "deduped": True, "resource": existing})
+            continue
+        futs[_upload_pool.submit(_upload_to_runninghub, p, webapp_id, filename, mime, _iter_file_chunks(local), size)] = p
+
+    fresh: List[Tuple[Dict[str, Any], str, Dict[str, Any]]] = []
+    for fut in as_completed(futs):
+        p = futs[fut]
+        pid = str(p.get("id") or "")
+        try:
+            name, out = fut.result()
+        except HTTPException as e:
+            results.append({"profileId": pid, "ok": False, "error": str(e.detail)})
+            continue
+        except Exception as e:
+            results.append({"profileId": pid, "ok": False, "error": str(e)})
+            continue
+        fresh.append((p, name, out))
+
+    if fresh:
+        saved = _save_uploaded_resources(
+            fresh,
+            webapp_id,
+            filename,
+            None,
+            sha256,
+            size,
+            mime,
+            local_path=lp,
+            local_url=str(res.get("localUrl") or ""),
+            source_id=str(res.get("id") or ""),
+        )
+        for (p, _, _), r in zip(fresh, saved):
+            results.append({"profileId": str(p.get("id") or ""), "ok": True, "deduped": False, "resource": r})
+    return results
+
+
+@app.post("/api/resources/{resource_id}/replicate")
+def replicate_resource(resource_id: str, body: Dict[str, Any] = Body(...)) -> Any:
+    """
+    Upload the stored local copy of a resource to other profiles.
+
+    Body: { profileIds: [...] }. No bytes go through the browser.
+    """
+    res = next((r for r in _load_resources() if r.get("id") == resource_id), None)
+    if not res:
+        raise HTTPException(status_code=404, detail="resource not found")
+    wanted = body.get("profileIds") if isinstance(body, dict) else None
+    if not isinstance(wanted, list) or not wanted:
+        raise HTTPException(status_code=400, detail="profileIds required")
+
+    by_id = {str(p.get("id") or ""): p for p in _load_cookies()}
+    ids = [x for x in dict.fromkeys(str(w) for w in wanted) if x]
+    missing = [x for x in ids if x not in by_id]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"cookie profile not found: {', '.join(missing)}")
+    profiles = [by_id[x] for x in ids]
+    for p in profiles:
+        _upload_credentials(p)
+
+    results = _replicate_resource(res, profiles)
+    return {"ok": all(r.get("ok") for r in results), "results": results}
+
+
+def _localize_resource_name(
+    name: str,
+    profile: Dict[str, Any],
+    *,
+    replicate: bool = False,
+    log: Any = None,
+) -> Optional[str]:
+    """
+    This profile's copy of the resource called `name` when it belongs to another profile.
+
+    Uses existing replicas (same sha256); with replicate=True a missing one is uploaded
+    from the local copy first. None when nothing needs to change (or no copy is available).
+    """
+    res = _find_resource_by_name(name.strip())
+    pid = str(profile.get("id") or "")
+    if res is None or str(res.get("profileId") or "") == pid:
+        return None
+    local = _find_resource_by_hash(str(res.get("sha256") or ""), pid)
+    if local is None and replicate:
+        try:
+            for r in _replicate_resource(res, [profile]):
+                if r.get("ok"):
+                    local = r.get("resource")
+                elif log is not None:
+                    log(f"replicate {name!r} failed: {r.get('error')}")
+        except HTTPException as e:
+            if log is not None:
+                log(f"replicate {name!r} failed: {e.detail}")
+    if local is None or not local.get("name"):
+        return None
+    if log is not None:
+        log(f"resource {name!r} -> {local['name']!r} for this profile")
+    return str(local["name"])
+
+
+def _localize_payload_resources(
+    payload: Dict[str, Any],
+    profile: Dict[str, Any],
+    *,
+    replicate: bool = False,
+    log: Any = None,
+) -> Dict[str, Any]:
+    """
+    Point file inputs that name another profile's resource at this profile's copy.
+    Returns a new payload, or the same one when nothing changed.
+    """
+    inputs = payload.get("inputs")
+    if not isinstance(inputs, list):
+        return payload
+    changed: Dict[int, str] = {}
+    for i, inp in enumerate(inputs):
+        fv = inp.get("fieldValue") if isinstance(inp, dict) else None
+        if not isinstance(fv, str) or not fv.strip():
+            continue
+        name = _localize_resource_name(fv, profile, replicate=replicate, log=log)
+        if name is not None:
+            changed[i] = name
+    if not changed:
+        return payload
+    next_inputs = list(inputs)
+    for i, name in changed.items():
+        next_inputs[i] = dict(next_inputs[i], fieldValue=name)
+    return dict(payload, inputs=next_inputs)
+
+
+def _localize_slot_values(
+    compiled: template_slots.CompiledTemplate,
+    resolved: Dict[int, Any],
+    profile: Dict[str, Any],
+    *,
+    replicate: bool = False,
+    log: Any = None,
+) -> Dict[int, Any]:
+    """
+    Same as _localize_payload_resources, for a compiled template plus slot values.
+    """
+    out = resolved
+    for n in range(len(compiled.slots)):
+        value, _ = template_slots.slot_value(compiled, resolved, n)
+        if not isinstance(value, str) or not value.strip():
+            continue
+        name = _localize_resource_name(value, profile, replicate=replicate, log=log)
+        if name is not None:
+            if out is resolved:
+                out = dict(resolved)
+            out[n] = name
+    return out
 
 
 # ---------------- Jobs ----------------
 
 @app.get("/api/jobs")
-def list_jobs() -> Any:
+def list_jobs(batchId: str = "", status: str = "") -> Any:
+    filters = {"batchId": batchId.strip()}
+    statuses = {x.strip() for x in status.split(",") if x.strip()}
     with _jobs_lock:
-        jobs = list(_jobs.values())
+        jobs = [j for j in _jobs.values() if _job_matches(j, filters) and (not statuses or j.get("status") in statuses)]
     jobs.sort(key=lambda j: j.get("createdAt", ""), reverse=True)
     return {"ok": True, "jobs": jobs}
 
 
+@app.post("/api/jobs/cancel")
+def cancel_jobs(body: Dict[str, Any] = Body(...)) -> Any:
+    """
+    Bulk cancel. Body: { ids?: [...], batchId?, templateId?, profileId?, status?: "queued" | "running", all?: true }.
+    At least one of ids/batchId/templateId/profileId, or all=true, is required.
+    """
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="body must be object")
+    ids = body.get("ids") if isinstance(body.get("ids"), list) else None
+    filters = {k: str(body.get(k) or "").strip() for k in ("batchId", "templateId", "profileId")}
+    if ids is None and not any(filters.values()) and not body.get("all"):
+        raise HTTPException(status_code=400, detail="ids, batchId, templateId, profileId or all=true required")
+    status = str(body.get("status") or "").strip()
+    statuses = (status,) if status in JOB_ACTIVE_STATUSES else JOB_ACTIVE_STATUSES
+    reason = str(body.get("reason") or "").strip() or "cancelled"
+
+    wanted = {str(x) for x in ids} if ids is not None else None
+    with _jobs_lock:
+        targets = [
+            j["id"] for j in _jobs.values()
+            if j.get("status") in statuses
+            and (wanted is None or j["id"] in wanted)
+            and _job_matches(j, filters)
+        ]
+    cancelled = [jid for jid in targets if _cancel_job(jid, reason)]
+    return {"ok": True, "cancelled": cancelled, "count": len(cancelled)}
+
+
+def _trace_response(jobs: List[Dict[str, Any]], download: bool, stem: str) -> Any:
+    jobs = sorted(jobs, key=lambda j: j.get("createdAt", ""))
+    labels = {j["id"]: f"{j.get('templateName') or j.get('templateId')} / {j.get('profileName') or j.get('profileId')} [{j['id'][:8]}]" for j in jobs}
+    if _job_store is not None:
+        # Worker jobs: timelines live in the shared queue (cancelled ones, or after a restart).
+        missing = [j["id"] for j in jobs if not tracing.has_trace(j["id"])]
+        if missing:
+            _replay_shared_traces(missing, observe=False)
+    data = tracing.chrome_trace([j["id"] for j in jobs], labels)
+    headers = {"Content-Disposition": f'attachment; filename="{stem}.trace.json"'} if download else None
+    return Response(content=json.dumps(data, ensure_ascii=False), media_type="application/json", headers=headers)
+
+
+@app.get("/api/jobs/trace")
+def get_jobs_trace(batchId: str = "", ids: str = "", download: int = 0) -> Any:
+    """
+    Chrome Trace Event JSON for a batch (batchId) or a comma-separated list of job ids;
+    one row per job. Open in chrome://tracing or ui.perfetto.dev.
+    """
+    wanted = {x.strip() for x in ids.split(",") if x.strip()}
+    if not batchId.strip() and not wanted:
+        raise HTTPException(status_code=400, detail="batchId or ids required")
+    filters = {"batchId": batchId.strip()}
+    with _jobs_lock:
+        jobs = [dict(j) for j in _jobs.values() if _job_matches(j, filters) and (not wanted or j["id"] in wanted)]
+    return _trace_response(jobs, bool(download), f"batch-{batchId.strip() or 'jobs'}")
+
+
+@app.put("/api/batches/{batch_id}/callback")
+def set_batch_callback(batch_id: str, body: Dict[str, Any] = Body(...)) -> Any:
+    """
+    Body: { url } — POSTed (signed) for every job of the batch as it finishes; "" removes it.
+    """
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="body must be object")
+    url = _callback_url(body, "url")
+    with _jobs_lock:
+        if url:
+            _batch_callbacks[batch_id] = url
+        else:
+            _batch_callbacks.pop(batch_id, None)
+    return {"ok": True, "batchId": batch_id, "url": url}
+
+
+@app.get("/api/jobs/completions")
+async def job_completions(after: int = 0, batchId: str = "", follow: int = 0, timeout: float = 30.0) -> Any:
+    """
+    NDJSON feed of finished jobs ({seq, event, job}) with seq > `after`.
+    follow=0: long-poll; returns as soon as there is at least one event, or empty after `timeout`.
+    follow=1: stream events as they happen, with a {"event": "keepalive", "seq": ...} line when idle.
+    Pass the last seq seen as `after` to resume; the newest COMPLETIONS_KEEP events are kept.
+    """
+    batch_id = batchId.strip()
+    timeout = max(0.0, min(float(timeout), 300.0))
+
+    async def gen() -> AsyncIterator[bytes]:
+        cursor = after
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        waiter = (loop, wake)
+        with _completions_lock:
+            _completion_waiters.add(waiter)
+        try:
+            deadline = loop.time() + timeout
+            while not _shutdown_event.is_set():
+                # Clear before reading: a completion landing in between still wakes the wait below.
+                wake.clear()
+                events = _completions_after(cursor, batch_id)
+                if events:
+                    cursor = events[-1]["seq"]
+                    yield "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in events).encode("utf-8")
+                    if not follow:
+                        return
+                    continue
+                wait = COMPLETIONS_KEEPALIVE_SEC if follow else deadline - loop.time()
+                if wait <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    if not follow:
+                        return
+                    yield (json.dumps({"event": "keepalive", "seq": cursor}) + "\n").encode("utf-8")
+        finally:
+            with _completions_lock:
+                _completion_waiters.discard(waiter)
+
+    return StreamingResponse(gen(), media_type="application/x-ndjson", headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+
+
 @app.get("/api/jobs/{job_id}")
 def get_job(job_id: str) -> Any:
     return {"ok": True, "job": _get_job(job_id)}
 
 
+@app.post("/api/jobs/{job_id}/cancel")
+def cancel_job(job_id: str) -> Any:
+    job = _get_job(job_id)
+    if not _cancel_job(job_id):
+        raise HTTPException(status_code=409, detail=f"job is {job.get('status')}, not queued/running")
+    return {"ok": True, "job": _get_job(job_id)}
+
+
+@app.get("/api/jobs/{job_id}/trace")
+def get_job_trace(job_id: str, download: int = 0) -> Any:
+    return _trace_response([_get_job(job_id)], bool(download), f"job-{job_id}")
+
+
+@dataclass
+class JobSpec:
+    """
+    Everything a run needs besides the job record. Round-trips through JSON (to_dict /
+    from_dict) so a worker process can run jobs queued by the webapp.
+    """
+
+    job_id: str
+    profile: Dict[str, Any]
+    payload: Dict[str, Any]
+    # Set for slotValues jobs: the body is rendered from the skeleton, not from `payload`.
+    compiled: Optional[template_slots.CompiledTemplate] = None
+    resolved: Dict[int, Any] = field(default_factory=dict)
+    token_override: str = ""
+    no_auth: bool = False
+    replicate_resources: bool = False
+    check_profile: bool = True
+    reroute: bool = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "jobId": self.job_id,
+            "profile": self.profile,
+            "payload": self.payload,
+            "tokenOverride": self.token_override,
+            "noAuth": self.no_auth,
+            "replicateResources": self.replicate_resources,
+            "checkProfile": self.check_profile,
+            "reroute": self.reroute,
+        }
+        if self.compiled is not None:
+            out["slots"] = self.compiled.slots
+            out["resolved"] = {str(n): v for n, v in self.resolved.items()}
+        return out
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> JobSpec:
+        payload = d.get("payload") if isinstance(d.get("payload"), dict) else {}
+        compiled = None
+        resolved: Dict[int, Any] = {}
+        if isinstance(d.get("slots"), list):
+            compiled = template_slots.compile_payload(payload, d["slots"])
+            resolved = {int(n): v for n, v in (d.get("resolved") or {}).items()}
+        return cls(
+            job_id=str(d.get("jobId") or ""),
+            profile=d.get("profile") if isinstance(d.get("profile"), dict) else {},
+            payload=payload,
+            compiled=compiled,
+            resolved=resolved,
+            token_override=str(d.get("tokenOverride") or ""),
+            no_auth=bool(d.get("noAuth")),
+            replicate_resources=bool(d.get("replicateResources")),
+            check_profile=bool(d.get("checkProfile", True)),
+            reroute=bool(d.get("reroute")),
+        )
+
+
+@dataclass
+class JobContext:
+    """
+    Where a run reports to: _jobs for in-process jobs, the shared queue for worker jobs.
+    `update` ignores status/error once the job is cancelled; `stop` is set on cancel/shutdown.
+    """
+
+    update: Callable[..., None]
+    log: Callable[[str], None]
+    stop: threading.Event
+    # Collects stage timings ({stage: [seconds]}) when set; see _record_stage.
+    stages: Optional[Dict[str, List[float]]] = None
+
+
+def _update_local_job(job_id: str, **kw: Any) -> None:
+    with _jobs_lock:
+        j = _jobs.get(job_id)
+        if not j:
+            return
+        was_active = j.get("status") in JOB_ACTIVE_STATUSES
+        if j.get("status") == "cancelled":
+            # A cancel wins over whatever the thread was about to report.
+            kw.pop("status", None)
+            kw.pop("error", None)
+        j.update(kw)
+        j["updatedAt"] = _now_iso()
+        finished = dict(j) if was_active and j.get("status") not in JOB_ACTIVE_STATUSES else None
+    if finished is not None:
+        _job_finished(finished)
+
+
+def _log_local_job(job_id: str, msg: str) -> None:
+    with _jobs_lock:
+        j = _jobs.get(job_id)
+        if not j:
+            return
+        j["logs"].append(f"[{_now_iso()}] {msg}")
+        j["updatedAt"] = _now_iso()
+
+
+def _dispatch_check(spec: JobSpec, ctx: JobContext) -> bool:
+    # The job may have queued for a while; re-check before spending a slot on upstream calls.
+    if not spec.check_profile:
+        return True
+    profile = spec.profile
+    problem = _profile_problem(profile)
+    if not problem:
+        return True
+    alt = _pick_alternative_profile(profile) if spec.reroute else None
+    if alt is None:
+        ctx.update(status="failed", error=f"cookie profile unusable: {problem}")
+        ctx.log(f"rejected before dispatch: {problem}")
+        return False
+    ctx.log(f"rerouted from {profile.get('name')} ({problem}) to {alt.get('name')}")
+    spec.profile = alt
+    ctx.update(profileId=str(alt.get("id") or ""), profileName=alt.get("name"), host=alt.get("host"))
+    return True
+
+
+def _download_outputs(
+    session: requests.Session,
+    job_id: str,
+    outputs: List[Tuple[str, str]],
+    *,
+    limit: int,
+    timeout: float,
+    stop_event: threading.Event,
+    deadline: float,
+    log: Callable[[str], None],
+    on_done: Callable[[List[Path]], None],
+) -> List[Path]:
+    """
+    Download every (url, name) output, up to `limit` at once. Returns paths in output
+    order. The first failure stops the other transfers and is raised once they have
+    ended; `on_done` gets the downloads that did finish (all of them on success), so a
+    failed job still lists the outputs it already paid for.
+    """
+    names: List[str] = []
+    for i, (url, name) in enumerate(outputs, start=1):
+        name = name or rh_client.default_name_from_url(url)
+        # Several outputs may share a name; number them so none overwrites another.
+        names.append(f"{job_id}-{name}" if len(outputs) == 1 else f"{job_id}-{i}-{name}")
+
+    # Set on the first failure (or a job stop) to end the sibling transfers at their next chunk.
+    abort = threading.Event() if len(outputs) > 1 else stop_event
+
+    def fetch(url: str, filename: str) -> Path:
+        path = rh_client.download_file(
+            session,
+            url,
+            DOWNLOAD_DIR,
+            filename,
+            timeout=timeout,
+            overwrite=False,
+            stop_event=abort,
+            deadline_monotonic=deadline,
+        )
+        log(f"downloaded: {path.name}")
+        return path
+
+    if len(outputs) == 1:
+        paths = [fetch(outputs[0][0], names[0])]
+        on_done(paths)
+        return paths
+    done_paths: List[Optional[Path]] = [None] * len(outputs)
+    error: Optional[BaseException] = None
+    pool = ThreadPoolExecutor(max_workers=max(1, min(limit, len(outputs))), thread_name_prefix=f"download-{job_id[:8]}")
+    try:
+        # copy_context: download spans land in this job's trace.
+        pending = {
+            pool.submit(contextvars.copy_context().run, fetch, url, filename): i
+            for i, ((url, _), filename) in enumerate(zip(outputs, names))
+        }
+        while pending:
+            finished, _ = futures_wait(list(pending), timeout=0.5, return_when=FIRST_COMPLETED)
+            if stop_event.is_set():
+                abort.set()
+            for fut in finished:
+                i = pending.pop(fut)
+                try:
+                    done_paths[i] = fut.result()
+                except BaseException as e:
+                    # Later errors are the siblings reacting to the abort.
+                    if error is None:
+                        error = e
+                        abort.set()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    paths = [p for p in done_paths if p is not None]
+    on_done(paths)
+    if error is not None:
+        if paths:
+            log(f"download failed; kept {len(paths)} of {len(outputs)} outputs")
+        raise error
+    return paths
+
+
+def _postprocess_files(
+    job_id: str,
+    files: List[Path],
+    hooks: List[str],
+    workers: int,
+    deadline: float,
+    stop_event: threading.Event,
+    log: Callable[[str], None],
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Run the post-processing hooks on every file in the process pool; the job thread only
+    waits. Returns {download link: {hook: result}} and records it for the downloads tab.
+    Files not done by the job deadline (or a cancel) are left out.
+    """
+    base = DOWNLOAD_DIR.resolve()
+    pending: Dict[Any, str] = {}
+    for fp in files:
+        try:
+            rel = fp.resolve().relative_to(base).as_posix()
+        except Exception:
+            continue
+        pending[postprocess.submit(str(fp), hooks, workers)] = rel
+    done_results: Dict[str, Dict[str, Any]] = {}
+    while pending and not stop_event.is_set() and time.monotonic() < deadline:
+        done, _ = futures_wait(list(pending), timeout=min(1.0, max(0.0, deadline - time.monotonic())), return_when=FIRST_COMPLETED)
+        for fut in done:
+            rel = pending.pop(fut)
+            try:
+                done_results[rel] = fut.result()
+            except Exception as e:
+                # The pool process died (e.g. a hook crashed the interpreter).
+                done_results[rel] = {"error": f"{type(e).__name__}: {e}"}
+    for fut in pending:
+        fut.cancel()
+    if pending:
+        log(f"postprocess: {len(pending)} files not processed (stopped or job timeout)")
+    errors = sum(1 for r in done_results.values() if "error" in r or any(isinstance(v, dict) and "error" in v for v in r.values()))
+    log(f"postprocess: {len(done_results)} files, hooks={','.join(hooks)}, errors={errors}")
+    if done_results:
+        DOWNLOADS_META_DIR.mkdir(parents=True, exist_ok=True)
+        write_json(DOWNLOADS_META_DIR / f"{job_id}.json", done_results, kind="downloads_meta")
+    return {"/downloads/" + rel: r for rel, r in done_results.items()}
+
+
+def run_job(spec: JobSpec, ctx: JobContext) -> None:
+    """
+    The job pipeline: localize resources, create, wait for the history entry, download
+    and unzip. Reports through `ctx`; never raises.
+    """
+    if ctx.stop.is_set() or not _dispatch_check(spec, ctx):
+        return
+    job_id = spec.job_id
+    profile = spec.profile
+    payload = spec.payload
+    compiled = spec.compiled
+    resolved = spec.resolved
+    update, log, job_stop = ctx.update, ctx.log, ctx.stop
+
+    settings = _load_settings()
+    job_timeout_sec = float(settings.get("jobTimeoutSec", 600))
+    interval_sec = float(settings.get("historyIntervalSec", 3.0))
+    req_timeout = float(settings.get("requestTimeoutSec", 25.0))
+
+    started = time.monotonic()
+    deadline = started + job_timeout_sec
+
+    def remaining() -> float:
+        return max(0.0, deadline - time.monotonic())
+
+    def check_stop() -> None:
+        if job_stop.is_set():
+            raise rh_client.StopRequested("server shutdown" if _shutdown_event.is_set() else "cancelled")
+        if time.monotonic() >= deadline:
+            raise TimeoutError("job timeout")
+
+    update(status="running", jobTimeoutSec=int(job_timeout_sec))
+    log(f"job started (timeout={int(job_timeout_sec)}s)")
+    try:
+        check_stop()
+        host = str(profile.get("host") or "www.runninghub.ai")
+        record = profile.get("record")
+        if not isinstance(record, dict):
+            raise RuntimeError("cookie record invalid")
+
+        auth = rh_client.parse_record(host, record)
+        token = spec.token_override.strip() or rh_client.extract_access_token(auth)
+        if spec.no_auth:
+            token = ""
+
+        session = requests.Session()
+        rh_client.install_cookies(session, auth)
+
+        body_text: Optional[str] = None
+        with tracing.span("localize", "stage"):
+            if compiled is not None:
+                resolved = _localize_slot_values(compiled, resolved, profile, replicate=spec.replicate_resources, log=log)
+                body_text = template_slots.render(compiled, resolved)
+            else:
+                payload = _localize_payload_resources(payload, profile, replicate=spec.replicate_resources, log=log)
+
+        check_stop()
+        log(f"create: webappId={payload.get('webappId')!r} auth={'yes' if token else 'no'}")
+        stage_started = time.monotonic()
+        with tracing.span("create", "stage"):
+            create_resp = rh_client.create(
+                session,
+                payload=payload,
+                token=token,
+                timeout=min(req_timeout, max(3.0, remaining())),
+                body=body_text,
+            )
+
+        _record_stage("create", time.monotonic() - stage_started, ctx.stages)
+        task_id = rh_client.extract_task_id(create_resp)
+        update(taskId=task_id)
+        log(f"create ok: taskId={task_id}")
+
+        referer = rh_client.build_referer(payload)
+        check_stop()
+        stage_started = time.monotonic()
+        with tracing.span("generate", "stage", taskId=task_id) as sp:
+            hit, last_status = rh_client.wait_for_output(
+                session,
+                token=token,
+                referer=referer,
+                task_id=task_id,
+                history_pages=3,
+                history_size=20,
+                interval_sec=interval_sec,
+                timeout_sec=remaining(),
+                req_timeout=min(req_timeout, max(3.0, remaining())),
+                stop_event=job_stop,
+                on_first_seen=lambda: _record_stage("first_history_hit", time.monotonic() - stage_started, ctx.stages),
+            )
+            sp["taskStatus"] = last_status
+        update(taskStatus=last_status)
+        if hit is not None:
+            _record_stage("generate", time.monotonic() - stage_started, ctx.stages)
+
+        if hit is None:
+            log(f"history timeout: last_status={last_status!r}")
+            update(status="failed", error="history timeout")
+            return
+
+        outputs = rh_client.collect_outputs(hit)
+        file_url = outputs[0][0] if outputs else ""
+        update(fileUrl=file_url, fileUrls=[url for url, _ in outputs])
+        log(f"history: status={last_status!r} outputs={len(outputs)}")
+
+        def record_downloads(done: List[Path]) -> None:
+            if done:
+                links = [f"/downloads/{path.name}" for path in done]
+                update(downloadPath=links[0], downloadPaths=links)
+
+        check_stop()
+        if outputs and rh_client.is_task_complete(last_status) and str(last_status).upper() == "SUCCESS":
+            stage_started = time.monotonic()
+            with tracing.span("download", "stage", files=len(outputs)):
+                paths = _download_outputs(
+                    session,
+                    job_id,
+                    outputs,
+                    limit=int(settings.get("downloadConcurrency", 4)),
+                    timeout=min(req_timeout, max(3.0, remaining())),
+                    stop_event=job_stop,
+                    deadline=deadline,
+                    log=log,
+                    on_done=record_downloads,
+                )
+            _record_stage("download", time.monotonic() - stage_started, ctx.stages)
+
+            rels: List[str] = []
+            produced: List[Path] = list(paths)
+            for path in paths:
+                if path.suffix.lower() != ".zip":
+                    continue
+                try:
+                    extract_dir = DOWNLOAD_DIR / f"{job_id}-{path.stem}"
+                    stage_started = time.monotonic()
+                    with tracing.span("unzip", "stage", file=path.name) as sp:
+                        files = _safe_extract_zip(path, extract_dir)
+                        sp["files"] = len(files)
+                    _record_stage("unzip", time.monotonic() - stage_started, ctx.stages)
+                    produced.extend(files)
+                    # Store relative links for the UI.
+                    for fp in files:
+                        try:
+                            rel = fp.resolve().relative_to(DOWNLOAD_DIR.resolve())
+                        except Exception:
+                            continue
+                        rels.append("/downloads/" + "/".join(rel.parts))
+                    log(f"unzipped {path.name}: {len(files)} files")
+                except Exception as e:
+                    log(f"unzip failed: {path.name}: {e}")
+            if rels:
+                update(extractedFiles=sorted(rels))
+
+            hooks = list(settings.get("postprocessHooks") or [])
+            if hooks:
+                stage_started = time.monotonic()
+                with tracing.span("postprocess", "stage", files=len(produced), hooks=",".join(hooks)):
+                    results = _postprocess_files(job_id, produced, hooks, int(settings.get("postprocessWorkers", 0)), deadline, job_stop, log)
+                _record_stage("postprocess", time.monotonic() - stage_started, ctx.stages)
+                update(postprocess=results)
+
+        if str(last_status).upper() == "SUCCESS":
+            update(status="success")
+        else:
+            update(status="failed", error=f"taskStatus={last_status}")
+    except rh_client.StopRequested as e:
+        update(status="cancelled", error=str(e))
+        log(f"stopped: {e}")
+    except TimeoutError as e:
+        update(status="failed", error=str(e))
+        log(f"timeout: {e}")
+    except Exception as e:
+        if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code in (401, 403):
+            _set_profile_health(str(profile.get("id") or ""), False, f"HTTP {e.response.status_code} from upstream")
+        update(status="failed", error=str(e))
+        log(f"error: {e}")
+    if not job_stop.is_set():
+        _record_stage("run", time.monotonic() - started, ctx.stages)
+
+
 @app.post("/api/jobs")
 def start_job(body: Dict[str, Any] = Body(...)) -> Any:
     template_id = body.get("templateId")
     profile_id = body.get("profileId")
     payload_override = body.get("payload")
+    # slotValues: {slot key | input index: value} rendered into the compiled template (no payload walk).
+    slot_values = body.get("slotValues")
 
     no_auth = bool(body.get("noAuth", False))
     token_override = body.get("token") if isinstance(body.get("token"), str) else ""
+    # validate: probe the profile upstream if we have no fresh verdict yet.
+    # reroute: move the job to another usable profile instead of rejecting it.
+    validate = bool(body.get("validate", False))
+    reroute = bool(body.get("reroute", False))
+    # replicateResources: upload missing per-profile copies of referenced resources before create.
+    replicate_resources = bool(body.get("replicateResources", False))
+    # Explicit tokens / cookie-only mode bypass the stored token, so its health is irrelevant.
+    check_profile = not no_auth and not token_override.strip()
+    # idempotencyKey: repeat submissions with the same key attach to the first job.
+    # dedupe: same for identical template + profile + payload, without a client key.
+    idempotency_key = str(body.get("idempotencyKey") or "").strip()
+    dedupe = bool(body.get("dedupe", False))
+    # batchId: free-form tag for grouping (bulk cancel, listing).
+    batch_id = str(body.get("batchId") or "").strip()
+    # callbackUrl: signed POST when this job finishes; batchCallbackUrl: same for every job of batchId.
+    callback_url = _callback_url(body, "callbackUrl")
+    batch_callback_url = _callback_url(body, "batchCallbackUrl")
+    if batch_callback_url and not batch_id:
+        raise HTTPException(status_code=400, detail="batchCallbackUrl requires batchId")
+    # then: follow-up jobs fed with this job's output (see _parse_chain).
+    chain = _parse_chain(body["then"]) if body.get("then") else []
+    chain_parent = str(body.get("chainParent") or "")
+    # priority: "high" | "normal" | "low" (or 0-2); order within the job queue.
+    raw_priority = body.get("priority", "normal")
+    if isinstance(raw_priority, int) and not isinstance(raw_priority, bool) and raw_priority in JOB_PRIORITIES.values():
+        priority = raw_priority
+    elif isinstance(raw_priority, str) and raw_priority.strip().lower() in JOB_PRIORITIES:
+        priority = JOB_PRIORITIES[raw_priority.strip().lower()]
+    else:
+        raise HTTPException(status_code=400, detail="priority must be high, normal or low")
 
     if not isinstance(template_id, str) or not template_id:
         raise HTTPException(status_code=400, detail="templateId required")
     if not isinstance(profile_id, str) or not profile_id:
         raise HTTPException(status_code=400, detail="profileId required")
 
-    templates = _load_templates()
-    template = next((t for t in templates if t.get("id") == template_id), None)
+    template = _get_template(template_id)
     if not template:
         raise HTTPException(status_code=404, detail="template not found")
 
@@ -872,177 +3939,157 @@ def start_job(body: Dict[str, Any] = Body(...)) -> Any:
         raise HTTPException(status_code=404, detail="cookie profile not found")
 
     payload = template.get("payload")
-    if isinstance(payload_override, dict):
+    compiled: Optional[template_slots.CompiledTemplate] = None
+    resolved: Dict[int, Any] = {}
+    if slot_values is not None:
+        if payload_override is not None:
+            raise HTTPException(status_code=400, detail="payload and slotValues are mutually exclusive")
+        compiled = _compiled_template(template)
+        resolved = _resolve_slot_values(compiled, slot_values)
+    elif isinstance(payload_override, dict):
         payload = payload_override
     if not isinstance(payload, dict):
         raise HTTPException(status_code=400, detail="payload must be an object")
 
+    job_keys: List[str] = []
+    if idempotency_key:
+        job_keys.append("key:" + idempotency_key)
+    if dedupe:
+        payload_text = template_slots.render(compiled, resolved) if compiled is not None else json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        job_keys.append(_job_dedupe_hash(template_id, profile_id, payload_text, no_auth, token_override.strip()))
+    settings = _load_settings()
+    dedupe_ttl = float(settings.get("jobDedupeTtlSec", 600)) if job_keys else 0.0
+    if job_keys:
+        # Fast path before any profile probing; the insert below re-checks atomically.
+        with _jobs_lock:
+            hit = _coalesced_job(job_keys, dedupe_ttl)
+            if hit is not None:
+                late = _attach_to_coalesced(hit, chain, callback_url, batch_id, batch_callback_url)
+                snapshot = dict(hit)
+        if hit is not None:
+            _run_late_followups(late)
+            return {"ok": True, "job": snapshot, "coalesced": True}
+
+    rerouted_from = ""
+    if check_profile:
+        problem = _profile_problem(profile, probe=validate)
+        if problem:
+            alt = _pick_alternative_profile(profile, probe=validate) if reroute else None
+            if alt is None:
+                raise HTTPException(status_code=409, detail=f"cookie profile unusable: {problem}")
+            rerouted_from = f"{profile.get('name')} ({problem})"
+            profile = alt
+            profile_id = str(alt.get("id") or "")
+
     job_id = _gen_id()
     job = {
         "id": job_id,
         "createdAt": _now_iso(),
         "updatedAt": _now_iso(),
         "status": "queued",
-        "jobTimeoutSec": _load_settings().get("jobTimeoutSec", 600),
+        "jobTimeoutSec": settings.get("jobTimeoutSec", 600),
+        "priority": next(k for k, v in JOB_PRIORITIES.items() if v == priority),
         "templateId": template_id,
         "templateName": template.get("name"),
+        "batchId": batch_id,
         "profileId": profile_id,
         "profileName": profile.get("name"),
         "host": profile.get("host"),
         "taskId": "",
         "taskStatus": "",
         "fileUrl": "",
+        "fileUrls": [],
         "downloadPath": "",
+        "downloadPaths": [],
         "extractedFiles": [],
         "error": "",
         "logs": [],
     }
+    if idempotency_key:
+        job["idempotencyKey"] = idempotency_key
+    if callback_url:
+        job["callbackUrl"] = callback_url
+    if chain:
+        job["chain"] = chain
+    if chain_parent:
+        job["chainParent"] = chain_parent
+    if compiled is not None:
+        # Resolved values (e.g. the seed picked for "random") so the run can be reproduced.
+        job["slotValues"] = {compiled.slots[n]["key"]: v for n, v in resolved.items()}
+
+    if rerouted_from:
+        job["logs"].append(f"[{_now_iso()}] rerouted from {rerouted_from}")
+
+    spec = JobSpec(
+        job_id=job_id,
+        profile=profile,
+        payload=payload,
+        compiled=compiled,
+        resolved=resolved,
+        token_override=token_override,
+        no_auth=no_auth,
+        replicate_resources=replicate_resources,
+        check_profile=check_profile,
+        reroute=reroute,
+    )
+    job_stop = threading.Event()
+    ctx = JobContext(
+        update=lambda **kw: _update_local_job(job_id, **kw),
+        log=lambda msg: _log_local_job(job_id, msg),
+        stop=job_stop,
+    )
+    enqueued_at = time.monotonic()
+    enqueued_us = time.time_ns() // 1000
 
-    with _jobs_lock:
-        _jobs[job_id] = job
-
-    def log(msg: str) -> None:
-        with _jobs_lock:
-            j = _jobs.get(job_id)
-            if not j:
-                return
-            j["logs"].append(f"[{_now_iso()}] {msg}")
-            j["updatedAt"] = _now_iso()
-
-    def update(**kw: Any) -> None:
-        with _jobs_lock:
-            j = _jobs.get(job_id)
-            if not j:
-                return
-            j.update(kw)
-            j["updatedAt"] = _now_iso()
-
-    def run() -> None:
-        settings = _load_settings()
-        job_timeout_sec = float(settings.get("jobTimeoutSec", 600))
-        interval_sec = float(settings.get("historyIntervalSec", 3.0))
-        req_timeout = float(settings.get("requestTimeoutSec", 25.0))
-
+    def runner() -> None:
+        # Started by the dispatcher once a slot is free.
         started = time.monotonic()
-        deadline = started + job_timeout_sec
-
-        def remaining() -> float:
-            return max(0.0, deadline - time.monotonic())
-
-        def check_stop() -> None:
-            if _shutdown_event.is_set():
-                raise rh_client.StopRequested("server shutdown")
-            if time.monotonic() >= deadline:
-                raise TimeoutError("job timeout")
-
-        update(status="running", jobTimeoutSec=int(job_timeout_sec))
-        log(f"job started (timeout={int(job_timeout_sec)}s)")
+        _record_stage("queue", started - enqueued_at)
+        tracing.add_span(job_id, "queue", enqueued_us, int((started - enqueued_at) * 1_000_000), "stage", {"priority": priority})
         try:
-            check_stop()
-            host = str(profile.get("host") or "www.runninghub.ai")
-            record = profile.get("record")
-            if not isinstance(record, dict):
-                raise RuntimeError("cookie record invalid")
-
-            auth = rh_client.parse_record(host, record)
-            token = token_override.strip() or rh_client.extract_access_token(auth)
-            if no_auth:
-                token = ""
-
-            session = requests.Session()
-            rh_client.install_cookies(session, auth)
-
-            check_stop()
-            log(f"create: webappId={payload.get('webappId')!r} auth={'yes' if token else 'no'}")
-            create_resp = rh_client.create(
-                session,
-                payload=payload,
-                token=token,
-                timeout=min(req_timeout, max(3.0, remaining())),
-            )
-
-            task_id = rh_client.extract_task_id(create_resp)
-            update(taskId=task_id)
-            log(f"create ok: taskId={task_id}")
-
-            referer = rh_client.build_referer(payload)
-            check_stop()
-            hit, last_status = rh_client.wait_for_output(
-                session,
-                token=token,
-                referer=referer,
-                task_id=task_id,
-                history_pages=3,
-                history_size=20,
-                interval_sec=interval_sec,
-                timeout_sec=remaining(),
-                req_timeout=min(req_timeout, max(3.0, remaining())),
-                stop_event=_shutdown_event,
-            )
-            update(taskStatus=last_status)
-
-            if hit is None:
-                log(f"history timeout: last_status={last_status!r}")
-                update(status="failed", error="history timeout")
-                return
-
-            file_url = str(hit.get("fileUrl") or "")
-            update(fileUrl=file_url)
-            log(f"history: status={last_status!r} fileUrl={'yes' if file_url else 'no'}")
-
-            check_stop()
-            if file_url and rh_client.is_task_complete(last_status) and str(last_status).upper() == "SUCCESS":
-                out_name = str(hit.get("outputName") or "").strip() or rh_client.default_name_from_url(file_url)
-                filename = f"{job_id}-{out_name}"
-                path = rh_client.download_file(
-                    session,
-                    file_url,
-                    DOWNLOAD_DIR,
-                    filename,
-                    timeout=min(req_timeout, max(3.0, remaining())),
-                    overwrite=False,
-                    stop_event=_shutdown_event,
-                    deadline_monotonic=deadline,
-                )
-                update(downloadPath=f"/downloads/{path.name}")
-                log(f"downloaded: {path.name}")
-
-                if path.suffix.lower() == ".zip":
-                    try:
-                        extract_dir = DOWNLOAD_DIR / f"{job_id}-{path.stem}"
-                        files = _safe_extract_zip(path, extract_dir)
-                        # Store relative links for the UI.
-                        rels: List[str] = []
-                        for fp in files:
-                            try:
-                                rel = fp.resolve().relative_to(DOWNLOAD_DIR.resolve())
-                            except Exception:
-                                continue
-                            rels.append("/downloads/" + "/".join(rel.parts))
-                        rels.sort()
-                        update(extractedFiles=rels)
-                        log(f"unzipped: {len(rels)} files")
-                    except Exception as e:
-                        log(f"unzip failed: {e}")
-
-            if str(last_status).upper() == "SUCCESS":
-                update(status="success")
-            else:
-                update(status="failed", error=f"taskStatus={last_status}")
-        except rh_client.StopRequested as e:
-            update(status="cancelled", error=str(e))
-            log(f"cancelled: {e}")
-        except TimeoutError as e:
-            update(status="failed", error=str(e))
-            log(f"timeout: {e}")
-        except Exception as e:
-            update(status="failed", error=str(e))
-            log(f"error: {e}")
-
-    def runner() -> None:
-        # Limit concurrency, but keep threads daemon so Ctrl+C can exit.
-        with _job_slots:
-            run()
-
-    threading.Thread(target=runner, daemon=True, name=f"job-{job_id}").start()
-    return {"ok": True, "job": job}
+            with tracing.bind(job_id), tracing.span("run", "job", jobId=job_id):
+                run_job(spec, ctx)
+        finally:
+            with _jobs_lock:
+                _job_stop_events.pop(job_id, None)
+            _release_job_slot(job_id)
+
+    depth = int(settings.get("jobQueueDepth", 200))
+    concurrency = int(settings.get("jobConcurrency", MAX_CONCURRENT_JOBS))
+    late: Optional[Dict[str, Any]] = None
+    with _jobs_lock:
+        hit = _coalesced_job(job_keys, dedupe_ttl) if job_keys else None
+        if hit is not None:
+            late = _attach_to_coalesced(hit, chain, callback_url, batch_id, batch_callback_url)
+            snapshot = dict(hit)
+        else:
+            if _job_store is None:
+                # Holding _jobs_lock: the runner cannot touch the job before it is registered.
+                job["estimatedWaitSec"] = _enqueue_job(job_id, priority, runner, depth, concurrency)
+                _job_stop_events[job_id] = job_stop
+            _jobs[job_id] = job
+            for key in job_keys:
+                _job_keys[key] = job_id
+            if batch_callback_url:
+                _batch_callbacks[batch_id] = batch_callback_url
+            snapshot = dict(job)
+    if hit is not None:
+        _run_late_followups(late)
+        return {"ok": True, "job": snapshot, "coalesced": True}
+    if _job_store is not None:
+        # Shared queue: a worker process runs it; this process only mirrors the record. The
+        # store lives on a shared volume, so enqueue outside _jobs_lock; the mirror and its
+        # coalescing keys are registered above, so identical submissions attach meanwhile.
+        try:
+            wait = _enqueue_shared_job(snapshot, spec, priority, depth, concurrency)
+        except BaseException:
+            with _jobs_lock:
+                _jobs.pop(job_id, None)
+                for key in job_keys:
+                    if _job_keys.get(key) == job_id:
+                        del _job_keys[key]
+            raise
+        with _jobs_lock:
+            job["estimatedWaitSec"] = wait
+            snapshot = dict(job)
+    return {"ok": True, "job": snapshot, "coalesced": False}
@@ -0,0 +1,300 @@
+"""
+Local RunningHub stand-in for offline load tests (run_fake_rh.py; point clients at it via RH_BASE_URL).
+
+Implements the endpoints rh_client talks to (create, history, getUserInfo, upload/image)
+plus output downloads, with tunable generation latency, failure and 429 rates, history
+paging drift and large (zip) outputs. Nothing is persisted; coins are never spent.
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import Body, FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse
+
+
+@dataclass
+class FakeConfig:
+    # Generation time per task, uniform in [min, max] seconds.
+    latency_min: float = 2.0
+    latency_max: float = 5.0
+    # Fraction of tasks that end FAILED instead of SUCCESS.
+    fail_rate: float = 0.0
+    # Fraction of create/history/upload calls answered with 429 (+ Retry-After).
+    rate_limit_rate: float = 0.0
+    # Added to every API call (seconds), to mimic network round trips.
+    request_latency: float = 0.0
+    # History polls that miss a fresh task before it shows up (eventual consistency).
+    history_lag_polls: int = 0
+    # Unrelated finished tasks pushed into the account's history per create, so a task
+    # drifts to later pages while it runs.
+    history_noise: int = 0
+    # Largest page size served (bigger requests are truncated).
+    history_max_page_size: int = 50
+    # "png" (single file) or "zip" (archive of `zip_entries` files).
+    output: str = "png"
+    output_bytes: int = 256 * 1024
+    zip_entries: int = 4
+    # Outputs per task; above 1 the history entry also lists them all under "outputs".
+    outputs: int = 1
+    # Reject calls without "Authorization: Bearer ..." with 401.
+    require_auth: bool = False
+    total_coin: int = 1000
+    seed: Optional[int] = None
+
+    def update(self, values: Dict[str, Any]) -> None:
+        known = {f.name: f for f in fields(self)}
+        for k, v in values.items():
+            f = known.get(k)
+            if f is None:
+                raise ValueError(f"unknown config key: {k}")
+            current = getattr(self, k)
+            if v is None or current is None:
+                setattr(self, k, v)
+            elif isinstance(current, bool):
+                setattr(self, k, bool(v))
+            else:
+                setattr(self, k, type(current)(v))
+
+
+@dataclass
+class _Task:
+    task_id: str
+    account: str
+    created: float
+    ready_at: float
+    failed: bool
+    polls_missed: int = 0
+
+
+class FakeRunningHub:
+    def __init__(self, config: Optional[FakeConfig] = None) -> None:
+        self.config = config or FakeConfig()
+        self._lock = threading.Lock()
+        self._rng = random.Random(self.config.seed)
+        # account -> tasks, newest first (the order RunningHub's history uses)
+        self._history: Dict[str, List[_Task]] = {}
+        self._tasks: Dict[str, _Task] = {}
+        self._counts: Dict[str, int] = {}
+        self._output_dir = Path(tempfile.mkdtemp(prefix="fake_rh_"))
+        self._outputs: Dict[Tuple[str, int, int], Path] = {}
+
+    # ---- helpers ----
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+            tasks = list(self._tasks.values())
+        now = time.time()
+        return {
+            "calls": counts,
+            "tasks": len(tasks),
+            "running": sum(1 for t in tasks if t.ready_at > now),
+            "config": asdict(self.config),
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._history.clear()
+            self._tasks.clear()
+            self._counts.clear()
+            self._rng = random.Random(self.config.seed)
+
+    def has_task(self, task_id: str) -> bool:
+        with self._lock:
+            return task_id in self._tasks
+
+    def _chance(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < rate
+
+    def gate(self, request: Request, endpoint: str) -> str:
+        """
+        Common per-call behavior: latency, auth check, injected 429s. Returns the account key.
+        """
+        self.count(endpoint)
+        if self.config.request_latency > 0:
+            time.sleep(self.config.request_latency)
+        auth = request.headers.get("authorization", "")
+        token = auth[7:].strip() if auth.lower().startswith("bearer ") else ""
+        if self.config.require_auth and not token:
+            self.count(f"{endpoint}:401")
+            raise HTTPException(status_code=401, detail="unauthorized")
+        if self._chance(self.config.rate_limit_rate):
+            self.count(f"{endpoint}:429")
+            raise HTTPException(status_code=429, detail="too many requests", headers={"Retry-After": "1"})
+        return token or "anonymous"
+
+    def create(self, account: str) -> _Task:
+        cfg = self.config
+        now = time.time()
+        with self._lock:
+            latency = self._rng.uniform(cfg.latency_min, max(cfg.latency_min, cfg.latency_max))
+            failed = self._rng.random() < cfg.fail_rate
+            task = _Task(uuid.uuid4().hex, account, now, now + latency, failed, 0)
+            history = self._history.setdefault(account, [])
+            history.insert(0, task)
+            self._tasks[task.task_id] = task
+            for _ in range(max(0, cfg.history_noise)):
+                noise = _Task(uuid.uuid4().hex, account, now, now, False, cfg.history_lag_polls)
+                history.insert(0, noise)
+                self._tasks[noise.task_id] = noise
+        return task
+
+    def history_page(self, account: str, current: int, size: int, base_url: str) -> List[Dict[str, Any]]:
+        size = max(1, min(int(size), self.config.history_max_page_size))
+        start = (max(1, int(current)) - 1) * size
+        now = time.time()
+        out: List[Dict[str, Any]] = []
+        with self._lock:
+            page = list(self._history.get(account, [])[start:start + size])
+            for t in page:
+                if t.polls_missed < self.config.history_lag_polls:
+                    t.polls_missed += 1
+                    continue
+                out.append(self._history_item(t, now, base_url))
+        return out
+
+    def _history_item(self, t: _Task, now: float, base_url: str) -> Dict[str, Any]:
+        item: Dict[str, Any] = {
+            "taskId": t.task_id,
+            "taskType": "WEBAPP",
+            "createTime": int(t.created * 1000),
+        }
+        if t.ready_at > now:
+            item["taskStatus"] = "RUNNING"
+            return item
+        if t.failed:
+            item["taskStatus"] = "FAILED"
+            return item
+        ext = "zip" if self.config.output == "zip" else "png"
+        item["taskStatus"] = "SUCCESS"
+        item["fileUrl"] = f"{base_url}/fake/outputs/{t.task_id}.{ext}"
+        item["outputName"] = f"{t.task_id[:12]}.{ext}"
+        if self.config.outputs > 1:
+            item["outputs"] = [
+                {"fileUrl": f"{base_url}/fake/outputs/{t.task_id}-{i}.{ext}", "outputName": f"{t.task_id[:12]}_{i}.{ext}", "fileType": ext}
+                for i in range(self.config.outputs)
+            ]
+            item["fileUrl"] = item["outputs"][0]["fileUrl"]
+            item["outputName"] = item["outputs"][0]["outputName"]
+        return item
+
+    def output_path(self, kind: str) -> Path:
+        """
+        One shared file per (kind, size, entries); outputs are identical across tasks.
+        """
+        key = (kind, self.config.output_bytes, self.config.zip_entries)
+        with self._lock:
+            path = self._outputs.get(key)
+            if path is not None and path.exists():
+                return path
+            path = self._output_dir / f"{kind}-{key[1]}-{key[2]}.{kind}"
+            if kind == "zip":
+                entries = max(1, key[2])
+                per_entry = max(1, key[1] // entries)
+                with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as zf:
+                    for i in range(entries):
+                        zf.writestr(f"output_{i:04d}.png", _png_bytes(per_entry))
+            else:
+                path.write_bytes(_png_bytes(key[1]))
+            self._outputs[key] = path
+            return path
+
+
+_PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+
+def _png_bytes(size: int) -> bytes:
+    # Incompressible filler behind a PNG signature: close enough for transfer/unzip costs.
+    size = max(len(_PNG_HEADER), int(size))
+    return _PNG_HEADER + os.urandom(size - len(_PNG_HEADER))
+
+
+def _ok(data: Any) -> Dict[str, Any]:
+    return {"code": 0, "msg": "success", "data": data}
+
+
+def create_app(config: Optional[FakeConfig] = None) -> FastAPI:
+    fake = FakeRunningHub(config)
+    app = FastAPI(title="fake RunningHub")
+    app.state.fake = fake
+
+    def base_url(request: Request) -> str:
+        return str(request.base_url).rstrip("/")
+
+    @app.post("/task/webapp/create")
+    def create(request: Request, body: Dict[str, Any] = Body(...)) -> Any:
+        account = fake.gate(request, "create")
+        if not isinstance(body, dict) or not body.get("webappId"):
+            return {"code": 1, "msg": "webappId required", "data": None}
+        task = fake.create(account)
+        return _ok({"taskId": task.task_id, "netWssUrl": None, "clientId": uuid.uuid4().hex})
+
+    @app.post("/api/output/v2/history")
+    def history(request: Request, body: Dict[str, Any] = Body(...)) -> Any:
+        account = fake.gate(request, "history")
+        current = int(body.get("current") or 1) if isinstance(body, dict) else 1
+        size = int(body.get("size") or 20) if isinstance(body, dict) else 20
+        return _ok(fake.history_page(account, current, size, base_url(request)))
+
+    @app.post("/uc/getUserInfo")
+    def user_info(request: Request, body: Dict[str, Any] = Body(...)) -> Any:
+        fake.gate(request, "userinfo")
+        user_id = str(body.get("userId") or "") if isinstance(body, dict) else ""
+        return _ok({"id": user_id, "totalCoin": str(fake.config.total_coin)})
+
+    @app.post("/upload/image")
+    async def upload(request: Request) -> Any:
+        fake.gate(request, "upload")
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+        return {"name": f"api/{uuid.uuid4().hex}.png", "subfolder": "", "type": "input", "size": size}
+
+    @app.get("/fake/outputs/{name}")
+    def output(name: str) -> Any:
+        fake.count("download")
+        stem, _, ext = name.partition(".")
+        # "<task>.<ext>", or "<task>-<n>.<ext>" for multi-output tasks
+        task_id = stem.partition("-")[0]
+        if not fake.has_task(task_id) or ext not in ("png", "zip"):
+            raise HTTPException(status_code=404, detail="not found")
+        path = fake.output_path(ext)
+        media = "application/zip" if ext == "zip" else "image/png"
+        return FileResponse(path, media_type=media)
+
+    @app.get("/fake/stats")
+    def stats() -> Any:
+        return fake.stats()
+
+    @app.post("/fake/config")
+    def set_config(body: Dict[str, Any] = Body(...)) -> Any:
+        try:
+            fake.config.update(body if isinstance(body, dict) else {})
+        except (TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return asdict(fake.config)
+
+    @app.post("/fake/reset")
+    def reset() -> Any:
+        fake.reset()
+        return {"ok": True}
+
+    return app
@@ -0,0 +1,216 @@
+"""
+SQLite job queue shared by the webapp and headless workers (run_worker.py).
+
+Set RH_JOB_QUEUE to the same database path (e.g. on a shared volume) for the webapp and
+every worker: the webapp only enqueues and shows jobs, workers claim and run them. Each row
+holds the job record the UI shows and the spec a worker needs to run it. Claims happen in
+a write transaction, so two workers never get the same job.
+
+Uses SQLite's default rollback journal (WAL needs shared memory, which network filesystems
+do not provide); keep the database on a filesystem with working POSIX locks.
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# A running job whose worker has not sent a heartbeat for this long is failed (not re-run:
+# the task may already exist upstream and a second create would spend coins again).
+STALE_AFTER_SEC = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT NOT NULL DEFAULT '',
+    heartbeat REAL NOT NULL DEFAULT 0,
+    job TEXT NOT NULL,
+    spec TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority, seq);
+CREATE TABLE IF NOT EXISTS traces (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+
+class JobStore:
+    def __init__(self, path: Path, stale_after: float = STALE_AFTER_SEC) -> None:
+        self.path = Path(path)
+        self.stale_after = stale_after
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._db() as db:
+            db.executescript(_SCHEMA)
+
+    @contextmanager
+    def _db(self) -> Iterator[sqlite3.Connection]:
+        # One short-lived connection per call: safe from any thread, and no lock is held
+        # between calls. Autocommit mode; writers open BEGIN IMMEDIATE themselves.
+        db = sqlite3.connect(str(self.path), timeout=30.0, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def enqueue(self, job: Dict[str, Any], spec: Dict[str, Any], priority: int) -> None:
+        with self._write() as db:
+            seq = db.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM jobs").fetchone()[0]
+            db.execute(
+                "INSERT INTO jobs (id, seq, priority, status, job, spec) VALUES (?, ?, ?, ?, ?, ?)",
+                (job["id"], seq, priority, str(job.get("status") or "queued"), _dumps(job), _dumps(spec)),
+            )
+
+    def counts(self) -> Dict[str, int]:
+        with self._db() as db:
+            return {s: n for s, n in db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")}
+
+    def queued_by_priority(self) -> Dict[int, int]:
+        with self._db() as db:
+            return {int(p): n for p, n in db.execute("SELECT priority, COUNT(*) FROM jobs WHERE status = 'queued' GROUP BY priority")}
+
+    def queued_ahead(self, priority: int) -> int:
+        """
+        Queued jobs a new job of `priority` would wait behind.
+        """
+        with self._db() as db:
+            return int(db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND priority <= ?", (priority,)).fetchone()[0])
+
+    def claim(self, worker: str, stamp: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """
+        Take the next queued job (priority, then FIFO) for `worker`. Returns (job, spec) or None.
+        Also fails running jobs whose worker stopped sending heartbeats.
+        """
+        now = time.time()
+        with self._write() as db:
+            stale = db.execute(
+                "SELECT id, worker, job FROM jobs WHERE status = 'running' AND heartbeat < ?",
+                (now - self.stale_after,),
+            ).fetchall()
+            for job_id, owner, raw in stale:
+                job = json.loads(raw)
+                error = f"worker lost: {owner or '?'} (no heartbeat for {int(self.stale_after)}s)"
+                job.update(status="failed", error=error, updatedAt=stamp)
+                job.setdefault("logs", []).append(f"[{stamp}] {error}")
+                db.execute("UPDATE jobs SET status = 'failed', job = ? WHERE id = ?", (_dumps(job), job_id))
+
+            row = db.execute("SELECT id, job, spec FROM jobs WHERE status = 'queued' ORDER BY priority, seq LIMIT 1").fetchone()
+            if row is None:
+                return None
+            job_id, raw_job, raw_spec = row
+            job = json.loads(raw_job)
+            job.update(status="running", worker=worker, updatedAt=stamp)
+            db.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, heartbeat = ?, job = ? WHERE id = ?",
+                (worker, now, _dumps(job), job_id),
+            )
+        return job, json.loads(raw_spec)
+
+    def update(self, job_id: str, fields: Dict[str, Any], log: str = "") -> str:
+        """
+        Merge `fields` into the job record and append `log`. A cancel wins over whatever the
+        worker was about to report (status/error are dropped once cancelled). Returns the
+        resulting status, so the worker learns about cancels.
+        """
+        with self._write() as db:
+            row = db.execute("SELECT job FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return ""
+            job = json.loads(row[0])
+            fields = dict(fields)
+            if job.get("status") == "cancelled":
+                fields.pop("status", None)
+                fields.pop("error", None)
+            job.update(fields)
+            if log:
+                job.setdefault("logs", []).append(log)
+            status = str(job.get("status") or "")
+            db.execute("UPDATE jobs SET status = ?, job = ? WHERE id = ?", (status, _dumps(job), job_id))
+        return status
+
+    def heartbeat(self, job_id: str, worker: str) -> str:
+        """
+        Mark the job as alive; returns its status ("cancelled" means stop).
+        """
+        with self._write() as db:
+            db.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ?", (time.time(), job_id, worker))
+            row = db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return str(row[0]) if row else ""
+
+    def cancel(self, job_id: str, reason: str, stamp: str) -> bool:
+        """
+        Cancel a queued/running job. A queued job is never claimed; a running one stops at
+        its worker's next heartbeat. False if the job is not active.
+        """
+        with self._write() as db:
+            row = db.execute("SELECT status, job FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row[0] not in ACTIVE_STATUSES:
+                return False
+            job = json.loads(row[1])
+            job.update(status="cancelled", error=reason, updatedAt=stamp)
+            job.setdefault("logs", []).append(f"[{stamp}] cancelled: {reason}")
+            db.execute("UPDATE jobs SET status = 'cancelled', job = ? WHERE id = ?", (_dumps(job), job_id))
+        return True
+
+    def save_trace(self, job_id: str, data: Dict[str, Any]) -> None:
+        """
+        Store a job's timeline and stage timings ({"spans", "dropped", "stages"}), which are
+        recorded in the worker process, for the webapp's trace export and metrics.
+        """
+        with self._write() as db:
+            db.execute("INSERT OR REPLACE INTO traces (id, data) VALUES (?, ?)", (job_id, _dumps(data)))
+
+    def traces(self, ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        wanted = list(ids)
+        out: Dict[str, Dict[str, Any]] = {}
+        with self._db() as db:
+            for i in range(0, len(wanted), 500):
+                chunk = wanted[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                for job_id, raw in db.execute(f"SELECT id, data FROM traces WHERE id IN ({marks})", chunk):
+                    out[job_id] = json.loads(raw)
+        return out
+
+    def jobs(self, ids: Optional[Iterable[str]] = None, limit: int = 0) -> List[Dict[str, Any]]:
+        """
+        Job records, newest first; all of them, the given ids, or the newest `limit`.
+        """
+        with self._db() as db:
+            if ids is not None:
+                wanted = list(ids)
+                rows: List[Any] = []
+                # Stay below SQLite's bound-parameter limit.
+                for i in range(0, len(wanted), 500):
+                    chunk = wanted[i:i + 500]
+                    marks = ",".join("?" * len(chunk))
+                    rows.extend(db.execute(f"SELECT job FROM jobs WHERE id IN ({marks}) ORDER BY seq DESC", chunk))
+            elif limit > 0:
+                rows = db.execute("SELECT job FROM jobs ORDER BY seq DESC LIMIT ?", (limit,)).fetchall()
+            else:
+                rows = db.execute("SELECT job FROM jobs ORDER BY seq DESC").fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
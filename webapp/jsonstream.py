@@ -0,0 +1,258 @@
+"""Incremental JSON / NDJSON parsing for large imports, and streamed export bodies."""
+
+from __future__ import annotations
+
+import codecs
+import json
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+
+# ("begin", path, None): a streamed array starts at `path`
+# ("item", path, value): one element of a streamed array (or one NDJSON line, path=())
+# ("value", path, value): any other member of an object on the way to a streamed array
+Event = Tuple[str, Tuple[str, ...], Any]
+
+_WS = " \t\r\n"
+
+
+def _match(path: Tuple[str, ...], pattern: Tuple[str, ...]) -> bool:
+    return len(path) == len(pattern) and all(p == "*" or p == k for k, p in zip(path, pattern))
+
+
+class JsonItemParser:
+    """
+    Push parser that yields the elements of selected arrays one at a time.
+
+    `stream_paths` are object-key paths ("*" matches any key; () is the root) whose array
+    elements are emitted as "item" events. Objects are only descended into on the way to
+    such a path; everything else is decoded whole. Memory is bounded by the largest single
+    element, not by the document.
+    """
+
+    def __init__(self, stream_paths: Sequence[Sequence[str]]) -> None:
+        self._patterns = [tuple(p) for p in stream_paths]
+        self._dec = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        # Characters already dropped from the front of _buf (for error offsets).
+        self._base = 0
+        # Frames: [kind ("obj" | "arr"), path, state, current key]
+        self._stack: List[List[Any]] = []
+        self._done = False
+        # After an incomplete element, wait for the buffer to double before re-parsing it.
+        self._retry_at = 0
+
+    def _streams(self, path: Tuple[str, ...]) -> bool:
+        return any(_match(path, p) for p in self._patterns)
+
+    def _leads_to_stream(self, path: Tuple[str, ...]) -> bool:
+        n = len(path)
+        return any(len(p) > n and _match(path, p[:n]) for p in self._patterns)
+
+    def feed(self, text: str) -> List[Event]:
+        self._buf += text
+        if len(self._buf) < self._retry_at:
+            return []
+        return self._run(final=False)
+
+    def close(self) -> List[Event]:
+        out = self._run(final=True)
+        if self._stack or not self._done:
+            raise ValueError("unexpected end of JSON input")
+        return out
+
+    def _after_value(self) -> None:
+        if not self._stack:
+            self._done = True
+        else:
+            self._stack[-1][2] = "comma"
+
+    def _decode(self, final: bool) -> Optional[Tuple[Any]]:
+        try:
+            value, end = self._dec.raw_decode(self._buf, self._pos)
+        except json.JSONDecodeError:
+            if final:
+                raise ValueError(f"invalid JSON at offset {self._base + self._pos}")
+            return None
+        # A number at the very end of the buffer may continue in the next chunk.
+        if end >= len(self._buf) and not final:
+            return None
+        self._pos = end
+        return (value,)
+
+    def _value(self, path: Tuple[str, ...], in_stream: bool, out: List[Event], final: bool) -> bool:
+        c = self._buf[self._pos]
+        if not in_stream and c == "[" and self._streams(path):
+            self._pos += 1
+            self._stack.append(["arr", path, "first", None])
+            out.append(("begin", path, None))
+            return True
+        if not in_stream and c == "{" and self._leads_to_stream(path):
+            self._pos += 1
+            self._stack.append(["obj", path, "key", None])
+            return True
+        got = self._decode(final)
+        if got is None:
+            return False
+        out.append(("item" if in_stream else "value", path, got[0]))
+        self._after_value()
+        return True
+
+    def _run(self, final: bool) -> List[Event]:
+        out: List[Event] = []
+        buf_len = len(self._buf)
+        while True:
+            while self._pos < buf_len and self._buf[self._pos] in _WS:
+                self._pos += 1
+            if self._pos >= buf_len:
+                break
+            if self._done:
+                raise ValueError(f"unexpected data after JSON value at offset {self._base + self._pos}")
+            c = self._buf[self._pos]
+
+            if not self._stack:
+                if not self._value((), False, out, final):
+                    break
+                continue
+
+            frame = self._stack[-1]
+            kind, path, state = frame[0], frame[1], frame[2]
+            if kind == "obj":
+                if state == "key":
+                    if c == "}":
+                        self._pos += 1
+                        self._stack.pop()
+                        self._after_value()
+                        continue
+                    if c != '"':
+                        raise ValueError(f"expected object key at offset {self._base + self._pos}")
+                    got = self._decode(final)
+                    if got is None:
+                        break
+                    frame[3] = got[0]
+                    frame[2] = "colon"
+                elif state == "colon":
+                    if c != ":":
+                        raise ValueError(f"expected ':' at offset {self._base + self._pos}")
+                    self._pos += 1
+                    frame[2] = "value"
+                elif state == "value":
+                    if not self._value(path + (frame[3],), False, out, final):
+                        break
+                else:
+                    if c == ",":
+                        self._pos += 1
+                        frame[2] = "key"
+                    elif c == "}":
+                        self._pos += 1
+                        self._stack.pop()
+                        self._after_value()
+                    else:
+                        raise ValueError(f"expected ',' or '}}' at offset {self._base + self._pos}")
+            else:
+                if state in ("first", "value"):
+                    if c == "]" and state == "first":
+                        self._pos += 1
+                        self._stack.pop()
+                        self._after_value()
+                        continue
+                    if not self._value(path, True, out, final):
+                        break
+                else:
+                    if c == ",":
+                        self._pos += 1
+                        frame[2] = "value"
+                    elif c == "]":
+                        self._pos += 1
+                        self._stack.pop()
+                        self._after_value()
+                    else:
+                        raise ValueError(f"expected ',' or ']' at offset {self._base + self._pos}")
+
+        self._base += self._pos
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+        self._retry_at = 2 * len(self._buf) if self._buf.strip() else 0
+        return out
+
+
+class NdjsonParser:
+    """
+    One JSON value per line; every value is an "item" at path ().
+    """
+
+    def __init__(self) -> None:
+        self._buf = ""
+        self._line = 0
+
+    def _parse(self, line: str) -> List[Event]:
+        self._line += 1
+        if not line.strip():
+            return []
+        try:
+            return [("item", (), json.loads(line))]
+        except ValueError:
+            raise ValueError(f"invalid JSON on line {self._line}")
+
+    def feed(self, text: str) -> List[Event]:
+        self._buf += text
+        if "\n" not in text:
+            return []
+        *lines, self._buf = self._buf.split("\n")
+        out: List[Event] = []
+        for line in lines:
+            out.extend(self._parse(line))
+        return out
+
+    def close(self) -> List[Event]:
+        rest, self._buf = self._buf, ""
+        return self._parse(rest)
+
+
+def is_ndjson(content_type: str, fmt: str = "") -> bool:
+    if fmt.strip().lower() in ("ndjson", "jsonl"):
+        return True
+    ct = content_type.split(";", 1)[0].strip().lower()
+    return ct in ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines")
+
+
+async def aiter_events(
+    chunks: AsyncIterator[bytes],
+    stream_paths: Sequence[Sequence[str]],
+    *,
+    ndjson: bool = False,
+) -> AsyncIterator[Event]:
+    """
+    Parse a UTF-8 byte stream (e.g. `request.stream()`) into events as it arrives.
+    Raises ValueError on malformed input.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    parser: Any = NdjsonParser() if ndjson else JsonItemParser(stream_paths)
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        for ev in parser.feed(decoder.decode(chunk)):
+            yield ev
+    tail = decoder.decode(b"", final=True)
+    events = parser.feed(tail) if tail else []
+    events.extend(parser.close())
+    for ev in events:
+        yield ev
+
+
+def iter_json_document(head: Dict[str, Any], key: str, items: Iterable[Any]) -> Iterator[str]:
+    """
+    `{...head, key: [items...]}` as text pieces, one item at a time.
+    """
+    prefix = json.dumps(head, ensure_ascii=False)[:-1]
+    yield (prefix + ", " if head else "{") + json.dumps(key) + ": ["
+    first = True
+    for item in items:
+        yield ("\n" if first else ",\n") + json.dumps(item, ensure_ascii=False)
+        first = False
+    yield "\n]}"
+
+
+def iter_ndjson(items: Iterable[Any]) -> Iterator[str]:
+    for item in items:
+        yield json.dumps(item, ensure_ascii=False) + "\n"
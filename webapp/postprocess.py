@@ -0,0 +1,199 @@
+"""
+Post-download hooks (hashing, media metadata) run in a process pool, off the job threads.
+
+A hook takes a file path and returns a JSON-able dict. Built-ins are registered by name
+("sha256", "media"); other hooks are named "package.module:function" and imported in the
+worker process, so they work with the spawn start method (Windows) too.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import shutil
+import struct
+import subprocess
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+
+Hook = Callable[[str], Dict[str, Any]]
+
+_hooks: Dict[str, Hook] = {}
+
+_pool_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+
+
+def register(name: str) -> Callable[[Hook], Hook]:
+    def deco(fn: Hook) -> Hook:
+        _hooks[name] = fn
+        return fn
+
+    return deco
+
+
+def _resolve(name: str) -> Hook:
+    fn = _hooks.get(name)
+    if fn is not None:
+        return fn
+    module, sep, attr = name.partition(":")
+    if not sep:
+        raise KeyError(f"unknown hook: {name}")
+    return getattr(importlib.import_module(module), attr)
+
+
+def run_hooks(path: str, names: List[str]) -> Dict[str, Any]:
+    """
+    Run the named hooks on one file (in a pool process). A failing hook yields
+    {"error": ...} without affecting the others.
+    """
+    out: Dict[str, Any] = {}
+    for name in names:
+        try:
+            out[name] = _resolve(name)(path)
+        except Exception as e:
+            out[name] = {"error": f"{type(e).__name__}: {e}"}
+    return out
+
+
+def submit(path: str, names: List[str], workers: int = 0) -> "Future[Dict[str, Any]]":
+    """
+    Queue run_hooks(path, names) on the shared pool (`workers` processes, 0 = one per core).
+    A different size starts a new pool; work queued on the old one still finishes.
+    """
+    global _pool, _pool_workers
+    size = workers if workers > 0 else (os.cpu_count() or 1)
+    with _pool_lock:
+        if _pool is None or _pool_workers != size:
+            old = _pool
+            # spawn: forking a process full of threads (uvicorn, job threads) can deadlock the child.
+            _pool = ProcessPoolExecutor(max_workers=size, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = size
+            if old is not None:
+                # Queued work on the old pool still finishes.
+                old.shutdown(wait=False)
+        return _pool.submit(run_hooks, path, names)
+
+
+def shutdown() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# ---- built-in hooks ----
+
+@register("sha256")
+def sha256_hook(path: str) -> Dict[str, Any]:
+    h = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            h.update(chunk)
+            size += len(chunk)
+    return {"sha256": h.hexdigest(), "size": size}
+
+
+_VIDEO_AUDIO_EXTS = {".mp4", ".mov", ".webm", ".mkv", ".avi", ".m4v", ".mp3", ".wav", ".flac", ".m4a", ".ogg"}
+
+
+@register("media")
+def media_hook(path: str) -> Dict[str, Any]:
+    """
+    Image dimensions from the file header (PNG, JPEG, GIF, WebP); duration, size and frame
+    count of audio/video via ffprobe when it is on PATH.
+    """
+    with open(path, "rb") as f:
+        size = _image_size(f)
+    if size is not None:
+        return {"kind": "image", "width": size[0], "height": size[1]}
+    if os.path.splitext(path)[1].lower() in _VIDEO_AUDIO_EXTS:
+        return _ffprobe(path)
+    return {}
+
+
+def _image_size(f: BinaryIO) -> Optional[Tuple[int, int]]:
+    head = f.read(32)
+    if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+        return struct.unpack(">II", head[16:24])
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return struct.unpack("<HH", head[6:10])
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        chunk = head[12:16]
+        if chunk == b"VP8 ":
+            w, h = struct.unpack("<HH", head[26:30])
+            return w & 0x3FFF, h & 0x3FFF
+        if chunk == b"VP8L":
+            b0, b1, b2, b3 = head[21:25]
+            return 1 + (((b1 & 0x3F) << 8) | b0), 1 + (((b3 & 0x0F) << 10) | (b2 << 2) | ((b1 & 0xC0) >> 6))
+        if chunk == b"VP8X":
+            return 1 + int.from_bytes(head[24:27], "little"), 1 + int.from_bytes(head[27:30], "little")
+        return None
+    if head[:2] == b"\xff\xd8":
+        return _jpeg_size(f)
+    return None
+
+
+def _jpeg_size(f: BinaryIO) -> Optional[Tuple[int, int]]:
+    # Walk the marker segments up to the first start-of-frame (SOFn, not DHT/JPG/DAC).
+    f.seek(2)
+    while True:
+        b = f.read(1)
+        while b and b != b"\xff":
+            b = f.read(1)
+        while b == b"\xff":
+            b = f.read(1)
+        if not b:
+            return None
+        marker = b[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            continue
+        seg = f.read(2)
+        if len(seg) < 2:
+            return None
+        length = struct.unpack(">H", seg)[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            h, w = struct.unpack(">HH", data[1:5])
+            return w, h
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _ffprobe(path: str) -> Dict[str, Any]:
+    exe = shutil.which("ffprobe")
+    if exe is None:
+        return {"kind": "media", "note": "ffprobe not found"}
+    proc = subprocess.run(
+        [exe, "-v", "error", "-show_entries", "format=duration:stream=codec_type,width,height,nb_frames", "-of", "json", path],
+        capture_output=True,
+        timeout=60,
+    )
+    if proc.returncode != 0:
+        return {"error": proc.stderr.decode("utf-8", "replace").strip()[:200]}
+    info = json.loads(proc.stdout or b"{}")
+    out: Dict[str, Any] = {"kind": "audio"}
+    try:
+        out["duration"] = round(float(info.get("format", {}).get("duration")), 3)
+    except (TypeError, ValueError):
+        pass
+    for st in info.get("streams") or []:
+        if st.get("codec_type") == "video":
+            out["kind"] = "video"
+            out["width"], out["height"] = st.get("width"), st.get("height")
+            if str(st.get("nb_frames") or "").isdigit():
+                out["frames"] = int(st["nb_frames"])
+            break
+    return out
@@ -0,0 +1,123 @@
+"""On-demand sampling profiler over every thread of the process (request handlers, job threads)."""
+
+from __future__ import annotations
+
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+
+MAX_SECONDS = 300.0
+MAX_STACK_DEPTH = 128
+
+# "job-3f2a...", "AnyIO worker thread 12" -> one flame graph root per kind of thread.
+_THREAD_SUFFIX = re.compile(r"([-_ ]?[0-9a-f]{8,}|[-_ ]?\(?\d+\)?)$")
+
+_running_lock = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+@dataclass
+class Profile:
+    seconds: float
+    interval: float
+    samples: int = 0
+    # "thread;outer;...;inner" -> sample count
+    stacks: Dict[str, int] = field(default_factory=dict)
+
+    def collapsed(self) -> str:
+        """
+        Brendan Gregg's collapsed-stack format (flamegraph.pl, speedscope, inferno).
+        """
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(self.stacks.items(), key=lambda kv: -kv[1]))
+
+    def top(self, limit: int = 50) -> str:
+        """
+        pstats-like table: samples where the function was on top of the stack (self) and
+        anywhere on it (cumulative).
+        """
+        own: Dict[str, int] = {}
+        cum: Dict[str, int] = {}
+        for stack, n in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own[frames[-1]] = own.get(frames[-1], 0) + n
+            for fn in set(frames):
+                cum[fn] = cum.get(fn, 0) + n
+        total = max(1, self.samples)
+        lines = [
+            f"{self.samples} samples over {self.seconds:.1f}s (every {self.interval * 1000:.0f} ms), all threads",
+            "",
+            f"{'self':>8} {'self%':>6} {'cum':>8} {'cum%':>6}  function",
+        ]
+        for fn, n in sorted(own.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]:
+            lines.append(f"{n:>8} {100 * n / total:>5.1f}% {cum[fn]:>8} {100 * cum[fn] / total:>5.1f}%  {fn}")
+        return "\n".join(lines) + "\n"
+
+
+def _frame_label(code: object) -> str:
+    filename = getattr(code, "co_filename", "?").replace("\\", "/")
+    # Trim to "package/module.py" so stacks stay readable.
+    short = "/".join(filename.rsplit("/", 2)[-2:])
+    return f"{getattr(code, 'co_name', '?')} ({short}:{getattr(code, 'co_firstlineno', 0)})"
+
+
+def _thread_label(name: str) -> str:
+    return _THREAD_SUFFIX.sub("", name).strip() or name
+
+
+def sample(seconds: float, interval: float = 0.005, stop: Optional[threading.Event] = None) -> Profile:
+    """
+    Sample every thread's stack (wall clock, so waiting threads count too) each `interval`
+    seconds for `seconds`. Nothing is hooked into the interpreter, so there is no cost
+    outside of a run. Only one run at a time (ProfilerBusy otherwise).
+    """
+    seconds = max(0.1, min(float(seconds), MAX_SECONDS))
+    interval = max(0.001, min(float(interval), 1.0))
+    if not _running_lock.acquire(blocking=False):
+        raise ProfilerBusy("a profile is already running")
+    try:
+        prof = Profile(seconds=seconds, interval=interval)
+        me = threading.get_ident()
+        thread_labels: Dict[str, str] = {}
+        # Cache code object -> label; id() is stable while the code object is alive.
+        code_labels: Dict[int, Tuple[object, str]] = {}
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            if stop is not None and stop.is_set():
+                break
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                parts: List[str] = []
+                f = frame
+                while f is not None and len(parts) < MAX_STACK_DEPTH:
+                    code = f.f_code
+                    hit = code_labels.get(id(code))
+                    if hit is None or hit[0] is not code:
+                        hit = (code, _frame_label(code))
+                        code_labels[id(code)] = hit
+                    parts.append(hit[1])
+                    f = f.f_back
+                raw = names.get(ident, "thread")
+                thread = thread_labels.get(raw)
+                if thread is None:
+                    thread = thread_labels[raw] = _thread_label(raw)
+                parts.append(thread)
+                parts.reverse()
+                key = ";".join(parts)
+                prof.stacks[key] = prof.stacks.get(key, 0) + 1
+                prof.samples += 1
+            time.sleep(interval)
+        prof.seconds = seconds - max(0.0, end - time.monotonic())
+        return prof
+    finally:
+        _running_lock.release()
@@ -1,26 +1,57 @@
 from __future__ import annotations
 
+import base64
 import json
+import os
 import threading
 import time
+import uuid
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
-from urllib.parse import unquote, urlparse
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote, urlparse
 
 import requests
 
+from . import metrics, tracing
 
-CREATE_URL = "https://www.runninghub.ai/task/webapp/create"
-HISTORY_URL = "https://www.runninghub.ai/api/output/v2/history"
-USERINFO_URL = "https://www.runninghub.ai/uc/getUserInfo"
-ORIGIN = "https://www.runninghub.ai"
+
+# RH_BASE_URL points every endpoint elsewhere, e.g. the local stand-in (run_fake_rh.py).
+BASE_URL = (os.environ.get("RH_BASE_URL") or "https://www.runninghub.ai").rstrip("/")
+CREATE_URL = f"{BASE_URL}/task/webapp/create"
+HISTORY_URL = f"{BASE_URL}/api/output/v2/history"
+USERINFO_URL = f"{BASE_URL}/uc/getUserInfo"
+UPLOAD_URL = f"{BASE_URL}/upload/image"
+ORIGIN = BASE_URL
 
 
 class StopRequested(RuntimeError):
     pass
 
 
+def _send(session: requests.Session, method: str, endpoint: str, url: str, *, bytes_out: int = 0, **kw: Any) -> requests.Response:
+    """
+    session.request() plus latency/status metrics and a trace span under `endpoint`.
+    For streamed responses the latency is time to headers.
+    """
+    # Only the path goes into the trace: upload query strings carry auth values.
+    with tracing.span(f"http {endpoint}", "http", method=method, path=urlparse(url).path) as sp:
+        started = time.monotonic()
+        try:
+            r = session.request(method, url, **kw)
+        except Exception:
+            metrics.HTTP_RESPONSES.inc(endpoint, "error")
+            raise
+        finally:
+            metrics.HTTP_SECONDS.observe(time.monotonic() - started, endpoint)
+        metrics.HTTP_RESPONSES.inc(endpoint, str(r.status_code))
+        sp["status"] = r.status_code
+        if bytes_out:
+            metrics.TRANSFER_BYTES.inc("upload", amount=bytes_out)
+            sp["bytes"] = bytes_out
+    return r
+
+
 def _sleep_with_stop(stop_event: Optional[threading.Event], seconds: float) -> None:
     if seconds <= 0:
         return
@@ -83,6 +114,27 @@ def extract_access_token(auth: ParsedAuth) -> str:
     return ""
 
 
+def parse_token_expiry(token: str) -> Optional[float]:
+    """
+    Return the `exp` claim (unix seconds) if the token is a JWT, else None.
+
+    The signature is not verified; this is only used to skip obviously dead tokens.
+    """
+    parts = (token or "").split(".")
+    if len(parts) != 3:
+        return None
+    seg = parts[1]
+    try:
+        raw = base64.urlsafe_b64decode(seg + "=" * (-len(seg) % 4))
+        claims = json.loads(raw.decode("utf-8"))
+    except Exception:
+        return None
+    exp = claims.get("exp") if isinstance(claims, dict) else None
+    if isinstance(exp, bool) or not isinstance(exp, (int, float)):
+        return None
+    return float(exp)
+
+
 def build_referer(payload: Dict[str, Any]) -> str:
     webapp_id = payload.get("webappId")
     if isinstance(webapp_id, str) and webapp_id.strip():
@@ -133,7 +185,79 @@ def get_user_info(
     """
     body = {"userId": str(user_id)}
     headers = make_headers(token, referer)
-    r = session.post(url, headers=headers, json=body, timeout=timeout)
+    r = _send(session, "POST", "userinfo", url, headers=headers, json=body, timeout=timeout)
+    r.raise_for_status()
+    return r.json()
+
+
+class MultipartFileBody:
+    """
+    Sized, iterable multipart/form-data body with a single file field.
+
+    requests sends it with a Content-Length header and pulls `chunks` lazily, so the
+    file never has to be buffered or re-read to build the request.
+    """
+
+    def __init__(self, field: str, filename: str, content_type: str, chunks: Iterable[bytes], size: int) -> None:
+        self.boundary = uuid.uuid4().hex
+        safe = (filename or "file.bin").replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+        self._head = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{safe}"\r\n'
+            f"Content-Type: {content_type or 'application/octet-stream'}\r\n\r\n"
+        ).encode("utf-8")
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("ascii")
+        self._chunks = chunks
+        self._size = int(size)
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return len(self._head) + self._size + len(self._tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._head
+        sent = 0
+        for chunk in self._chunks:
+            if not chunk:
+                continue
+            sent += len(chunk)
+            if sent > self._size:
+                raise ValueError("upload body larger than declared size")
+            yield chunk
+        if sent != self._size:
+            raise ValueError(f"upload body size mismatch: declared {self._size}, got {sent}")
+        yield self._tail
+
+
+def upload_file(
+    session: requests.Session,
+    token: str,
+    comfy_auth: str,
+    identify: str,
+    filename: str,
+    content_type: str,
+    chunks: Iterable[bytes],
+    size: int,
+    *,
+    referer: str = f"{ORIGIN}/",
+    url: str = UPLOAD_URL,
+    timeout: float = 60.0,
+) -> Dict[str, Any]:
+    """
+    POST /upload/image?Rh-Comfy-Auth=...&Rh-Identify=... with multipart field "image".
+
+    Both the query string and the rh-comfy-auth/rh-identify headers are sent, like the browser does.
+    """
+    body = MultipartFileBody("image", filename, content_type, chunks, size)
+    upload_url = f"{url}?Rh-Comfy-Auth={quote(comfy_auth, safe='')}&Rh-Identify={quote(identify, safe='')}"
+    headers = make_headers(token, referer)
+    headers["content-type"] = body.content_type
+    headers["rh-comfy-auth"] = comfy_auth
+    headers["rh-identify"] = identify
+    r = _send(session, "POST", "upload", upload_url, bytes_out=len(body), headers=headers, data=body, timeout=timeout)
     r.raise_for_status()
     return r.json()
 
@@ -144,10 +268,18 @@ def create(
     token: str,
     url: str = CREATE_URL,
     timeout: float = 25.0,
+    body: Optional[str] = None,
 ) -> Dict[str, Any]:
+    """
+    `body` is the already-serialized payload (e.g. a rendered template); `payload` is then
+    only used for the referer.
+    """
     referer = build_referer(payload)
     headers = make_headers(token, referer)
-    r = session.post(url, headers=headers, json=payload, timeout=timeout)
+    if body is not None:
+        r = _send(session, "POST", "create", url, headers=headers, data=body.encode("utf-8"), timeout=timeout)
+    else:
+        r = _send(session, "POST", "create", url, headers=headers, json=payload, timeout=timeout)
     r.raise_for_status()
     return r.json()
 
@@ -164,7 +296,7 @@ def history(
 ) -> Dict[str, Any]:
     body = {"size": size, "current": current, "taskType": ["WORKFLOW", "WEBAPP"], "fromId": from_id}
     headers = make_headers(token, referer)
-    r = session.post(url, headers=headers, json=body, timeout=timeout)
+    r = _send(session, "POST", "history", url, headers=headers, json=body, timeout=timeout)
     r.raise_for_status()
     return r.json()
 
@@ -199,6 +331,45 @@ def find_task_in_history(history_resp: Dict[str, Any], task_id: str) -> Optional
     return None
 
 
+_OUTPUT_URL_KEYS = ("fileUrl", "file_url")
+_OUTPUT_NAME_KEYS = ("outputName", "output_name", "fileName", "file_name")
+
+
+def collect_outputs(hit: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """
+    Every output of a history entry as (url, name), in order: the top-level fileUrl first,
+    then fileUrl entries of nested objects and URL lists (multi-output workflows). `name`
+    is "" when the entry has none. De-duplicated by URL.
+    """
+    out: List[Tuple[str, str]] = []
+    seen: set = set()
+
+    def add(url: Any, name: Any) -> None:
+        if isinstance(url, str) and url.startswith(("http://", "https://")) and url not in seen:
+            seen.add(url)
+            out.append((url, str(name or "").strip()))
+
+    def visit(node: Any, depth: int) -> None:
+        if depth > 4:
+            return
+        if isinstance(node, dict):
+            name = next((node[k] for k in _OUTPUT_NAME_KEYS if isinstance(node.get(k), str)), "")
+            for k in _OUTPUT_URL_KEYS:
+                add(node.get(k), name)
+            for k, v in node.items():
+                if isinstance(v, list) and k.lower().endswith("urls"):
+                    for url in v:
+                        add(url, "")
+                elif isinstance(v, (dict, list)):
+                    visit(v, depth + 1)
+        elif isinstance(node, list):
+            for v in node:
+                visit(v, depth + 1)
+
+    visit(hit, 0)
+    return out
+
+
 def safe_filename(name: str) -> str:
     bad = '<>:"/\\|?*\0'
     out = "".join("_" if c in bad else c for c in name)
@@ -231,18 +402,28 @@ def download_file(
     if path.exists() and not overwrite:
         return path
 
-    with session.get(url, stream=True, timeout=timeout) as r:
+    with tracing.span("download body", "io", file=path.name) as sp, _send(session, "GET", "download", url, stream=True, timeout=timeout) as r:
         r.raise_for_status()
         tmp = path.with_suffix(path.suffix + ".part")
-        with open(tmp, "wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 256):
-                if stop_event is not None and stop_event.is_set():
-                    raise StopRequested("stop requested")
-                if deadline_monotonic is not None and time.monotonic() >= deadline_monotonic:
-                    raise TimeoutError("job timeout")
-                if not chunk:
-                    continue
-                f.write(chunk)
+        received = 0
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in r.iter_content(chunk_size=1024 * 256):
+                    if stop_event is not None and stop_event.is_set():
+                        raise StopRequested("stop requested")
+                    if deadline_monotonic is not None and time.monotonic() >= deadline_monotonic:
+                        raise TimeoutError("job timeout")
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    received += len(chunk)
+        except BaseException:
+            # Stopped, timed out or broken: do not leave the partial file behind.
+            tmp.unlink(missing_ok=True)
+            raise
+        finally:
+            metrics.TRANSFER_BYTES.inc("download", amount=received)
+            sp["bytes"] = received
         tmp.replace(path)
     return path
 
@@ -260,45 +441,60 @@ def wait_for_output(
     history_url: str = HISTORY_URL,
     req_timeout: float = 25.0,
     stop_event: Optional[threading.Event] = None,
+    on_first_seen: Optional[Callable[[], None]] = None,
 ) -> Tuple[Optional[Dict[str, Any]], str]:
-    started = time.monotonic()
-    last_status = ""
-
-    while True:
-        if stop_event is not None and stop_event.is_set():
-            raise StopRequested("stop requested")
-
-        if time.monotonic() - started > timeout_sec:
-            return None, last_status
+    """
+    Poll history until the task reaches a final status. `on_first_seen` is called once,
+    the first time the task shows up in history.
+    """
+    with tracing.span("wait for output", "poll", taskId=task_id, polls=0, errors=0) as sp:
+        started = time.monotonic()
+        last_status = ""
 
-        hit: Optional[Dict[str, Any]] = None
-        for page in range(1, max(1, history_pages) + 1):
+        while True:
             if stop_event is not None and stop_event.is_set():
                 raise StopRequested("stop requested")
-            try:
-                h = history(
-                    session,
-                    token=token,
-                    referer=referer,
-                    current=page,
-                    size=history_size,
-                    from_id="",
-                    url=history_url,
-                    timeout=req_timeout,
-                )
-            except Exception:
-                continue
 
-            hit = find_task_in_history(h, task_id)
-            if hit is not None:
-                break
+            if time.monotonic() - started > timeout_sec:
+                return None, last_status
 
-        if hit is None:
-            _sleep_with_stop(stop_event, interval_sec)
-            continue
+            hit: Optional[Dict[str, Any]] = None
+            sp["polls"] += 1
+            for page in range(1, max(1, history_pages) + 1):
+                if stop_event is not None and stop_event.is_set():
+                    raise StopRequested("stop requested")
+                try:
+                    h = history(
+                        session,
+                        token=token,
+                        referer=referer,
+                        current=page,
+                        size=history_size,
+                        from_id="",
+                        url=history_url,
+                        timeout=req_timeout,
+                    )
+                except Exception:
+                    # Transient upstream errors are retried on the next page/round.
+                    sp["errors"] += 1
+                    continue
+
+                hit = find_task_in_history(h, task_id)
+                if hit is not None:
+                    break
+
+            if hit is None:
+                with tracing.span("sleep", "poll"):
+                    _sleep_with_stop(stop_event, interval_sec)
+                continue
+
+            if on_first_seen is not None:
+                on_first_seen()
+                on_first_seen = None
 
-        last_status = str(hit.get("taskStatus") or hit.get("status") or "")
-        if is_task_complete(last_status):
-            return hit, last_status
+            last_status = str(hit.get("taskStatus") or hit.get("status") or "")
+            if is_task_complete(last_status):
+                return hit, last_status
 
-        _sleep_with_stop(stop_event, interval_sec)
+            with tracing.span("sleep", "poll"):
+                _sleep_with_stop(stop_event, interval_sec)
@@ -26,7 +26,14 @@ const state = {
   resources: [],
   jobs: [],
   downloads: [],
-  settings: { jobTimeoutSec: 600, historyIntervalSec: 3.0, requestTimeoutSec: 25.0 },
+  cookieQuery: '',
+  cookieSort: '',
+  templateQuery: '',
+  templateOffset: 0,
+  // id -> full template (with payload); summaries in `templates` carry no payload.
+  templateCache: new Map(),
+  settings: { jobTimeoutSec: 600, historyIntervalSec: 3.0, requestTimeoutSec: 25.0, userInfoTtlSec: 300, userInfoConcurrency: 8, jobDedupeTtlSec: 600, jobConcurrency: 6, jobQueueDepth: 200, downloadConcurrency: 4, callbackSecret: '' },
+  queue: null,
 };
 
 function isObj(v) { return v && typeof v === 'object' && !Array.isArray(v); }
@@ -58,7 +65,37 @@ function isFileField(input) {
   return false;
 }
 
-function mountInputsTable(container, textarea, resources) {
+// Server-compiled slots (template.slots) describe payload.inputs by index; use them while
+// the edited payload still has the same inputs.
+function slotsFor(slots, inputs) {
+  if (!Array.isArray(slots) || !Array.isArray(inputs)) return null;
+  const byIndex = new Map();
+  for (const s of slots) {
+    const inp = inputs[s.index];
+    if (!isObj(inp) || String(inp.nodeId ?? '') !== s.nodeId || String(inp.fieldName ?? '') !== s.fieldName) return null;
+    byIndex.set(s.index, s);
+  }
+  return byIndex;
+}
+
+// { slotKey: value } for a payload that only differs from the template in input values,
+// otherwise null (send the full payload instead).
+function slotValuesFor(tpl, p) {
+  const base = tpl && tpl.payload;
+  const byIndex = slotsFor(tpl && tpl.slots, p && p.inputs);
+  if (!base || !byIndex || !Array.isArray(base.inputs) || base.inputs.length !== p.inputs.length) return null;
+  if (JSON.stringify({ ...p, inputs: null }) !== JSON.stringify({ ...base, inputs: null })) return null;
+  const values = {};
+  for (let i = 0; i < p.inputs.length; i++) {
+    const a = p.inputs[i], b = base.inputs[i];
+    if (!isObj(a) || !isObj(b)) { if (JSON.stringify(a) !== JSON.stringify(b)) return null; continue; }
+    if (JSON.stringify({ ...a, fieldValue: null }) !== JSON.stringify({ ...b, fieldValue: null })) return null;
+    if (JSON.stringify(a.fieldValue) !== JSON.stringify(b.fieldValue)) values[byIndex.get(i).key] = a.fieldValue;
+  }
+  return values;
+}
+
+function mountInputsTable(container, textarea, resources, slots) {
   container.innerHTML = '';
   const payloadObj = safeJsonParse(textarea.value);
   if (!payloadObj || !isObj(payloadObj)) {
@@ -72,6 +109,7 @@ function mountInputsTable(container, textarea, resources) {
   }
 
   const resNames = Array.isArray(resources) ? resources.map(r => r && r.name).filter(Boolean) : [];
+  const slotByIndex = slotsFor(slots, inputs);
   const table = el('table', { class: 'table' }, []);
   table.appendChild(el('thead', {}, [
     el('tr', {}, [
@@ -96,7 +134,9 @@ function mountInputsTable(container, textarea, resources) {
     tr.appendChild(el('td', { class: 'mono' }, [String(inp?.fieldName ?? '')]));
     tr.appendChild(el('td', { class: 'hint' }, [String(inp?.description ?? '')]));
 
-    const kind = guessInputKind(inp);
+    const slot = slotByIndex ? slotByIndex.get(idx) : null;
+    const kind = (slot && ['bool', 'num', 'json', 'text'].includes(slot.kind)) ? slot.kind : guessInputKind(inp);
+    const fileField = slot ? slot.kind === 'file' : isFileField(inp);
     let editor;
 
     if (kind === 'bool') {
@@ -146,7 +186,7 @@ function mountInputsTable(container, textarea, resources) {
     tr.appendChild(td);
 
     const tdRes = el('td');
-    if (isFileField(inp) && resNames.length) {
+    if (fileField && resNames.length) {
       const sel = el('select');
       sel.appendChild(el('option', { value: '' }, ['不替换']));
       resNames.forEach(n => sel.appendChild(el('option', { value: n }, [n])));
@@ -230,13 +270,14 @@ document.querySelectorAll('.navbtn').forEach(btn => {
 });
 
 async function refreshAll() {
-  const [t, c, r, j, d, s] = await Promise.all([
+  const [t, c, r, j, d, s, q] = await Promise.all([
     api('GET', '/api/templates'),
     api('GET', '/api/cookies'),
     api('GET', '/api/resources'),
     api('GET', '/api/jobs'),
     api('GET', '/api/downloads'),
     api('GET', '/api/settings'),
+    api('GET', '/api/queue'),
   ]);
   state.templates = t.templates || [];
   state.profiles = c.profiles || [];
@@ -244,6 +285,18 @@ async function refreshAll() {
   state.jobs = j.jobs || [];
   state.downloads = d.items || [];
   state.settings = s.settings || state.settings;
+  state.queue = q;
+}
+
+const TEMPLATE_PAGE_SIZE = 50;
+
+async function getTemplate(id) {
+  const summary = state.templates.find(x => x.id === id);
+  const hit = state.templateCache.get(id);
+  if (hit && (!summary || hit.updatedAt === summary.updatedAt)) return hit;
+  const r = await api('GET', `/api/templates/${encodeURIComponent(id)}`);
+  state.templateCache.set(id, r.template);
+  return r.template;
 }
 
 function renderTemplates() {
@@ -267,33 +320,77 @@ function renderTemplates() {
     return;
   }
 
+  // Search/paging runs server-side against the template index; payloads load on "编辑".
+  const q = el('input', { placeholder: '搜索名称/webappId/输入字段（空格分隔多个词）', value: state.templateQuery || '' });
+  const pager = el('div', { class: 'row' });
+  root.appendChild(el('div', { class: 'row', style: 'margin-top:10px;' }, [
+    el('div', { class: 'grow' }, [q]),
+    pager,
+  ]));
+
   const table = el('table', { class: 'table', style: 'margin-top:12px;' }, []);
   table.appendChild(el('thead', {}, [
     el('tr', {}, [
       el('th', {}, ['名称']),
       el('th', {}, ['webappId']),
+      el('th', {}, ['输入']),
       el('th', {}, ['更新']),
       el('th', {}, ['操作']),
     ])
   ]));
   const tb = el('tbody');
-
-  state.templates.forEach(t => {
-    const tr = el('tr');
-    tr.appendChild(el('td', {}, [t.name || t.id]));
-    tr.appendChild(el('td', { class: 'mono' }, [String(t.webappId || '')]));
-    tr.appendChild(el('td', {}, [fmtTime(t.updatedAt)]));
-    const ops = el('td', {}, [
-      el('div', { class: 'row' }, [
-        el('button', { class: 'btn', onclick: () => openTemplateEditor(t) }, ['编辑']),
-        el('button', { class: 'btn danger', onclick: () => deleteTemplate(t.id) }, ['删除']),
-      ])
-    ]);
-    tr.appendChild(ops);
-    tb.appendChild(tr);
-  });
   table.appendChild(tb);
   root.appendChild(table);
+
+  let seq = 0;
+  async function reload() {
+    state.templateQuery = q.value;
+    const mine = ++seq;
+    const params = new URLSearchParams({ q: q.value.trim(), offset: String(state.templateOffset), limit: String(TEMPLATE_PAGE_SIZE) });
+    const r = await api('GET', `/api/templates?${params.toString()}`);
+    if (mine !== seq) return;
+    renderRows(r.templates || [], r.total || 0);
+  }
+
+  let timer = null;
+  q.addEventListener('input', () => {
+    clearTimeout(timer);
+    timer = setTimeout(() => { state.templateOffset = 0; reload(); }, 200);
+  });
+
+  function renderRows(list, total) {
+    tb.innerHTML = '';
+    if (!list.length) {
+      tb.appendChild(el('tr', {}, [el('td', { colspan: '5', class: 'hint' }, ['无匹配模板。'])]));
+    }
+    list.forEach(t => {
+      const tr = el('tr');
+      tr.appendChild(el('td', {}, [t.name || t.id]));
+      tr.appendChild(el('td', { class: 'mono' }, [String(t.webappId || '')]));
+      tr.appendChild(el('td', { class: 'hint' }, [(t.fields || []).join(', ')]));
+      tr.appendChild(el('td', {}, [fmtTime(t.updatedAt)]));
+      const ops = el('td', {}, [
+        el('div', { class: 'row' }, [
+          el('button', { class: 'btn', onclick: async () => openTemplateEditor(await getTemplate(t.id)) }, ['编辑']),
+          el('button', { class: 'btn danger', onclick: () => deleteTemplate(t.id) }, ['删除']),
+        ])
+      ]);
+      tr.appendChild(ops);
+      tb.appendChild(tr);
+    });
+
+    const off = state.templateOffset;
+    pager.innerHTML = '';
+    pager.appendChild(el('span', { class: 'hint' }, [total ? `${off + 1}-${off + list.length} / ${total}` : '0']));
+    const prev = el('button', { class: 'btn', onclick: () => { state.templateOffset = Math.max(0, off - TEMPLATE_PAGE_SIZE); reload(); } }, ['上一页']);
+    const next = el('button', { class: 'btn', onclick: () => { state.templateOffset = off + TEMPLATE_PAGE_SIZE; reload(); } }, ['下一页']);
+    prev.disabled = off <= 0;
+    next.disabled = off + list.length >= total;
+    pager.appendChild(prev);
+    pager.appendChild(next);
+  }
+
+  reload();
 }
 
 function openTemplateEditor(tpl) {
@@ -323,7 +420,7 @@ function openTemplateEditor(tpl) {
         class: 'btn',
         onclick: () => {
           inputsBox.style.display = 'block';
-          mountInputsTable(inputsBox, payload, state.resources);
+          mountInputsTable(inputsBox, payload, state.resources, init.slots);
         }
       }, ['渲染 inputs 表格']),
       el('div', { class: 'hint' }, ['表格编辑会实时回写 JSON。'])
@@ -357,13 +454,47 @@ async function deleteTemplate(id) {
   render();
 }
 
+// Large libraries: exports download as files (streamed by the server) and imports send the
+// chosen file as-is, so the browser never parses or re-serializes the whole library.
+function exportBox(path, stem, hint) {
+  const ta = el('textarea', { spellcheck: 'false', style: 'display:none' });
+  return el('div', {}, [
+    el('div', { class: 'hint' }, [hint]),
+    el('div', { class: 'row', style: 'margin:10px 0;' }, [
+      el('a', { class: 'btn', href: `${path}?download=1`, download: `${stem}.json` }, ['下载 JSON']),
+      el('a', { class: 'btn', href: `${path}?format=ndjson&download=1`, download: `${stem}.ndjson` }, ['下载 NDJSON']),
+      el('button', { class: 'btn ghost', onclick: async () => {
+        ta.value = pretty(await api('GET', path));
+        ta.style.display = 'block';
+      } }, ['在此显示']),
+    ]),
+    ta,
+  ]);
+}
+
+function importFileRow(path) {
+  const fileInput = el('input', { type: 'file', accept: '.json,.ndjson,.jsonl,.txt' });
+  return el('div', { class: 'row', style: 'margin-top:10px;' }, [
+    el('div', { class: 'grow' }, [el('div', { class: 'label' }, ['或从文件导入（.json / .ndjson，适合大文件）']), fileInput]),
+    el('button', { class: 'btn warn', onclick: async () => {
+      const f = fileInput.files && fileInput.files[0];
+      if (!f) { alert('请选择文件'); return; }
+      const ndjson = /\.(ndjson|jsonl)$/i.test(f.name);
+      setStatus('importing...');
+      const r = await fetch(path, { method: 'POST', headers: { 'content-type': ndjson ? 'application/x-ndjson' : 'application/json' }, body: f });
+      const text = await r.text();
+      const j = safeJsonParse(text);
+      if (!r.ok) { setStatus(''); throw new Error((j && j.detail) ? j.detail : `HTTP ${r.status}: ${text}`); }
+      setStatus(`导入完成：${j.imported ?? j.added ?? 0} 条`);
+      await refreshAll();
+      closeModal();
+      render();
+    } }, ['从文件导入']),
+  ]);
+}
+
 async function exportTemplates() {
-  const data = await api('GET', '/api/templates/export');
-  const text = pretty(data);
-  showModal('导出模板', el('div', {}, [
-    el('div', { class: 'hint' }, ['复制或保存为 JSON 文件。']),
-    el('textarea', { spellcheck: 'false' }, [text])
-  ]));
+  showModal('导出模板', exportBox('/api/templates/export', 'templates', '下载为 JSON / NDJSON 文件，或在此显示后复制。'));
 }
 
 async function importTemplates() {
@@ -384,7 +515,8 @@ async function importTemplates() {
           render();
         }
       }, ['导入'])
-    ])
+    ]),
+    importFileRow('/api/templates/import'),
   ]);
   showModal('导入模板', box);
 }
@@ -400,6 +532,7 @@ function renderCookies() {
   const tools = el('div', { class: 'row', style: 'margin-top:10px;' }, [
     el('button', { class: 'btn warn', onclick: () => importCookies() }, ['导入 cookies']),
     el('button', { class: 'btn', onclick: () => exportCookies() }, ['导出 cookies（multi）']),
+    el('button', { class: 'btn good', onclick: (e) => refreshAllUserInfo(e.currentTarget) }, ['全部刷新积分']),
   ]);
   root.appendChild(tools);
 
@@ -408,33 +541,77 @@ function renderCookies() {
     return;
   }
 
+  // Filtering/sorting runs server-side against the slim profile summaries.
+  const q = el('input', { placeholder: '筛选名称/host/userId', value: state.cookieQuery || '' });
+  const sort = el('select', {}, [
+    el('option', { value: '' }, ['默认顺序']),
+    el('option', { value: '-coin' }, ['积分从高到低']),
+    el('option', { value: 'coin' }, ['积分从低到高']),
+  ]);
+  sort.value = state.cookieSort || '';
+  root.appendChild(el('div', { class: 'row', style: 'margin-top:10px;' }, [
+    el('div', { class: 'grow' }, [q]),
+    sort,
+  ]));
+
   const table = el('table', { class: 'table', style: 'margin-top:12px;' }, []);
   table.appendChild(el('thead', {}, [
     el('tr', {}, [
       el('th', {}, ['名称']),
       el('th', {}, ['host']),
       el('th', {}, ['积分(totalCoin)']),
+      el('th', {}, ['状态']),
       el('th', {}, ['操作']),
     ])
   ]));
   const tb = el('tbody');
 
-  state.profiles.forEach(p => {
-    const tr = el('tr');
-    tr.appendChild(el('td', {}, [p.name || p.id]));
-    tr.appendChild(el('td', { class: 'mono' }, [String(p.host || '')]));
-    tr.appendChild(el('td', { class: 'mono' }, [String((p && p.totalCoin !== undefined && p.totalCoin !== null && String(p.totalCoin).trim()) ? p.totalCoin : '-')]));
-    tr.appendChild(el('td', {}, [
-      el('div', { class: 'row' }, [
-        el('button', { class: 'btn', onclick: () => previewCookie(p) }, ['查看']),
-        el('button', { class: 'btn good', onclick: (e) => refreshUserInfo(p.id, e.currentTarget) }, ['刷新']),
-        el('button', { class: 'btn danger', onclick: () => deleteCookie(p.id) }, ['删除']),
-      ])
-    ]));
-    tb.appendChild(tr);
-  });
+  let seq = 0;
+  async function reload() {
+    state.cookieQuery = q.value;
+    state.cookieSort = sort.value;
+    const mine = ++seq;
+    const params = new URLSearchParams({ q: q.value.trim(), sort: sort.value });
+    const r = await api('GET', `/api/cookies?${params.toString()}`);
+    if (mine !== seq) return;
+    renderRows(r.profiles || []);
+  }
+
+  let timer = null;
+  q.addEventListener('input', () => { clearTimeout(timer); timer = setTimeout(reload, 200); });
+  sort.addEventListener('change', reload);
+
+  function renderRows(list) {
+    tb.innerHTML = '';
+    if (!list.length) {
+      tb.appendChild(el('tr', {}, [el('td', { colspan: '5', class: 'hint' }, ['无匹配 profile。'])]));
+      return;
+    }
+    list.forEach(p => tb.appendChild(cookieRow(p)));
+  }
+
   table.appendChild(tb);
   root.appendChild(table);
+  if (q.value.trim() || sort.value) reload();
+  else renderRows(state.profiles);
+}
+
+function cookieRow(p) {
+  const tr = el('tr');
+  tr.appendChild(el('td', {}, [p.name || p.id]));
+  tr.appendChild(el('td', { class: 'mono' }, [String(p.host || '')]));
+  tr.appendChild(el('td', { class: 'mono' }, [String((p && p.totalCoin !== undefined && p.totalCoin !== null && String(p.totalCoin).trim()) ? p.totalCoin : '-')]));
+  tr.appendChild(p.problem
+    ? el('td', { class: 'hint', style: 'color:#b91c1c' }, [String(p.problem)])
+    : el('td', { class: 'hint' }, [p.tokenExpiresAt ? `token 有效至 ${fmtTime(p.tokenExpiresAt)}` : '-']));
+  tr.appendChild(el('td', {}, [
+    el('div', { class: 'row' }, [
+      el('button', { class: 'btn', onclick: () => previewCookie(p) }, ['查看']),
+      el('button', { class: 'btn good', onclick: (e) => refreshUserInfo(p.id, e.currentTarget) }, ['刷新']),
+      el('button', { class: 'btn danger', onclick: () => deleteCookie(p.id) }, ['删除']),
+    ])
+  ]));
+  return tr;
 }
 
 async function refreshUserInfo(profileId, btn) {
@@ -455,8 +632,58 @@ async function refreshUserInfo(profileId, btn) {
   }
 }
 
+async function readNdjson(r, onItem) {
+  // Consume an application/x-ndjson response line by line as it arrives.
+  const reader = r.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, { stream: true });
+    let i;
+    while ((i = buf.indexOf('\n')) >= 0) {
+      const line = buf.slice(0, i).trim();
+      buf = buf.slice(i + 1);
+      const j = line ? safeJsonParse(line) : null;
+      if (j) onItem(j);
+    }
+  }
+  const rest = buf.trim() ? safeJsonParse(buf.trim()) : null;
+  if (rest) onItem(rest);
+}
+
+async function refreshAllUserInfo(btn, force = false) {
+  const b = btn;
+  try {
+    if (b) { b.disabled = true; b.textContent = '刷新中...'; }
+    setStatus('refresh all...');
+    const r = await fetch('/api/cookies/refresh-all', {
+      method: 'POST',
+      headers: { 'content-type': 'application/json' },
+      body: JSON.stringify({ force }),
+    });
+    if (!r.ok) throw new Error(`HTTP ${r.status}: ${await r.text()}`);
+    let summary = null;
+    await readNdjson(r, (j) => {
+      if (j.done === true) { summary = j; return; }
+      setStatus(`刷新积分 ${j.done}/${j.total}`);
+    });
+    await refreshAll();
+    render();
+    if (summary) setStatus(`刷新完成：${summary.refreshed} 个更新，${summary.failed} 个失败，共 ${summary.total} 个`);
+  } catch (e) {
+    setStatus(String(e && e.message ? e.message : e));
+    alert(String(e && e.message ? e.message : e));
+  } finally {
+    if (b) { b.disabled = false; b.textContent = '全部刷新积分'; }
+  }
+}
+
 async function previewCookie(p) {
-  const rec = p.record || {};
+  // List endpoints only carry summaries; fetch the full record on demand.
+  const r = await api('GET', `/api/cookies/${p.id}`);
+  const rec = (r.profile && r.profile.record) || {};
   showModal('查看 cookies profile', el('div', {}, [
     el('div', { class: 'hint' }, ['该对象会被后端解析为 Cookie/localStorage，并用于请求 create/history。']),
     el('textarea', { spellcheck: 'false' }, [pretty({ host: p.host, record: rec })])
@@ -471,10 +698,7 @@ async function deleteCookie(id) {
 }
 
 async function exportCookies() {
-  const data = await api('GET', '/api/cookies/export');
-  showModal('导出 cookies（multi）', el('div', {}, [
-    el('textarea', { spellcheck: 'false' }, [pretty(data)])
-  ]));
+  showModal('导出 cookies（multi）', exportBox('/api/cookies/export', 'multicookies', 'multicookies.txt 格式；NDJSON 为每行一个 {host, record}。'));
 }
 
 async function importCookies() {
@@ -495,11 +719,139 @@ async function importCookies() {
           render();
         }
       }, ['导入'])
-    ])
+    ]),
+    importFileRow('/api/cookies/import'),
   ]);
   showModal('导入 cookies', box);
 }
 
+// crypto.subtle needs the whole file in memory; only pre-hash files up to this size.
+const PREHASH_MAX_BYTES = 64 * 1024 * 1024;
+
+async function sha256Hex(file) {
+  if (!window.crypto || !crypto.subtle || file.size > PREHASH_MAX_BYTES) return '';
+  try {
+    const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+  } catch {
+    return '';
+  }
+}
+
+// Files above this go through a resumable session (PUT chunks), so a dropped connection
+// only costs the current chunk.
+const CHUNKED_UPLOAD_MIN_BYTES = PREHASH_MAX_BYTES;
+const UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024;
+const UPLOAD_CHUNK_RETRIES = 5;
+
+async function uploadResourceFileChunked(profileId, webappId, f, onProgress) {
+  const created = await api('POST', '/api/resources/upload-sessions', {
+    profileId,
+    webappId: webappId || '',
+    filename: f.name,
+    contentType: f.type || '',
+    size: f.size,
+    clientKey: `${f.name}:${f.size}:${f.lastModified}`,
+  });
+  if (created.deduped) return { ok: true, resource: created.resource, deduped: true };
+  const sid = created.session.id;
+  let received = created.session.received || 0;
+
+  let failures = 0;
+  while (received < f.size) {
+    const end = Math.min(f.size, received + UPLOAD_CHUNK_BYTES);
+    try {
+      const r = await fetch(`/api/resources/upload-sessions/${sid}?offset=${received}`, {
+        method: 'PUT',
+        headers: { 'content-type': 'application/octet-stream' },
+        body: f.slice(received, end),
+      });
+      const text = await r.text();
+      const j = safeJsonParse(text);
+      if (!r.ok) throw new Error((j && j.detail) ? j.detail : `HTTP ${r.status}: ${text}`);
+      received = j.received;
+      failures = 0;
+      if (onProgress) onProgress(received, f.size);
+    } catch (e) {
+      if (++failures > UPLOAD_CHUNK_RETRIES) throw e;
+      await new Promise(res => setTimeout(res, Math.min(15000, 1000 * 2 ** (failures - 1))));
+      // Resume from what the server actually has.
+      try { received = (await api('GET', `/api/resources/upload-sessions/${sid}`)).session.received; } catch {}
+    }
+  }
+  return api('POST', `/api/resources/upload-sessions/${sid}/finalize`);
+}
+
+async function uploadResourceFile(profileId, webappId, f, onProgress) {
+  if (f.size > CHUNKED_UPLOAD_MIN_BYTES) return uploadResourceFileChunked(profileId, webappId, f, onProgress);
+
+  // Known bytes for this profile: reuse the existing resource without sending the file.
+  const sha256 = await sha256Hex(f);
+  if (sha256) {
+    const hit = await api('GET', `/api/resources/lookup?${new URLSearchParams({ sha256, profileId }).toString()}`);
+    if (hit.resource) return { ok: true, resource: hit.resource, deduped: true };
+  }
+
+  // Fields must precede the file part: the server streams the file as it arrives.
+  const fd = new FormData();
+  fd.append('profileId', profileId);
+  fd.append('webappId', webappId || '');
+  fd.append('size', String(f.size));
+  if (sha256) fd.append('sha256', sha256);
+  fd.append('file', f);
+
+  const r = await fetch('/api/resources/upload', { method: 'POST', body: fd });
+  const text = await r.text();
+  const j = safeJsonParse(text);
+  if (!r.ok) throw new Error((j && j.detail) ? j.detail : `HTTP ${r.status}: ${text}`);
+  return j;
+}
+
+async function uploadResourceFilesBulk(profileIds, webappId, files, onFile) {
+  const fd = new FormData();
+  fd.append('profileIds', profileIds.join(','));
+  fd.append('webappId', webappId || '');
+  files.forEach(f => fd.append('file', f));
+
+  const r = await fetch('/api/resources/upload-bulk', { method: 'POST', body: fd });
+  if (!r.ok) {
+    const text = await r.text();
+    const j = safeJsonParse(text);
+    throw new Error((j && j.detail) ? j.detail : `HTTP ${r.status}: ${text}`);
+  }
+  let summary = { total: files.length, failed: 0 };
+  await readNdjson(r, (j) => {
+    if (j.done === true) summary = j;
+    else onFile(j);
+  });
+  return summary;
+}
+
+function replicateResource(r) {
+  const sel = el('select', { multiple: 'multiple', size: '8' });
+  state.profiles
+    .filter(p => p && p.id && p.id !== r.profileId)
+    .forEach(p => sel.appendChild(el('option', { value: p.id }, [`${p.name || p.id} (${p.host || ''})`])));
+  showModal('同步资源到其他 profile', el('div', {}, [
+    el('div', { class: 'hint' }, ['由服务端用本地副本重新上传，浏览器不再传输文件。已有相同内容的 profile 会直接复用。']),
+    sel,
+    el('div', { class: 'row', style: 'justify-content:flex-end;margin-top:10px' }, [
+      el('button', { class: 'btn ghost', onclick: closeModal }, ['取消']),
+      el('button', { class: 'btn good', onclick: async () => {
+        const profileIds = Array.from(sel.selectedOptions).map(o => o.value);
+        if (!profileIds.length) { alert('请选择 profile'); return; }
+        setStatus('replicating...');
+        const j = await api('POST', `/api/resources/${r.id}/replicate`, { profileIds });
+        const failed = (j.results || []).filter(x => !x.ok).length;
+        setStatus(`同步完成：${profileIds.length - failed} 成功，${failed} 失败`);
+        await refreshAll();
+        closeModal();
+        render();
+      } }, ['同步'])
+    ])
+  ]));
+}
+
 function renderResources() {
   const root = $('#view-resources');
   root.innerHTML = '';
@@ -508,21 +860,26 @@ function renderResources() {
     '仿照 runninghub.js：上传任意文件到 RunningHub（upload/image），响应返回的 name 会写入资源库。生成时可从表格右侧“资源库”列一键替换上传字段。'
   ]));
 
-  const profSel = el('select');
-  state.profiles.forEach(p => profSel.appendChild(el('option', { value: p.id }, [`${p.name || p.id} (${p.host || ''})`])));
+  const profSel = el('select', { multiple: 'multiple', size: '4' });
+  state.profiles.forEach((p, i) => {
+    const opt = el('option', { value: p.id }, [`${p.name || p.id} (${p.host || ''})`]);
+    if (i === 0) opt.selected = true;
+    profSel.appendChild(opt);
+  });
 
   const tplSel = el('select');
   tplSel.appendChild(el('option', { value: '' }, ['(可选) 选择模板用于 referrer/webappId']));
   state.templates.forEach(t => tplSel.appendChild(el('option', { value: t.id }, [t.name || t.id])));
 
-  const fileInput = el('input', { type: 'file' });
+  const fileInput = el('input', { type: 'file', multiple: 'multiple' });
 
   const uploadBtn = el('button', {
     class: 'btn good',
     onclick: async () => {
-      const f = fileInput.files && fileInput.files[0];
-      if (!f) { alert('请选择文件'); return; }
-      if (!profSel.value) { alert('请选择 cookies profile'); return; }
+      const files = Array.from(fileInput.files || []);
+      const profileIds = Array.from(profSel.selectedOptions).map(o => o.value).filter(Boolean);
+      if (!files.length) { alert('请选择文件'); return; }
+      if (!profileIds.length) { alert('请选择 cookies profile'); return; }
 
       let webappId = '';
       if (tplSel.value) {
@@ -530,21 +887,24 @@ function renderResources() {
         webappId = String(t?.webappId || t?.payload?.webappId || '').trim();
       }
 
-      const fd = new FormData();
-      fd.append('profileId', profSel.value);
-      fd.append('webappId', webappId);
-      fd.append('file', f);
-
       setStatus('uploading...');
-      const r = await fetch('/api/resources/upload', { method: 'POST', body: fd });
-      const text = await r.text();
-      const j = safeJsonParse(text);
-      if (!r.ok) {
+      try {
+        if (files.length === 1 && profileIds.length === 1) {
+          const j = await uploadResourceFile(profileIds[0], webappId, files[0], (done, total) => {
+            setStatus(`uploading ${(done / 1048576).toFixed(0)}/${(total / 1048576).toFixed(0)} MB`);
+          });
+          setStatus(`${j.deduped ? 'reused' : 'uploaded'}: ${j.resource?.name || ''}`);
+        } else {
+          const summary = await uploadResourceFilesBulk(profileIds, webappId, files, (j) => {
+            setStatus(`uploading ${j.done}/${j.total}: ${j.filename}${j.ok ? '' : '（失败）'}`);
+          });
+          setStatus(`上传完成：${summary.total} 个文件，${summary.failed} 个失败`);
+        }
+      } catch (e) {
         setStatus('');
-        throw new Error((j && j.detail) ? j.detail : `HTTP ${r.status}: ${text}`);
+        throw e;
       }
 
-      setStatus(`uploaded: ${j.resource?.name || ''}`);
       await refreshAll();
       render();
     }
@@ -552,20 +912,19 @@ function renderResources() {
 
   root.appendChild(el('div', { class: 'card' }, [
     el('div', { class: 'row' }, [
-      el('div', { class: 'grow' }, [el('div', { class: 'label' }, ['Cookies profile（用于 auth）']), profSel]),
+      el('div', { class: 'grow' }, [el('div', { class: 'label' }, ['Cookies profile（用于 auth，可多选）']), profSel]),
       el('div', { class: 'grow' }, [el('div', { class: 'label' }, ['模板（用于 referrer，可选）']), tplSel]),
     ]),
     el('div', { class: 'row' }, [
-      el('div', { class: 'grow' }, [el('div', { class: 'label' }, ['选择文件']), fileInput]),
+      el('div', { class: 'grow' }, [el('div', { class: 'label' }, ['选择文件（可多选，并发上传）']), fileInput]),
       uploadBtn,
     ]),
     el('div', { class: 'hint' }, ['upload 需要 cookies 里的 Rh-Comfy-Auth + Rh-Identify（在 localStorage 中）。']),
   ]));
 
   const tools = el('div', { class: 'row', style: 'margin-top:10px;' }, [
-    el('button', { class: 'btn', onclick: async () => {
-      const data = await api('GET', '/api/resources/export');
-      showModal('导出资源库', el('div', {}, [el('textarea', { spellcheck: 'false' }, [pretty(data)])]));
+    el('button', { class: 'btn', onclick: () => {
+      showModal('导出资源库', exportBox('/api/resources/export', 'resources', '下载为 JSON / NDJSON 文件，或在此显示后复制。'));
     } }, ['导出资源库']),
     el('button', { class: 'btn warn', onclick: async () => {
       const ta = el('textarea', { spellcheck: 'false', placeholder: '粘贴 resources JSON（{resources:[...]} 或 [...]）' });
@@ -581,7 +940,8 @@ function renderResources() {
             closeModal();
             render();
           } }, ['导入'])
-        ])
+        ]),
+        importFileRow('/api/resources/import'),
       ]));
     } }, ['导入资源库']),
   ]);
@@ -619,6 +979,7 @@ function renderResources() {
         el('button', { class: 'btn', onclick: async () => {
           try { await navigator.clipboard.writeText(String(r.name || '')); setStatus('copied'); } catch { setStatus('copy failed'); }
         } }, ['复制 name']),
+        r.localPath ? el('button', { class: 'btn', onclick: () => replicateResource(r) }, ['同步到其他 profile']) : el('span'),
         el('button', { class: 'btn danger', onclick: async () => {
           if (!confirm('确认删除该资源记录？')) return;
           await api('DELETE', `/api/resources/${r.id}`);
@@ -649,29 +1010,41 @@ function renderGenerate() {
       .filter(j => j && (j.status === 'queued' || j.status === 'running') && j.profileId)
       .map(j => String(j.profileId))
   );
-  const availableProfiles = (state.profiles || []).filter(p => p && p.id && !inUse.has(String(p.id)));
+  // Also hide profiles whose token expired or whose last probe failed.
+  const availableProfiles = (state.profiles || []).filter(p => p && p.id && !inUse.has(String(p.id)) && !p.problem);
   const profSel = el('select');
   availableProfiles.forEach(p => {
     const coin = (p && p.totalCoin !== undefined && p.totalCoin !== null && String(p.totalCoin).trim()) ? String(p.totalCoin).trim() : '-';
     profSel.appendChild(el('option', { value: p.id }, [(p.name || p.id) + ' (' + (p.host || '') + ') [剩余积分: ' + coin + ']']));
   });
 
-  const payload = el('textarea', { spellcheck: 'false' }, [
-    state.templates[0] ? pretty(state.templates[0].payload || {}) : '{}'
-  ]);
+  const payload = el('textarea', { spellcheck: 'false' }, ['{}']);
   const inputsBox = el('div', { class: 'card', style: 'display:none' });
 
-  tplSel.addEventListener('change', () => {
-    const t = state.templates.find(x => x.id === tplSel.value);
+  async function loadPayload() {
+    const id = tplSel.value;
+    const t = id ? await getTemplate(id) : null;
+    if (tplSel.value !== id) return;
     payload.value = pretty((t && t.payload) ? t.payload : {});
     inputsBox.style.display = 'none';
     inputsBox.innerHTML = '';
-  });
+  }
+  tplSel.addEventListener('change', loadPayload);
+  loadPayload();
 
   const noAuth = el('select', {}, [
     el('option', { value: '0' }, ['发送 Authorization（推荐）']),
     el('option', { value: '1' }, ['不发送 Authorization（仅 Cookie）'])
   ]);
+  const reroute = el('select', {}, [
+    el('option', { value: '1' }, ['失效时自动换用其他 cookies']),
+    el('option', { value: '0' }, ['失效时直接失败'])
+  ]);
+  const priority = el('select', {}, [
+    el('option', { value: 'normal' }, ['普通']),
+    el('option', { value: 'high' }, ['高（插队）']),
+    el('option', { value: 'low' }, ['低'])
+  ]);
 
   const btn = el('button', {
     class: 'btn good',
@@ -679,9 +1052,14 @@ function renderGenerate() {
       const p = safeJsonParse(payload.value);
       if (!p || typeof p !== 'object') { alert('payload 不是合法 JSON 对象'); return; }
       if (!tplSel.value || !profSel.value) { alert('请选择模板和 cookies'); return; }
-      const body = { templateId: tplSel.value, profileId: profSel.value, payload: p, noAuth: noAuth.value === '1' };
+      // dedupe: a double-click (or re-submit of the same payload) attaches to the running job.
+      const body = { templateId: tplSel.value, profileId: profSel.value, noAuth: noAuth.value === '1', reroute: reroute.value === '1', dedupe: true, priority: priority.value };
+      // Only input values changed: let the server render its compiled template.
+      const slotValues = slotValuesFor(await getTemplate(tplSel.value), p);
+      if (slotValues) body.slotValues = slotValues;
+      else body.payload = p;
       const r = await api('POST', '/api/jobs', body);
-      setStatus(`job started: ${r.job.id}`);
+      setStatus(r.coalesced ? `相同任务已在运行/刚完成，复用: ${r.job.id}` : `job started: ${r.job.id}`);
       await refreshAll();
       setView('jobs');
       render();
@@ -693,6 +1071,8 @@ function renderGenerate() {
       el('div', { class: 'grow' }, [el('div', { class: 'label' }, ['模板']), tplSel]),
       el('div', { class: 'grow' }, [el('div', { class: 'label' }, ['Cookies profile']), profSel]),
       el('div', { class: 'grow' }, [el('div', { class: 'label' }, ['鉴权方式']), noAuth]),
+      el('div', { class: 'grow' }, [el('div', { class: 'label' }, ['cookies 失效']), reroute]),
+      el('div', { class: 'grow' }, [el('div', { class: 'label' }, ['优先级']), priority]),
     ]),
     (availableProfiles.length === 0 && (state.profiles || []).length > 0) ? el('div', { class: 'hint', style: 'margin-top:10px;color:#b91c1c' }, [
       '当前没有可用 cookies：所有 cookies 都正在被运行/排队中的任务占用。'
@@ -702,9 +1082,10 @@ function renderGenerate() {
     el('div', { class: 'row', style: 'justify-content:space-between;margin-top:10px;' }, [
       el('button', {
         class: 'btn',
-        onclick: () => {
+        onclick: async () => {
           inputsBox.style.display = 'block';
-          mountInputsTable(inputsBox, payload, state.resources);
+          const t = tplSel.value ? await getTemplate(tplSel.value) : null;
+          mountInputsTable(inputsBox, payload, state.resources, t && t.slots);
         }
       }, ['渲染 inputs 表格']),
       el('div', { class: 'hint' }, ['表格编辑会实时回写 JSON。'])
@@ -736,8 +1117,13 @@ function renderJobs() {
   root.appendChild(el('div', { class: 'h1' }, ['任务']));
 
   const tools = el('div', { class: 'row', style: 'justify-content:space-between;margin-top:6px;' }, [
-    el('div', { class: 'hint' }, ['自动刷新：每 3 秒']),
-    el('button', { class: 'btn', onclick: async () => { await refreshAll(); render(); } }, ['手动刷新']),
+    el('div', { class: 'hint' }, [
+      '自动刷新：每 3 秒' + (state.queue ? ` | 队列：${state.queue.queued} 排队 / ${state.queue.active} 运行（并发 ${state.queue.concurrency}），预计等待 ${Math.round(state.queue.estimatedWaitSec || 0)} 秒` : '')
+    ]),
+    el('div', { class: 'row' }, [
+      el('button', { class: 'btn danger', onclick: () => cancelJobs({ all: true }, '取消全部排队/运行中的任务？') }, ['全部取消']),
+      el('button', { class: 'btn', onclick: async () => { await refreshAll(); render(); } }, ['手动刷新']),
+    ]),
   ]);
   root.appendChild(tools);
 
@@ -751,7 +1137,7 @@ function renderJobs() {
       el('div', { class: 'row', style: 'justify-content:space-between;' }, [
         el('div', {}, [
           el('div', { style: 'font-weight:900' }, [`${j.templateName || j.templateId}  /  ${j.profileName || j.profileId}`]),
-          el('div', { class: 'hint' }, [`jobId: ${j.id} | 创建: ${fmtTime(j.createdAt)} | 更新: ${fmtTime(j.updatedAt)}`]),
+          el('div', { class: 'hint' }, [`jobId: ${j.id}${j.batchId ? ` | 批次: ${j.batchId}` : ''}${j.worker ? ` | worker: ${j.worker}` : ''}${j.chainParent ? ` | 上一步: ${j.chainParent}` : ''}${j.chainNext ? ` | 下一步: ${j.chainNext}` : ''}${j.chain && j.chain.length && !j.chainNext ? ` | 待续 ${j.chain.length} 步` : ''} | 创建: ${fmtTime(j.createdAt)} | 更新: ${fmtTime(j.updatedAt)}`]),
         ]),
         pill(j)
       ]),
@@ -766,7 +1152,12 @@ function renderJobs() {
         ]),
       ]),
       el('div', { class: 'row', style: 'margin-top:10px;justify-content:flex-end;' }, [
-        j.downloadPath ? el('a', { class: 'btn good', href: j.downloadPath, target: '_blank' }, ['下载文件']) : el('span', { class: 'hint' }, ['暂无下载文件']),
+        j.downloadPath ? el('a', { class: 'btn good', href: j.downloadPath, target: '_blank' }, [(j.downloadPaths || []).length > 1 ? '下载文件 1' : '下载文件']) : el('span', { class: 'hint' }, ['暂无下载文件']),
+        ...(j.downloadPaths || []).slice(1).map((u, i) => el('a', { class: 'btn good', href: u, target: '_blank' }, [`下载文件 ${i + 2}`])),
+        (j.status === 'queued' || j.status === 'running') ? el('button', { class: 'btn danger', onclick: () => cancelJob(j.id) }, ['取消']) : el('span'),
+        ((j.status === 'queued' || j.status === 'running') && j.batchId) ? el('button', { class: 'btn danger', onclick: () => cancelJobs({ batchId: j.batchId }, `取消批次 ${j.batchId} 中所有未完成的任务？`) }, ['取消批次']) : el('span'),
+        el('a', { class: 'btn ghost', href: `/api/jobs/${encodeURIComponent(j.id)}/trace?download=1`, title: '在 chrome://tracing 或 ui.perfetto.dev 中打开' }, ['Trace']),
+        j.batchId ? el('a', { class: 'btn ghost', href: `/api/jobs/trace?batchId=${encodeURIComponent(j.batchId)}&download=1` }, ['批次 Trace']) : el('span'),
         el('button', { class: 'btn', onclick: () => showJobLogs(j) }, ['日志']),
       ]),
       (j.extractedFiles && j.extractedFiles.length) ? el('div', { style: 'margin-top:10px' }, [
@@ -783,6 +1174,29 @@ function renderJobs() {
   });
 }
 
+async function cancelJob(id) {
+  try {
+    await api('POST', `/api/jobs/${encodeURIComponent(id)}/cancel`);
+    setStatus('已取消');
+  } catch (e) {
+    setStatus(String(e && e.message ? e.message : e));
+  }
+  await refreshAll();
+  render();
+}
+
+async function cancelJobs(filter, question) {
+  if (question && !confirm(question)) return;
+  try {
+    const r = await api('POST', '/api/jobs/cancel', filter);
+    setStatus(`已取消 ${r.count} 个任务`);
+  } catch (e) {
+    setStatus(String(e && e.message ? e.message : e));
+  }
+  await refreshAll();
+  render();
+}
+
 function showJobLogs(j) {
   showModal('任务日志', el('div', {}, [
     el('div', { class: 'hint' }, ['只展示本地 job 日志，不包含敏感 token/cookie。']),
@@ -884,6 +1298,18 @@ function renderDownloads() {
     return items;
   }
 
+  function postprocessSummary(pp) {
+    const parts = [];
+    const media = pp.media || {};
+    if (media.width && media.height) parts.push(`${media.width}×${media.height}`);
+    if (media.duration) parts.push(`${media.duration}s`);
+    if (media.frames) parts.push(`${media.frames} 帧`);
+    if (pp.sha256 && pp.sha256.sha256) parts.push(`sha256 ${pp.sha256.sha256.slice(0, 12)}…`);
+    const errors = Object.keys(pp).filter(k => k === 'error' || (pp[k] && pp[k].error));
+    if (errors.length) parts.push(`失败: ${errors.join(', ')}`);
+    return parts.join(' | ');
+  }
+
   const table = el('table', { class: 'table', style: 'margin-top:12px;' }, []);
   table.appendChild(el('thead', {}, [
     el('tr', {}, [
@@ -906,7 +1332,10 @@ function renderDownloads() {
 
     items.forEach(it => {
       const tr = el('tr');
-      tr.appendChild(el('td', { class: 'mono' }, [String(it.path || it.name || '')]));
+      tr.appendChild(el('td', { class: 'mono' }, [
+        String(it.path || it.name || ''),
+        it.postprocess ? el('div', { class: 'hint' }, [postprocessSummary(it.postprocess)]) : el('span'),
+      ]));
       tr.appendChild(el('td', { class: 'preview-cell' }, [buildInlinePreview(String(it.url || ''), String(it.path || it.name || ''))]));
       tr.appendChild(el('td', {}, [formatBytes(it.size)]));
       tr.appendChild(el('td', {}, [fmtTime(it.modifiedAt)]));
@@ -940,6 +1369,13 @@ function renderSettings() {
   const jobTimeout = el('input', { type: 'number', min: '30', max: String(24 * 3600), value: String(cur.jobTimeoutSec ?? 600) });
   const interval = el('input', { type: 'number', min: '0.5', max: '60', step: '0.5', value: String(cur.historyIntervalSec ?? 3.0) });
   const reqTimeout = el('input', { type: 'number', min: '3', max: '120', step: '1', value: String(cur.requestTimeoutSec ?? 25.0) });
+  const userInfoTtl = el('input', { type: 'number', min: '0', max: String(24 * 3600), value: String(cur.userInfoTtlSec ?? 300) });
+  const userInfoConcurrency = el('input', { type: 'number', min: '1', max: '32', value: String(cur.userInfoConcurrency ?? 8) });
+  const dedupeTtl = el('input', { type: 'number', min: '0', max: String(7 * 24 * 3600), value: String(cur.jobDedupeTtlSec ?? 600) });
+  const jobConcurrency = el('input', { type: 'number', min: '1', max: '64', value: String(cur.jobConcurrency ?? 6) });
+  const jobQueueDepth = el('input', { type: 'number', min: '1', max: '100000', value: String(cur.jobQueueDepth ?? 200) });
+  const downloadConcurrency = el('input', { type: 'number', min: '1', max: '16', value: String(cur.downloadConcurrency ?? 4) });
+  const callbackSecret = el('input', { type: 'text', value: String(cur.callbackSecret ?? ''), placeholder: '留空则不签名' });
 
   const saveBtn = el('button', {
     class: 'btn good',
@@ -948,6 +1384,13 @@ function renderSettings() {
         jobTimeoutSec: Number(jobTimeout.value),
         historyIntervalSec: Number(interval.value),
         requestTimeoutSec: Number(reqTimeout.value),
+        userInfoTtlSec: Number(userInfoTtl.value),
+        userInfoConcurrency: Number(userInfoConcurrency.value),
+        jobDedupeTtlSec: Number(dedupeTtl.value),
+        jobConcurrency: Number(jobConcurrency.value),
+        jobQueueDepth: Number(jobQueueDepth.value),
+        downloadConcurrency: Number(downloadConcurrency.value),
+        callbackSecret: callbackSecret.value.trim(),
       };
       const r = await api('PUT', '/api/settings', body);
       state.settings = r.settings || state.settings;
@@ -975,6 +1418,47 @@ function renderSettings() {
         reqTimeout,
         el('div', { class: 'hint' }, ['create/history/download 单次请求超时。'])
       ]),
+      el('div', { class: 'grow' }, [
+        el('div', { class: 'label' }, ['重复任务复用（秒）']),
+        dedupeTtl,
+        el('div', { class: 'hint' }, ['相同模板+cookies+payload（或相同 idempotencyKey）的提交会复用进行中的任务，或该时间内成功的结果。'])
+      ]),
+    ]),
+    el('div', { class: 'row', style: 'margin-top:10px' }, [
+      el('div', { class: 'grow' }, [
+        el('div', { class: 'label' }, ['积分缓存（秒）']),
+        userInfoTtl,
+        el('div', { class: 'hint' }, ['“全部刷新积分”时，该时间内刷新过的 profile 直接用缓存。'])
+      ]),
+      el('div', { class: 'grow' }, [
+        el('div', { class: 'label' }, ['积分刷新并发数']),
+        userInfoConcurrency,
+        el('div', { class: 'hint' }, ['同时请求 getUserInfo 的数量。'])
+      ]),
+    ]),
+    el('div', { class: 'row', style: 'margin-top:10px' }, [
+      el('div', { class: 'grow' }, [
+        el('div', { class: 'label' }, ['任务并发数']),
+        jobConcurrency,
+        el('div', { class: 'hint' }, ['同时运行（create/轮询/下载）的任务数，其余排队。'])
+      ]),
+      el('div', { class: 'grow' }, [
+        el('div', { class: 'label' }, ['队列长度上限']),
+        jobQueueDepth,
+        el('div', { class: 'hint' }, ['排队任务达到上限后，新提交返回 429 + Retry-After。'])
+      ]),
+    ]),
+    el('div', { class: 'row', style: 'margin-top:10px' }, [
+      el('div', { class: 'grow' }, [
+        el('div', { class: 'label' }, ['单任务下载并发数']),
+        downloadConcurrency,
+        el('div', { class: 'hint' }, ['一个任务有多个产出时，同时下载的文件数。'])
+      ]),
+      el('div', { class: 'grow' }, [
+        el('div', { class: 'label' }, ['回调签名密钥']),
+        callbackSecret,
+        el('div', { class: 'hint' }, ['任务完成回调（callbackUrl / batchCallbackUrl）带 X-RH-Signature: sha256=HMAC(密钥, "时间戳." + 请求体)。'])
+      ]),
     ]),
     el('div', { class: 'row', style: 'justify-content:flex-end;margin-top:12px;' }, [saveBtn]),
   ]));
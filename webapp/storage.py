@@ -3,8 +3,11 @@ from __future__ import annotations
 import json
 import os
 import threading
+import time
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Tuple
+
+from . import metrics
 
 
 _LOCKS: Dict[str, threading.Lock] = {}
@@ -21,9 +24,13 @@ def _lock_for(path: Path) -> threading.Lock:
         return lock
 
 
-def read_json(path: Path, default: Any) -> Any:
+def read_json(path: Path, default: Any, *, kind: str = "") -> Any:
+    """
+    `kind` labels the storage timing metric (defaults to the file stem).
+    """
     lock = _lock_for(path)
     with lock:
+        started = time.monotonic()
         try:
             if not path.exists():
                 return default
@@ -33,14 +40,29 @@ def read_json(path: Path, default: Any) -> Any:
             return json.loads(text)
         except Exception:
             return default
+        finally:
+            metrics.STORAGE_SECONDS.observe(time.monotonic() - started, "read", kind or path.stem)
 
 
-def write_json(path: Path, data: Any) -> None:
+def write_json(path: Path, data: Any, *, kind: str = "") -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     lock = _lock_for(path)
     with lock:
+        started = time.monotonic()
         tmp = path.with_suffix(path.suffix + ".tmp")
         text = json.dumps(data, ensure_ascii=False, indent=2)
         tmp.write_text(text, encoding="utf-8")
         os.replace(tmp, path)
+        metrics.STORAGE_SECONDS.observe(time.monotonic() - started, "write", kind or path.stem)
+
+
 
+def file_signature(path: Path) -> Tuple[int, int]:
+    """
+    Cheap change detector for derived caches: (mtime_ns, size), or (0, 0) if missing.
+    """
+    try:
+        st = path.stat()
+        return int(st.st_mtime_ns), int(st.st_size)
+    except Exception:
+        return 0, 0
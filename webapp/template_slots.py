@@ -0,0 +1,190 @@
+"""Compile template payloads into a JSON skeleton plus indexed input slots."""
+
+from __future__ import annotations
+
+import json
+import random
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Placeholder put in place of each fieldValue before serializing; json.dumps escapes the
+# NUL characters, so the marker cannot collide with real payload text.
+_MARK = "\x00slot{}\x00"
+
+SEED_MAX = 2**31 - 1
+
+
+def classify_input(inp: Dict[str, Any]) -> str:
+    """
+    Slot kind for one `payload.inputs[i]`: file, seed, bool, num, json or text.
+
+    Same heuristics as the inputs table in the UI (isFileField / guessInputKind).
+    """
+    fv = inp.get("fieldValue")
+    desc = str(inp.get("description") or "")
+    node_name = str(inp.get("nodeName") or "").lower()
+    field_name = str(inp.get("fieldName") or "").lower()
+
+    if "上传" in desc or "load" in node_name or field_name in ("video", "image", "file", "filename"):
+        return "file"
+    if "seed" in field_name or "seed" in node_name:
+        return "seed"
+    if isinstance(fv, bool):
+        return "bool"
+    if isinstance(fv, (int, float)):
+        return "num"
+    if isinstance(fv, (dict, list)):
+        return "json"
+
+    s = str(fv if fv is not None else "").strip().lower()
+    if ("boolean" in node_name or "boolean" in field_name) and s in ("true", "false"):
+        return "bool"
+    if ("int" in node_name or "float" in node_name) and s:
+        try:
+            float(s)
+            return "num"
+        except ValueError:
+            pass
+    if (s.startswith("{") and s.endswith("}")) or (s.startswith("[") and s.endswith("]")):
+        return "json"
+    return "text"
+
+
+def build_slots(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    One slot per input: {key, index, nodeId, nodeName, fieldName, description, kind, default}.
+
+    key is "nodeId:fieldName" ("...#index" when the pair repeats).
+    """
+    inputs = payload.get("inputs")
+    if not isinstance(inputs, list):
+        return []
+    slots: List[Dict[str, Any]] = []
+    seen: Dict[str, int] = {}
+    for i, inp in enumerate(inputs):
+        if not isinstance(inp, dict):
+            continue
+        key = f"{inp.get('nodeId', '')}:{inp.get('fieldName', '')}"
+        seen[key] = seen.get(key, 0) + 1
+        if seen[key] > 1:
+            key = f"{key}#{i}"
+        slots.append(
+            {
+                "key": key,
+                "index": i,
+                "nodeId": str(inp.get("nodeId") or ""),
+                "nodeName": str(inp.get("nodeName") or ""),
+                "fieldName": str(inp.get("fieldName") or ""),
+                "description": str(inp.get("description") or ""),
+                "kind": classify_input(inp),
+                "default": inp.get("fieldValue"),
+            }
+        )
+    return slots
+
+
+@dataclass
+class CompiledTemplate:
+    slots: List[Dict[str, Any]]
+    # len(slots) + 1 pieces of JSON text; slot values go between them.
+    segments: List[str]
+    # Pre-serialized default fieldValue per slot.
+    defaults_json: List[str]
+    by_key: Dict[str, int]
+
+
+def compile_payload(payload: Dict[str, Any], slots: Optional[List[Dict[str, Any]]] = None) -> CompiledTemplate:
+    if slots is None:
+        slots = build_slots(payload)
+    inputs = payload.get("inputs")
+    if not slots or not isinstance(inputs, list):
+        return CompiledTemplate([], [json.dumps(payload, ensure_ascii=False)], [], {})
+
+    marked = list(inputs)
+    for n, slot in enumerate(slots):
+        marked[slot["index"]] = dict(marked[slot["index"]], fieldValue=_MARK.format(n))
+    text = json.dumps(dict(payload, inputs=marked), ensure_ascii=False)
+
+    segments: List[str] = []
+    rest = text
+    for n in range(len(slots)):
+        head, sep, rest = rest.partition(json.dumps(_MARK.format(n)))
+        if not sep:
+            raise ValueError(f"slot {n} marker not found")
+        segments.append(head)
+    segments.append(rest)
+
+    by_key: Dict[str, int] = {}
+    for n, slot in enumerate(slots):
+        by_key[slot["key"]] = n
+        by_key.setdefault(str(slot["index"]), n)
+    defaults_json = [json.dumps(s.get("default"), ensure_ascii=False) for s in slots]
+    return CompiledTemplate(slots, segments, defaults_json, by_key)
+
+
+def coerce_slot_value(slot: Dict[str, Any], value: Any) -> Any:
+    """
+    Match the value to the type the template used for this field (RunningHub payloads
+    mostly carry numbers and booleans as strings). Seeds accept "random".
+    """
+    default = slot.get("default")
+    kind = slot.get("kind")
+    if kind == "seed" and isinstance(value, str) and value.strip().lower() == "random":
+        value = random.randint(0, SEED_MAX)
+    if kind == "json" and isinstance(default, (dict, list)) and isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    if isinstance(default, str) and not isinstance(value, str):
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False)
+        return "" if value is None else str(value)
+    if isinstance(default, bool) and isinstance(value, str):
+        return value.strip().lower() == "true"
+    if isinstance(default, (int, float)) and not isinstance(default, bool) and isinstance(value, str):
+        try:
+            num = float(value.strip())
+        except ValueError:
+            return value
+        return int(num) if isinstance(default, int) and num.is_integer() else num
+    return value
+
+
+def resolve_values(compiled: CompiledTemplate, values: Dict[str, Any]) -> Dict[int, Any]:
+    """
+    Map {slot key or input index: value} to {slot number: coerced value}. Unknown keys raise KeyError.
+    """
+    out: Dict[int, Any] = {}
+    for k, v in values.items():
+        n = compiled.by_key.get(str(k))
+        if n is None:
+            raise KeyError(str(k))
+        out[n] = coerce_slot_value(compiled.slots[n], v)
+    return out
+
+
+def render(compiled: CompiledTemplate, resolved: Dict[int, Any]) -> str:
+    """
+    Payload JSON text with the given slot values (defaults elsewhere), in one pass.
+    """
+    parts: List[str] = []
+    segments = compiled.segments
+    defaults_json = compiled.defaults_json
+    for n in range(len(compiled.slots)):
+        parts.append(segments[n])
+        parts.append(json.dumps(resolved[n], ensure_ascii=False) if n in resolved else defaults_json[n])
+    parts.append(segments[-1])
+    return "".join(parts)
+
+
+def slot_value(compiled: CompiledTemplate, resolved: Dict[int, Any], n: int) -> Tuple[Any, bool]:
+    """
+    (value, overridden) for slot n.
+    """
+    if n in resolved:
+        return resolved[n], True
+    return compiled.slots[n].get("default"), False
@@ -0,0 +1,130 @@
+"""Per-job span recording, exported in the Chrome Trace Event format (chrome://tracing, ui.perfetto.dev)."""
+
+from __future__ import annotations
+
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+
+# Oldest traces are dropped past this many; spans past the per-trace cap are counted, not kept.
+MAX_TRACES = 1000
+MAX_SPANS_PER_TRACE = 5000
+
+_current: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("rh_trace_id", default=None)
+
+_lock = threading.Lock()
+# trace id -> {"spans": [...], "dropped": int}
+_traces: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+def _now_us() -> int:
+    return time.time_ns() // 1000
+
+
+def add_span(trace_id: str, name: str, start_us: int, dur_us: int, cat: str = "", args: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Record a finished span. `start_us` is wall-clock microseconds.
+    """
+    span = {"name": name, "cat": cat, "ts": int(start_us), "dur": max(0, int(dur_us)), "args": dict(args or {})}
+    with _lock:
+        trace = _traces.get(trace_id)
+        if trace is None:
+            trace = {"spans": [], "dropped": 0}
+            _traces[trace_id] = trace
+            while len(_traces) > MAX_TRACES:
+                _traces.popitem(last=False)
+        if len(trace["spans"]) >= MAX_SPANS_PER_TRACE:
+            trace["dropped"] += 1
+        else:
+            trace["spans"].append(span)
+
+
+@contextmanager
+def bind(trace_id: str) -> Iterator[None]:
+    """
+    Attach spans opened in this thread (including rh_client HTTP calls) to `trace_id`.
+    """
+    token = _current.set(trace_id)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, cat: str = "", **args: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Time the block as a span of the bound trace. Yields the args dict so the block can add
+    counts (bytes, retries, status). A no-op when no trace is bound.
+    """
+    trace_id = _current.get()
+    if trace_id is None:
+        yield args
+        return
+    start_us = _now_us()
+    started = time.perf_counter()
+    try:
+        yield args
+    except BaseException as e:
+        args.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        add_span(trace_id, name, start_us, int((time.perf_counter() - started) * 1_000_000), cat, args)
+
+
+def pop(trace_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Remove and return a trace as {"spans": [...], "dropped": int} (for handing it to another process).
+    """
+    with _lock:
+        return _traces.pop(trace_id, None)
+
+
+def load(trace_id: str, trace: Dict[str, Any]) -> None:
+    """
+    Install a trace exported with pop(), replacing any spans recorded here under that id.
+    """
+    spans = [s for s in trace.get("spans") or [] if isinstance(s, dict)][:MAX_SPANS_PER_TRACE]
+    with _lock:
+        _traces[trace_id] = {"spans": spans, "dropped": int(trace.get("dropped") or 0)}
+        while len(_traces) > MAX_TRACES:
+            _traces.popitem(last=False)
+
+
+def has_trace(trace_id: str) -> bool:
+    with _lock:
+        return trace_id in _traces
+
+
+def chrome_trace(trace_ids: Iterable[str], labels: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Trace Event JSON for the given traces: one thread row per trace, complete ("X") events.
+    """
+    labels = labels or {}
+    events: List[Dict[str, Any]] = [{"name": "process_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": "runninghub jobs"}}]
+    dropped = 0
+    with _lock:
+        picked = [(tid, _traces.get(tid)) for tid in trace_ids]
+        picked = [(tid, {"spans": list(t["spans"]), "dropped": t["dropped"]}) for tid, t in picked if t is not None]
+    for row, (trace_id, trace) in enumerate(picked, start=1):
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": row, "args": {"name": labels.get(trace_id) or trace_id}})
+        events.append({"name": "thread_sort_index", "ph": "M", "pid": 1, "tid": row, "args": {"sort_index": row}})
+        dropped += trace["dropped"]
+        for s in trace["spans"]:
+            events.append(
+                {
+                    "name": s["name"],
+                    "cat": s["cat"] or "job",
+                    "ph": "X",
+                    "ts": s["ts"],
+                    "dur": s["dur"],
+                    "pid": 1,
+                    "tid": row,
+                    "args": dict(s["args"], traceId=trace_id),
+                }
+            )
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"traces": len(picked), "droppedSpans": dropped}}
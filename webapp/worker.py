@@ -0,0 +1,128 @@
+"""
+Headless job worker (run_worker.py): claims jobs from the shared queue (RH_JOB_QUEUE) and
+runs the same pipeline as the web app. Point RH_DATA_DIR / RH_DOWNLOAD_DIR at the volume
+the web app uses, so profiles, settings and downloads are shared.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, List
+
+from . import app, jobstore, tracing
+
+
+HEARTBEAT_SEC = 5.0
+IDLE_POLL_SEC = 1.0
+
+
+def _run_claimed(store: jobstore.JobStore, worker_id: str, job: Dict[str, Any], spec_dict: Dict[str, Any], stop: threading.Event) -> None:
+    job_id = str(job["id"])
+    # The final status is held back until the timeline is saved, so the webapp finds the
+    # trace and stage timings when it sees the job finish.
+    final: Dict[str, Any] = {}
+
+    def update(**kw: Any) -> None:
+        if final or kw.get("status") not in (None, "running"):
+            final.update(kw)
+            return
+        kw["updatedAt"] = app._now_iso()
+        if store.update(job_id, kw) == "cancelled":
+            stop.set()
+
+    def log(msg: str) -> None:
+        now = app._now_iso()
+        store.update(job_id, {"updatedAt": now}, log=f"[{now}] {msg}")
+
+    done = threading.Event()
+
+    def heartbeat() -> None:
+        # Keeps the claim alive and carries cancels from the web app to this worker.
+        while not done.wait(HEARTBEAT_SEC):
+            try:
+                status = store.heartbeat(job_id, worker_id)
+            except Exception:
+                continue
+            if status != "running":
+                stop.set()
+
+    threading.Thread(target=heartbeat, daemon=True, name=f"heartbeat-{job_id}").start()
+    stages: Dict[str, List[float]] = {}
+    enqueued = float(spec_dict.get("enqueuedAt") or 0)
+    if enqueued:
+        waited = max(0.0, time.time() - enqueued)
+        app._record_stage("queue", waited, stages)
+        tracing.add_span(job_id, "queue", int(enqueued * 1_000_000), int(waited * 1_000_000), "stage", {"priority": job.get("priority")})
+    try:
+        spec = app.JobSpec.from_dict(spec_dict)
+        log(f"claimed by worker {worker_id}")
+        with tracing.bind(job_id), tracing.span("run", "job", jobId=job_id, worker=worker_id):
+            app.run_job(spec, app.JobContext(update=update, log=log, stop=stop, stages=stages))
+    except Exception as e:
+        # Store unreachable or a broken spec; a lost heartbeat fails the job otherwise.
+        print(f"[worker] job {job_id} aborted: {e}")
+        update(status="failed", error=f"worker error: {e}")
+    finally:
+        trace = tracing.pop(job_id) or {"spans": [], "dropped": 0}
+        try:
+            store.save_trace(job_id, dict(trace, stages=stages))
+        except Exception as e:
+            print(f"[worker] job {job_id}: saving trace failed: {e}")
+        if final:
+            try:
+                store.update(job_id, dict(final, updatedAt=app._now_iso()))
+            except Exception:
+                pass
+        done.set()
+
+
+def serve(store: jobstore.JobStore, worker_id: str, concurrency: int) -> None:
+    """
+    Claim and run jobs, at most `concurrency` at a time, until interrupted (Ctrl+C), then
+    stop the running jobs like the web app does on shutdown.
+    """
+    slots = threading.BoundedSemaphore(concurrency)
+    lock = threading.Lock()
+    running: Dict[str, threading.Event] = {}
+    threads: List[threading.Thread] = []
+
+    def run(job: Dict[str, Any], spec: Dict[str, Any], stop: threading.Event) -> None:
+        try:
+            _run_claimed(store, worker_id, job, spec, stop)
+        finally:
+            with lock:
+                running.pop(str(job["id"]), None)
+            slots.release()
+
+    print(f"[worker] {worker_id}: queue={store.path} concurrency={concurrency}")
+    try:
+        while not app._shutdown_event.is_set():
+            if not slots.acquire(timeout=IDLE_POLL_SEC):
+                continue
+            try:
+                claimed = store.claim(worker_id, app._now_iso())
+            except Exception as e:
+                print(f"[worker] claim failed: {e}")
+                claimed = None
+            if claimed is None:
+                slots.release()
+                app._shutdown_event.wait(IDLE_POLL_SEC)
+                continue
+            job, spec = claimed
+            stop = threading.Event()
+            with lock:
+                running[str(job["id"])] = stop
+            t = threading.Thread(target=run, args=(job, spec, stop), daemon=True, name=f"job-{job['id']}")
+            t.start()
+            threads = [x for x in threads if x.is_alive()] + [t]
+    except KeyboardInterrupt:
+        pass
+    finally:
+        app._shutdown_event.set()
+        with lock:
+            for ev in running.values():
+                ev.set()
+        # Jobs notice the stop at their next check and record "cancelled: server shutdown".
+        for t in threads:
+            t.join(timeout=HEARTBEAT_SEC)